@@ -25,7 +25,9 @@ class ProductionConfig:
     # Performance Settings
     MISA_MAX_PAGES_PER_CYCLE = 2  # Limit for incremental
     TIKTOK_DAYS_BACK_BUFFER = 1   # 1 day buffer for incremental
+    TIKTOK_WATERMARK_OVERLAP_MINUTES = 15  # Đọc lại 15 phút trước watermark (update_time) cho cập nhật đến muộn
     BATCH_SIZE = 1000
+    MISA_LOAD_BATCH_SIZE = 10000  # Rows mỗi batch insert vào staging MISA
     
     # Monitoring Settings
     ENABLE_DETAILED_LOGGING = True
@@ -49,6 +51,11 @@ class ProductionConfig:
         "admin@facolos.com",
         "etl-team@facolos.com"
     ]
+    SMTP_HOST = os.getenv("SMTP_HOST", "")  # Trống = chỉ log alert, không gửi email
+    SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+    SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
+    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+    ALERT_EMAIL_SENDER = os.getenv("ALERT_EMAIL_SENDER", "etl-monitor@facolos.com")
     
     # Slack Alert Settings (Optional)
     ENABLE_SLACK_ALERTS = False
@@ -94,6 +94,8 @@ class Settings:
         self.api_timeout: int = int(os.getenv('API_TIMEOUT', '30'))
         self.api_retry_attempts: int = int(os.getenv('API_RETRY_ATTEMPTS', '3'))
         self.api_retry_delay: int = int(os.getenv('API_RETRY_DELAY', '5'))
+        self.tiktok_rps: float = float(os.getenv('TIKTOK_RPS', '10'))  # Token bucket dùng chung cho search + order details
+        self.tiktok_burst: int = int(os.getenv('TIKTOK_BURST', '10'))
         
         # ========================
         # ETL SETTINGS
@@ -102,6 +104,16 @@ class Settings:
         self.etl_page_size: int = int(os.getenv('ETL_PAGE_SIZE', '50'))
         self.etl_max_days_back: int = int(os.getenv('ETL_MAX_DAYS_BACK', '30'))
         self.etl_default_frequency_hours: int = int(os.getenv('ETL_DEFAULT_FREQUENCY_HOURS', '6'))
+        self.etl_state_dir: str = os.getenv('ETL_STATE_DIR', 'state')
+        self.etl_commit_every: int = int(os.getenv('ETL_COMMIT_EVERY', '100000'))
+        self.etl_page_workers: int = int(os.getenv('ETL_PAGE_WORKERS', '4'))
+        self.etl_bulk_insert_dir: str = os.getenv('ETL_BULK_INSERT_DIR', '')  # Thư mục ETL ghi file CSV
+        self.etl_bulk_insert_server_dir: str = os.getenv('ETL_BULK_INSERT_SERVER_DIR', '')  # Cùng thư mục nhìn từ SQL Server
+        self.etl_bulk_insert_threshold: int = int(os.getenv('ETL_BULK_INSERT_THRESHOLD', '50000'))
+        self.etl_parallel_load_threshold: int = int(os.getenv('ETL_PARALLEL_LOAD_THRESHOLD', '100000'))
+        self.etl_parallel_load_workers: int = int(os.getenv('ETL_PARALLEL_LOAD_WORKERS', '4'))
+        self.etl_transform_workers: int = int(os.getenv('ETL_TRANSFORM_WORKERS', '4'))  # Processes cho transform_all_endpoints (<=1: tuần tự)
+        self.etl_api_cache_ttl_seconds: int = int(os.getenv('ETL_API_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
         
         # ========================
         # LOGGING SETTINGS
@@ -135,13 +135,18 @@ def run_incremental_etl(**context):
             tiktok_transformer = TikTokShopOrderTransformer()
             tiktok_loader = TikTokShopOrderLoader()
             
-            raw_orders = tiktok_extractor.extract_recent_orders(days_back=1)
+            raw_orders = tiktok_extractor.extract_recent_orders(
+                days_back=1,
+                use_watermark=True,
+                overlap_minutes=ProductionConfig.TIKTOK_WATERMARK_OVERLAP_MINUTES
+            )
             
             if raw_orders:
                 transformed_df = tiktok_transformer.transform_orders_to_dataframe(raw_orders)
                 success = tiktok_loader.load_incremental_orders(transformed_df)
                 
                 if success:
+                    tiktok_extractor.commit_watermark()
                     records_count = len(transformed_df)
                     results['tiktok_shop']['orders'] = records_count
                     results['total_records'] += records_count
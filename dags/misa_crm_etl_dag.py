@@ -19,9 +19,8 @@ import os
 sys.path.append('/opt/airflow/dags')
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.extractors.misa_crm_extractor import MISACRMExtractor
-from src.transformers.misa_crm_transformer import MISACRMTransformer
-from src.loaders.misa_crm_loader import MISACRMLoader
+# ETL components (pandas, requests, sqlalchemy) are imported inside the tasks,
+# so the scheduler's frequent DAG parsing doesn't load them
 from config.settings import settings
 import uuid
 
@@ -53,6 +52,10 @@ def run_misa_crm_incremental_etl(**context):
     logger = logging.getLogger(__name__)
     logger.info("🔄 Starting MISA CRM Incremental ETL")
 
+    from src.extractors.misa_crm_extractor import MISACRMExtractor
+    from src.transformers.misa_crm_transformer import MISACRMTransformer
+    from src.loaders.misa_crm_loader import MISACRMLoader
+
     try:
         # Initialize ETL components
         batch_id = str(uuid.uuid4())
@@ -118,6 +121,10 @@ def run_misa_crm_full_etl(**context):
     logger = logging.getLogger(__name__)
     logger.info("🚀 Starting MISA CRM Full ETL (Backfill)")
 
+    from src.extractors.misa_crm_extractor import MISACRMExtractor
+    from src.transformers.misa_crm_transformer import MISACRMTransformer
+    from src.loaders.misa_crm_loader import MISACRMLoader
+
     try:
         # Initialize ETL components
         batch_id = str(uuid.uuid4())
@@ -12,16 +12,14 @@ from airflow.models import Variable
 import logging
 import json
 import os
-import pandas as pd
 
 # Import các module ETL của chúng ta - TikTok Shop specific
 import sys
 import os
 sys.path.append('/opt/airflow')
 
-from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
-from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
-from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
+# Extractor/transformer/loader (kéo theo pandas, requests, sqlalchemy) import trong từng task:
+# Airflow parse file DAG liên tục, không cần load các thư viện nặng mỗi lần parse
 from src.utils.logging import setup_logging
 
 # Thiết lập logging cho TikTok Shop
@@ -64,6 +62,7 @@ def extract_tiktok_shop_orders(**context) -> str:
         days_back = Variable.get('tiktok_shop_extraction_days_back', default_var=1)
         
         # Khởi tạo TikTok Shop extractor
+        from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
         shop_extractor = TikTokShopOrderExtractor()
         
         # Kiểm tra kết nối TikTok Shop API trước
@@ -110,6 +109,7 @@ def transform_tiktok_shop_orders(**context) -> str:
             return "Không có đơn hàng TikTok Shop để chuyển đổi"
             
         # Khởi tạo TikTok Shop transformer
+        from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
         transformer = TikTokShopOrderTransformer()
         
         # Chuyển đổi đơn hàng TikTok Shop thành DataFrame
@@ -154,6 +154,8 @@ def load_tiktok_shop_orders(**context) -> str:
             return "Không có dữ liệu TikTok Shop để tải"
             
         # Đọc DataFrame TikTok Shop
+        import pandas as pd
+        from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
         shop_df = pd.read_parquet(temp_file)
         
         if shop_df.empty:
@@ -201,6 +203,7 @@ def test_tiktok_shop_api_connection(**context) -> str:
     try:
         logger.info("Đang kiểm tra kết nối TikTok Shop API...")
         
+        from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
         extractor = TikTokShopOrderExtractor()
         
         if not extractor.test_api_connection():
@@ -223,6 +226,7 @@ def test_database_connection(**context) -> str:
     try:
         logger.info("Đang kiểm tra kết nối database cho TikTok Shop...")
         
+        from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
         loader = TikTokShopOrderLoader()
         
         if not loader.test_connection():
@@ -9,7 +9,8 @@ Thực hiện backfill dữ liệu cho tất cả 6 staging tables trong một l
 
 import sys
 import os
-import pandas as pd
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 
@@ -17,13 +18,7 @@ from typing import Dict, List, Any
 sys.path.append('.')
 
 from config.settings import settings
-from src.extractors.misa_crm_extractor import MISACRMExtractor
-from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
-from src.transformers.misa_crm_transformer import MISACRMTransformer
-from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
-from src.loaders.misa_crm_loader import MISACRMLoader
-from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
-from src.utils.logging import setup_logging
+from src.utils.logging import setup_logging, disable_unused_record_fields
 
 logger = setup_logging("complete_backfill")
 
@@ -32,8 +27,9 @@ class CompleteBackfillOrchestrator:
     Orchestrates complete backfill cho tất cả 6 staging tables
     """
     
-    def __init__(self, days_back: int = 30):
+    def __init__(self, days_back: int = 30, resume: bool = False):
         self.days_back = days_back
+        self.resume = resume
         self.end_date = datetime.now()
         self.start_date = self.end_date - timedelta(days=days_back)
         
@@ -52,21 +48,66 @@ class CompleteBackfillOrchestrator:
             'tiktok_shop': {},
             'summary': {}
         }
+        
+        # Checkpoint file để resume khi backfill bị gián đoạn
+        self.state_path = os.path.join(settings.etl_state_dir, 'backfill_results.json')
+    
+    def _save_results(self):
+        """Ghi self.results xuống disk (atomic rename) sau mỗi bước hoàn thành"""
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.results, f, default=str, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not persist backfill state: {e}")
+    
+    def _load_results(self):
+        """Nạp kết quả của lần chạy trước từ checkpoint file (nếu có)"""
+        if not os.path.exists(self.state_path):
+            logger.info("   No previous backfill state found, starting fresh")
+            return
+        
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.results['misa_crm'] = saved.get('misa_crm', {})
+            self.results['tiktok_shop'] = saved.get('tiktok_shop', {})
+            logger.info(f"♻️ Resuming from {self.state_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load backfill state, starting fresh: {e}")
     
     def initialize_components(self) -> bool:
-        """Initialize all ETL components"""
+        """Initialize API clients (extractors) - đủ để test kết nối, chưa import pandas"""
         try:
-            logger.info("🔧 Initializing ETL components...")
+            logger.info("🔧 Initializing API clients...")
+            
+            from src.extractors.misa_crm_extractor import MISACRMExtractor
+            from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
             
-            # MISA CRM components
-            logger.info("   Initializing MISA CRM components...")
             self.misa_extractor = MISACRMExtractor()
+            self.tiktok_extractor = TikTokShopOrderExtractor()
+            
+            logger.info("✅ API clients initialized successfully")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize components: {e}")
+            return False
+    
+    def initialize_pipeline_components(self) -> bool:
+        """Import và khởi tạo transformers/loaders (pandas) chỉ khi API đã kết nối được"""
+        try:
+            logger.info("🔧 Initializing transformers and loaders...")
+            
+            from src.transformers.misa_crm_transformer import MISACRMTransformer
+            from src.loaders.misa_crm_loader import MISACRMLoader
+            from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
+            from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
+            
             self.misa_transformer = MISACRMTransformer()
             self.misa_loader = MISACRMLoader()
-            
-            # TikTok Shop components
-            logger.info("   Initializing TikTok Shop components...")
-            self.tiktok_extractor = TikTokShopOrderExtractor()
             self.tiktok_transformer = TikTokShopOrderTransformer()
             self.tiktok_loader = TikTokShopOrderLoader()
             
@@ -82,17 +123,25 @@ class CompleteBackfillOrchestrator:
         try:
             logger.info("🔌 Testing API connections...")
             
+            # Hai API độc lập - kiểm tra song song để không phải chờ tuần tự
+            logger.info("   Testing MISA CRM API and TikTok Shop API...")
+            executor = ThreadPoolExecutor(max_workers=2)
+            try:
+                future_misa = executor.submit(self.misa_extractor.get_access_token)
+                future_tiktok = executor.submit(self.tiktok_extractor.test_api_connection)
+                misa_token = self._probe_result(future_misa, 'MISA CRM')
+                tiktok_health = self._probe_result(future_tiktok, 'TikTok Shop')
+            finally:
+                # Không chờ probe bị treo (with-block sẽ join thread)
+                executor.shutdown(wait=False)
+            
             # Test MISA CRM connection
-            logger.info("   Testing MISA CRM API...")
-            misa_token = self.misa_extractor.get_access_token()
             if not misa_token:
                 logger.error("❌ MISA CRM API connection failed")
                 return False
             logger.info("✅ MISA CRM API connection successful")
             
             # Test TikTok Shop connection
-            logger.info("   Testing TikTok Shop API...")
-            tiktok_health = self.tiktok_extractor.test_api_connection()
             if not tiktok_health:
                 logger.error("❌ TikTok Shop API connection failed")
                 return False
@@ -104,12 +153,21 @@ class CompleteBackfillOrchestrator:
             logger.error(f"❌ API connection test failed: {e}")
             return False
     
+    @staticmethod
+    def _probe_result(future, api_name: str, timeout: float = 15):
+        """Kết quả probe kết nối; quá timeout -> coi như kết nối thất bại"""
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.error(f"❌ {api_name} API connection test timed out after {timeout}s")
+            return None
+    
     def backfill_misa_crm_data(self) -> Dict[str, Any]:
         """Complete MISA CRM backfill for all 5 endpoints"""
         logger.info("🏢 Starting MISA CRM complete backfill...")
         logger.info(f"   Date range: {self.start_date.strftime('%Y-%m-%d')} to {self.end_date.strftime('%Y-%m-%d')}")
         
-        misa_results = {}
+        misa_results = self.results['misa_crm']
         
         # MISA CRM endpoints with priority order
         endpoints = [
@@ -123,28 +181,59 @@ class CompleteBackfillOrchestrator:
         # Sort by priority
         endpoints.sort(key=lambda x: x['priority'])
         
+        already_loaded = {name for name, result in misa_results.items() if result.get('status') == 'success'}
+        
+        # Tất cả endpoints load trong 1 transaction, commit 1 lần ở cuối.
+        # Checkpoint chỉ ghi sau commit để --resume không bỏ qua dữ liệu đã bị rollback
+        self.misa_loader.begin(commit_every=settings.etl_commit_every)
+        try:
+            self._backfill_misa_endpoints(endpoints, misa_results)
+            self.misa_loader.commit()
+        except Exception:
+            self.misa_loader.rollback()
+            # Endpoints đã qua commit trung gian vẫn nằm trong DB -> giữ 'success' để --resume không load lại
+            committed_tables = self.misa_loader.committed_endpoints
+            for endpoint in endpoints:
+                result = misa_results.get(endpoint['name'], {})
+                if (endpoint['name'] not in already_loaded and result.get('status') == 'success'
+                        and endpoint['table'] not in committed_tables):
+                    result['status'] = 'rolled_back'
+            self._save_results()
+            raise
+        
+        self._save_results()
+        return misa_results
+    
+    def _backfill_misa_endpoints(self, endpoints: List[Dict[str, Any]], misa_results: Dict[str, Any]):
+        """Extract → transform → load từng MISA endpoint trong transaction đang mở"""
+        import pandas as pd
+        
         for endpoint in endpoints:
             endpoint_name = endpoint['name']
             table_name = endpoint['table']
             
+            if misa_results.get(endpoint_name, {}).get('status') == 'success':
+                logger.info("⏭️ Skipping %s (already loaded in previous run)", endpoint_name)
+                continue
+            
             try:
-                logger.info(f"\n📋 Priority {endpoint['priority']}: {endpoint['description']}")
-                logger.info(f"📊 Processing MISA CRM {endpoint_name} → staging.misa_{table_name}")
+                logger.info("\n📋 Priority %s: %s", endpoint['priority'], endpoint['description'])
+                logger.info("📊 Processing MISA CRM %s → staging.misa_%s", endpoint_name, table_name)
                 logger.info("-" * 60)
                 
                 # STEP 1: EXTRACT
-                logger.info(f"   🔄 Extracting {endpoint_name}...")
+                logger.info("   🔄 Extracting %s...", endpoint_name)
                 raw_data = self.misa_extractor.extract_all_data_from_endpoint(endpoint_name, max_pages=3)
                 
                 if not raw_data:
-                    logger.warning(f"⚠️ No data extracted for {endpoint_name}")
+                    logger.warning("⚠️ No data extracted for %s", endpoint_name)
                     misa_results[endpoint_name] = {'status': 'no_data', 'records': 0}
                     continue
                 
-                logger.info(f"   ✅ Extracted {len(raw_data):,} {endpoint_name} records")
+                logger.info("   ✅ Extracted %s %s records", f"{len(raw_data):,}", endpoint_name)
                 
                 # STEP 2: TRANSFORM
-                logger.info(f"   🔄 Transforming {endpoint_name}...")
+                logger.info("   🔄 Transforming %s...", endpoint_name)
                 
                 if endpoint_name == 'sale_orders':
                     # Use flattened transformer for sale orders
@@ -156,15 +245,15 @@ class CompleteBackfillOrchestrator:
                 
                 # Convert to DataFrame
                 df = pd.DataFrame(transformed_data)
-                logger.info(f"   ✅ Transformed to {len(df):,} records")
+                logger.info("   ✅ Transformed to %s records", f"{len(df):,}")
                 
                 # STEP 3: LOAD
-                logger.info(f"   🔄 Loading to staging.misa_{table_name}...")
+                logger.info("   🔄 Loading to staging.misa_%s...", table_name)
                 success = self.misa_loader.load_dataframe_to_staging(df, table_name)
                 
                 if success:
                     records_loaded = len(df)
-                    logger.info(f"   ✅ {endpoint_name}: {records_loaded:,} records loaded successfully")
+                    logger.info("   ✅ %s: %s records loaded successfully", endpoint_name, f"{records_loaded:,}")
                     misa_results[endpoint_name] = {
                         'status': 'success',
                         'extracted': len(raw_data),
@@ -172,7 +261,7 @@ class CompleteBackfillOrchestrator:
                         'loaded': records_loaded
                     }
                 else:
-                    logger.error(f"   ❌ {endpoint_name}: Load failed")
+                    logger.error("   ❌ %s: Load failed", endpoint_name)
                     misa_results[endpoint_name] = {
                         'status': 'load_failed',
                         'extracted': len(raw_data),
@@ -180,13 +269,11 @@ class CompleteBackfillOrchestrator:
                     }
                 
             except Exception as e:
-                logger.error(f"❌ Error processing {endpoint_name}: {e}")
+                logger.error("❌ Error processing %s: %s", endpoint_name, e)
                 misa_results[endpoint_name] = {
                     'status': 'error',
                     'error': str(e)
                 }
-        
-        return misa_results
     
     def backfill_tiktok_shop_data(self) -> Dict[str, Any]:
         """Complete TikTok Shop backfill"""
@@ -203,12 +290,12 @@ class CompleteBackfillOrchestrator:
                 logger.warning("⚠️ No TikTok Shop orders extracted")
                 return {'status': 'no_data', 'records': 0}
             
-            logger.info(f"   ✅ Extracted {len(raw_orders):,} TikTok Shop orders")
+            logger.info("   ✅ Extracted %s TikTok Shop orders", f"{len(raw_orders):,}")
             
             # STEP 2: TRANSFORM
             logger.info("   🔄 Transforming TikTok Shop orders...")
             transformed_df = self.tiktok_transformer.transform_orders_to_dataframe(raw_orders)
-            logger.info(f"   ✅ Transformed to {len(transformed_df):,} records")
+            logger.info("   ✅ Transformed to %s records", f"{len(transformed_df):,}")
             
             # STEP 3: LOAD
             logger.info("   🔄 Loading to staging.tiktok_shop_order_detail...")
@@ -216,7 +303,7 @@ class CompleteBackfillOrchestrator:
             
             if success:
                 records_loaded = len(transformed_df)
-                logger.info(f"   ✅ TikTok Shop: {records_loaded:,} records loaded successfully")
+                logger.info("   ✅ TikTok Shop: %s records loaded successfully", f"{records_loaded:,}")
                 return {
                     'status': 'success',
                     'extracted': len(raw_orders),
@@ -224,7 +311,7 @@ class CompleteBackfillOrchestrator:
                     'loaded': records_loaded
                 }
             else:
-                logger.error(f"   ❌ TikTok Shop: Load failed")
+                logger.error("   ❌ TikTok Shop: Load failed")
                 return {
                     'status': 'load_failed',
                     'extracted': len(raw_orders),
@@ -232,7 +319,7 @@ class CompleteBackfillOrchestrator:
                 }
                 
         except Exception as e:
-            logger.error(f"❌ Error processing TikTok Shop data: {e}")
+            logger.error("❌ Error processing TikTok Shop data: %s", e)
             return {
                 'status': 'error',
                 'error': str(e)
@@ -312,6 +399,9 @@ class CompleteBackfillOrchestrator:
         logger.info("")
         
         try:
+            if self.resume:
+                self._load_results()
+            
             # Step 1: Initialize components
             if not self.initialize_components():
                 return False
@@ -320,6 +410,10 @@ class CompleteBackfillOrchestrator:
             if not self.test_api_connections():
                 return False
             
+            # Step 2b: Transformers/loaders (pandas) chỉ load khi thật sự chạy backfill
+            if not self.initialize_pipeline_components():
+                return False
+            
             # Step 3: Backfill MISA CRM data (5 tables)
             logger.info("\n" + "="*70)
             logger.info("🏢 PHASE 1: MISA CRM BACKFILL (5 TABLES)")
@@ -330,7 +424,11 @@ class CompleteBackfillOrchestrator:
             logger.info("\n" + "="*70)
             logger.info("🛒 PHASE 2: TIKTOK SHOP BACKFILL (1 TABLE)")
             logger.info("="*70)
-            self.results['tiktok_shop'] = self.backfill_tiktok_shop_data()
+            if self.results['tiktok_shop'].get('status') == 'success':
+                logger.info("⏭️ Skipping TikTok Shop (already loaded in previous run)")
+            else:
+                self.results['tiktok_shop'] = self.backfill_tiktok_shop_data()
+                self._save_results()
             
             # Step 5: Verify all data
             logger.info("\n" + "="*70)
@@ -347,6 +445,9 @@ class CompleteBackfillOrchestrator:
         except Exception as e:
             logger.error(f"❌ Complete backfill failed: {e}")
             return False
+        finally:
+            if self.misa_loader is not None:
+                self.misa_loader.close()
 
     def generate_final_summary(self):
         """Generate comprehensive final summary"""
@@ -356,24 +457,22 @@ class CompleteBackfillOrchestrator:
 
         # MISA CRM Summary
         logger.info("🏢 MISA CRM Results (5 Tables):")
-        total_misa_loaded = 0
-        successful_misa = 0
+        misa = self.results['misa_crm']
+        successes = [(k, v) for k, v in misa.items() if v.get('status') == 'success']
+        successful_misa = len(successes)
+        total_misa_loaded = sum(v.get('loaded', 0) for _, v in successes)
 
         misa_priority_order = ['sale_orders', 'customers', 'contacts', 'stocks', 'products']
 
         for endpoint in misa_priority_order:
-            if endpoint in self.results['misa_crm']:
-                result = self.results['misa_crm'][endpoint]
+            if endpoint in misa:
+                result = misa[endpoint]
                 status = result.get('status', 'unknown')
-                loaded = result.get('loaded', 0)
+                priority_mark = "⭐" if endpoint == 'sale_orders' else " "
 
                 if status == 'success':
-                    successful_misa += 1
-                    total_misa_loaded += loaded
-                    priority_mark = "⭐" if endpoint == 'sale_orders' else " "
-                    logger.info(f"   ✅{priority_mark} {endpoint}: {loaded:,} records loaded")
+                    logger.info(f"   ✅{priority_mark} {endpoint}: {result.get('loaded', 0):,} records loaded")
                 else:
-                    priority_mark = "⭐" if endpoint == 'sale_orders' else " "
                     logger.info(f"   ❌{priority_mark} {endpoint}: {status}")
 
         # TikTok Shop Summary
@@ -401,7 +500,7 @@ class CompleteBackfillOrchestrator:
         logger.info(f"   MISA CRM success: {successful_misa}/5 endpoints")
 
         # Priority check
-        sale_orders_success = self.results['misa_crm'].get('sale_orders', {}).get('status') == 'success'
+        sale_orders_success = misa.get('sale_orders', {}).get('status') == 'success'
         if sale_orders_success:
             logger.info("🎯 PRIORITY 1 SUCCESS: Sale Orders loaded!")
 
@@ -419,8 +518,18 @@ class CompleteBackfillOrchestrator:
             logger.info("\n⚠️ BACKFILL COMPLETED WITH ISSUES")
             logger.info("🔧 Please review and fix issues before production deployment")
 
-def main():
-    """Main function"""
+def run_complete_backfill(days_back: int = 30, test: bool = False, resume: bool = False) -> bool:
+    """Programmatic entrypoint (Airflow, scripts) - không cần argparse"""
+    # Adjust days for test mode
+    if test:
+        logger.info("🧪 Running in TEST MODE - limited data extraction")
+        days_back = min(days_back, 7)  # Max 7 days for test
+
+    orchestrator = CompleteBackfillOrchestrator(days_back=days_back, resume=resume)
+    return orchestrator.run_complete_backfill()
+
+def _build_parser():
+    """Build CLI parser (chỉ dùng khi chạy từ command line)"""
     import argparse
 
     parser = argparse.ArgumentParser(description='Complete Backfill for All Staging Tables')
@@ -428,17 +537,15 @@ def main():
                        help='Number of days to backfill (default: 30)')
     parser.add_argument('--test', action='store_true',
                        help='Run in test mode with limited data (max 1 page per endpoint)')
-    args = parser.parse_args()
+    parser.add_argument('--resume', action='store_true',
+                       help='Skip endpoints that succeeded in the previous run (state/backfill_results.json)')
+    return parser
 
-    # Adjust days for test mode
-    if args.test:
-        logger.info("🧪 Running in TEST MODE - limited data extraction")
-        days_back = min(args.days, 7)  # Max 7 days for test
-    else:
-        days_back = args.days
-
-    orchestrator = CompleteBackfillOrchestrator(days_back=days_back)
-    success = orchestrator.run_complete_backfill()
+def main():
+    """Main function"""
+    args = _build_parser().parse_args()
+    disable_unused_record_fields()
+    success = run_complete_backfill(days_back=args.days, test=args.test, resume=args.resume)
 
     if success:
         print("\n" + "="*70)
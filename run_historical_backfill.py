@@ -5,31 +5,82 @@ Historical Backfill Script with UPSERT Logic
 Backfill dữ liệu lịch sử từ 01/07/2024 với khả năng handle duplicates
 """
 
+from __future__ import annotations
+
 import sys
 import os
-import pandas as pd
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
-from typing import Dict, List, Any
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
 import pyodbc
 
 # Add project root to Python path
 sys.path.append('.')
 
 from config.settings import settings
-from src.extractors.misa_crm_extractor import MISACRMExtractor
-from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
-from src.transformers.misa_crm_transformer import MISACRMTransformer
-from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
-from src.utils.logging import setup_logging
+from src.utils.logging import setup_logging, disable_unused_record_fields
+
+# pandas + ETL components import khi khởi tạo (--help / parse args không phải load pandas)
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = setup_logging("historical_backfill")
 
+def _quote_identifier(name: str) -> str:
+    """Quote SQL Server identifier (tương đương QUOTENAME)"""
+    return f"[{name.replace(']', ']]')}]"
+
+@functools.lru_cache(maxsize=32)
+def _merge_sql(table_name: str, columns: tuple, primary_keys: tuple) -> str:
+    """Build SQL MERGE statement for UPSERT (source = temp table #src), cache theo schema"""
+    quoted = {col: _quote_identifier(col) for col in columns}
+    
+    # Build column lists
+    column_list = ', '.join(quoted.values())
+    
+    # Build ON condition for primary keys
+    on_conditions = []
+    for pk in primary_keys:
+        if pk in columns:
+            on_conditions.append(f"target.{quoted[pk]} = source.{quoted[pk]}")
+    
+    on_clause = ' AND '.join(on_conditions) if on_conditions else "1=0"
+    
+    # Build UPDATE SET clause (exclude primary keys)
+    update_columns = [col for col in columns if col not in primary_keys]
+    update_set = ', '.join([f"{quoted[col]} = source.{quoted[col]}" for col in update_columns])
+    
+    return f"""
+    DECLARE @actions TABLE (merge_action NVARCHAR(10));
+    
+    MERGE staging.{_quote_identifier(table_name)} AS target
+    USING #src AS source
+    ON {on_clause}
+    WHEN MATCHED THEN
+        UPDATE SET {update_set}, etl_updated_at = GETUTCDATE()
+    WHEN NOT MATCHED THEN
+        INSERT ({column_list})
+        VALUES ({', '.join([f'source.{quoted[col]}' for col in columns])})
+    OUTPUT $action INTO @actions;
+    
+    SELECT
+        SUM(CASE WHEN merge_action = 'INSERT' THEN 1 ELSE 0 END),
+        SUM(CASE WHEN merge_action = 'UPDATE' THEN 1 ELSE 0 END)
+    FROM @actions;
+    """
+
 class HistoricalBackfillOrchestrator:
     """
     Orchestrates historical backfill với UPSERT logic
     """
     
-    def __init__(self, start_date: str = "2024-07-01", batch_days: int = 30):
+    def __init__(self, start_date: str = "2024-07-01", batch_days: int = 30, force: bool = False,
+                 use_cache: bool = False):
+        self.force = force  # Bỏ qua checkpoint, chạy lại toàn bộ
+        # Đọc trang API từ disk cache (TTL nhiều ngày). Opt-in: MERGE luôn UPDATE khi khớp key,
+        # payload cũ trong cache sẽ ghi đè rows incremental ETL đã cập nhật. --force luôn lấy data mới
+        self.use_cache = use_cache and not force
         self.start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         self.end_date = date.today()
         self.batch_days = batch_days
@@ -43,6 +94,7 @@ class HistoricalBackfillOrchestrator:
         self.misa_transformer = None
         self.tiktok_extractor = None
         self.tiktok_transformer = None
+        self.endpoint_config = []
         
         # Database connection
         self.connection_string = (
@@ -62,16 +114,38 @@ class HistoricalBackfillOrchestrator:
             'tiktok_shop_records': 0,
             'errors': []
         }
+        
+        # Cache INFORMATION_SCHEMA columns theo table (schema không đổi trong 1 lần chạy)
+        self._schema_cache: Dict[str, List[str]] = {}
     
     def initialize_components(self) -> bool:
         """Initialize all ETL components"""
         try:
             logger.info("🔧 Initializing ETL components...")
             
+            from src.extractors.misa_crm_extractor import MISACRMExtractor
+            from src.extractors.tiktok_shop_extractor import TikTokShopOrderExtractor
+            from src.transformers.misa_crm_transformer import MISACRMTransformer
+            from src.transformers.tiktok_shop_transformer import TikTokShopOrderTransformer
+            
             # MISA CRM components
             self.misa_extractor = MISACRMExtractor()
             self.misa_transformer = MISACRMTransformer()
             
+            # MISA endpoint config + transform dispatch table (build 1 lần)
+            self.endpoint_config = [
+                {'name': 'customers', 'table': 'misa_customers', 'pk': ['id'],
+                 'transform': self.misa_transformer.transform_customers},
+                {'name': 'sale_orders', 'table': 'misa_sale_orders_flattened', 'pk': ['order_id', 'item_id'],
+                 'transform': self.misa_transformer.transform_sale_orders_flattened},
+                {'name': 'contacts', 'table': 'misa_contacts', 'pk': ['id'],
+                 'transform': self.misa_transformer.transform_contacts},
+                {'name': 'stocks', 'table': 'misa_stocks', 'pk': ['stock_code'],
+                 'transform': self.misa_transformer.transform_stocks},
+                {'name': 'products', 'table': 'misa_products', 'pk': ['id'],
+                 'transform': self.misa_transformer.transform_products}
+            ]
+            
             # TikTok Shop components
             self.tiktok_extractor = TikTokShopOrderExtractor()
             self.tiktok_transformer = TikTokShopOrderTransformer()
@@ -83,106 +157,186 @@ class HistoricalBackfillOrchestrator:
             logger.error(f"❌ Failed to initialize components: {e}")
             return False
     
+    def _ensure_checkpoint_table(self):
+        """Tạo staging.etl_backfill_checkpoint nếu chưa có"""
+        connection = pyodbc.connect(self.connection_string, autocommit=True)
+        try:
+            connection.cursor().execute("""
+                IF OBJECT_ID('staging.etl_backfill_checkpoint', 'U') IS NULL
+                CREATE TABLE staging.etl_backfill_checkpoint (
+                    batch_start DATE NOT NULL,
+                    batch_end DATE NOT NULL,
+                    endpoint NVARCHAR(50) NOT NULL,
+                    rows_upserted INT NOT NULL,
+                    completed_at DATETIME2 NOT NULL DEFAULT GETUTCDATE(),
+                    PRIMARY KEY (batch_start, batch_end, endpoint)
+                )
+            """)
+        finally:
+            connection.close()
+    
+    def _get_completed_endpoints(self, batch_start: date, batch_end: date) -> set:
+        """Các endpoint đã backfill xong cho batch này (từ lần chạy trước)"""
+        connection = pyodbc.connect(self.connection_string)
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT endpoint FROM staging.etl_backfill_checkpoint WHERE batch_start = ? AND batch_end = ?",
+                batch_start, batch_end
+            )
+            return {row.endpoint for row in cursor.fetchall()}
+        finally:
+            connection.close()
+    
+    def _record_checkpoint(self, batch_start: date, batch_end: date, endpoint: str, rows_upserted: int):
+        """Ghi checkpoint sau khi endpoint đã UPSERT xong tất cả các trang"""
+        connection = pyodbc.connect(self.connection_string)
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                MERGE staging.etl_backfill_checkpoint AS target
+                USING (SELECT ? AS batch_start, ? AS batch_end, ? AS endpoint) AS source
+                ON target.batch_start = source.batch_start
+                AND target.batch_end = source.batch_end
+                AND target.endpoint = source.endpoint
+                WHEN MATCHED THEN
+                    UPDATE SET rows_upserted = ?, completed_at = GETUTCDATE()
+                WHEN NOT MATCHED THEN
+                    INSERT (batch_start, batch_end, endpoint, rows_upserted)
+                    VALUES (source.batch_start, source.batch_end, source.endpoint, ?);
+            """, batch_start, batch_end, endpoint, rows_upserted, rows_upserted)
+            connection.commit()
+        finally:
+            connection.close()
+    
     def upsert_misa_data(self, df: pd.DataFrame, table_name: str, primary_keys: List[str]) -> bool:
         """
         UPSERT MISA CRM data với proper duplicate handling
         """
+        connection = None
         try:
-            connection = pyodbc.connect(self.connection_string)
+            # 1 transaction cho toàn bộ upsert (bulk load #src + MERGE)
+            connection = pyodbc.connect(self.connection_string, autocommit=False)
             cursor = connection.cursor()
+            cursor.execute("SET NOCOUNT ON")
             
             # Get table columns
-            cursor.execute(f"""
-                SELECT COLUMN_NAME 
-                FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_SCHEMA = 'staging' 
-                AND TABLE_NAME = '{table_name}'
-                ORDER BY ORDINAL_POSITION
-            """)
+            db_columns = self._schema_cache.get(table_name)
+            if db_columns is None:
+                cursor.execute("""
+                    SELECT COLUMN_NAME 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = 'staging' 
+                    AND TABLE_NAME = ?
+                    ORDER BY ORDINAL_POSITION
+                """, table_name)
+                db_columns = [row.COLUMN_NAME for row in cursor.fetchall()]
+                self._schema_cache[table_name] = db_columns
             
-            db_columns = [row.COLUMN_NAME for row in cursor.fetchall()]
             matching_columns = [col for col in db_columns if col in df.columns]
             
             if not matching_columns:
                 logger.error(f"❌ No matching columns for {table_name}")
                 return False
             
-            # Build MERGE statement for UPSERT
-            merge_sql = self._build_merge_statement(table_name, matching_columns, primary_keys)
+            # Dedupe theo primary keys (MERGE không cho phép source trùng key)
+            key_columns = [pk for pk in primary_keys if pk in matching_columns]
+            source_df = df[matching_columns]
+            if key_columns:
+                source_df = source_df.drop_duplicates(subset=key_columns, keep='last')
             
-            # Prepare data for MERGE
-            inserted_count = 0
-            updated_count = 0
+            # NaN -> None, numpy scalars -> Python objects cho pyodbc
+            source_df = source_df.astype(object).where(source_df.notna(), None)
+            rows = list(source_df.itertuples(index=False, name=None))
             
-            for _, row in df.iterrows():
-                try:
-                    # Prepare values
-                    values = []
-                    for col in matching_columns:
-                        value = row[col] if col in row else None
-                        if pd.isna(value):
-                            values.append(None)
-                        else:
-                            values.append(value)
-                    
-                    # Execute MERGE
-                    cursor.execute(merge_sql, values + values)  # values twice for INSERT and UPDATE
-                    result = cursor.fetchone()
-                    
-                    if result and result[0] == 'INSERT':
-                        inserted_count += 1
-                    elif result and result[0] == 'UPDATE':
-                        updated_count += 1
-                        
-                except Exception as e:
-                    logger.warning(f"⚠️ Row merge failed: {str(e)[:100]}...")
-                    continue
+            if not rows:
+                return True
+            
+            # Bulk load vào temp table cùng cấu trúc với staging table
+            column_list = ', '.join(_quote_identifier(col) for col in matching_columns)
+            cursor.execute(f"SELECT TOP 0 {column_list} INTO #src FROM staging.{_quote_identifier(table_name)}")
             
+            cursor.fast_executemany = True
+            cursor.executemany(
+                f"INSERT INTO #src ({column_list}) VALUES ({', '.join(['?' for _ in matching_columns])})",
+                rows
+            )
+            
+            # 1 MERGE cho toàn bộ batch
+            cursor.execute(_merge_sql(table_name, tuple(matching_columns), tuple(primary_keys)))
+            inserted_count, updated_count = cursor.fetchone()
+            
+            cursor.execute("DROP TABLE #src")
             connection.commit()
-            cursor.close()
-            connection.close()
             
-            logger.info(f"   ✅ UPSERT completed: {inserted_count} inserted, {updated_count} updated")
+            logger.info(f"   ✅ UPSERT completed: {inserted_count or 0} inserted, {updated_count or 0} updated")
             return True
             
         except Exception as e:
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except pyodbc.Error:
+                    pass
             logger.error(f"❌ UPSERT failed for {table_name}: {e}")
             return False
-    
-    def _build_merge_statement(self, table_name: str, columns: List[str], primary_keys: List[str]) -> str:
-        """Build SQL MERGE statement for UPSERT"""
-        
-        # Build column lists
-        column_list = ', '.join(columns)
-        value_placeholders = ', '.join(['?' for _ in columns])
         
-        # Build ON condition for primary keys
-        on_conditions = []
-        for pk in primary_keys:
-            if pk in columns:
-                on_conditions.append(f"target.{pk} = source.{pk}")
-        
-        on_clause = ' AND '.join(on_conditions) if on_conditions else "1=0"
+        finally:
+            if connection is not None:
+                connection.close()
+    
+    def _process_one_endpoint(self, endpoint: Dict[str, Any], batch_start: date, batch_end: date) -> Dict[str, Any]:
+        """Extract → transform → UPSERT một MISA endpoint"""
+        import pandas as pd
         
-        # Build UPDATE SET clause (exclude primary keys)
-        update_columns = [col for col in columns if col not in primary_keys]
-        update_set = ', '.join([f"{col} = source.{col}" for col in update_columns])
+        try:
+            logger.info(f"   🔄 Processing {endpoint['name']}...")
+            
+            # Extract → transform → UPSERT từng trang (peak memory ~ 1 trang thay vì cả endpoint)
+            records_processed = 0
+            pages_failed = 0
+            pages = self.misa_extractor.iter_endpoint_pages(
+                endpoint['name'], 
+                max_pages=5,  # Limit for batch processing
+                cache=self.use_cache  # Các batch lấy lại cùng các trang -> đọc từ disk cache
+            )
+            
+            for raw_data in pages:
+                df = pd.DataFrame(endpoint['transform'](raw_data))
+                
+                if self.upsert_misa_data(df, endpoint['table'], endpoint['pk']):
+                    records_processed += len(df)
+                else:
+                    pages_failed += 1
+            
+            if records_processed == 0 and pages_failed == 0:
+                logger.info(f"   ⚠️ No data for {endpoint['name']}")
+                return {'success': False, 'records': 0}
+            
+            if pages_failed == 0:
+                self._record_checkpoint(batch_start, batch_end, endpoint['name'], records_processed)
+                logger.info(f"   ✅ {endpoint['name']}: {records_processed} records processed")
+                return {'success': True, 'records': records_processed}
+            
+            logger.error(f"   ❌ {endpoint['name']}: {pages_failed} page(s) failed")
+            return {'success': False, 'records': records_processed}
+                
+        except Exception as e:
+            logger.error(f"   ❌ {endpoint['name']} error: {e}")
+            return {'success': False, 'records': 0}
+    
+    def _extract_tiktok_batch(self, batch_start: date, batch_end: date) -> Optional[pd.DataFrame]:
+        """Extract + transform TikTok Shop orders cho 1 batch (chạy trước trong producer thread)"""
+        days_in_batch = (batch_end - batch_start).days
+        raw_orders = self.tiktok_extractor.extract_recent_orders(days_back=days_in_batch)
         
-        merge_sql = f"""
-        MERGE staging.{table_name} AS target
-        USING (SELECT {value_placeholders} AS ({column_list})) AS source
-        ON {on_clause}
-        WHEN MATCHED THEN
-            UPDATE SET {update_set}, etl_updated_at = GETUTCDATE()
-        WHEN NOT MATCHED THEN
-            INSERT ({column_list})
-            VALUES ({', '.join([f'source.{col}' for col in columns])})
-        OUTPUT $action;
-        """
+        if not raw_orders:
+            return None
         
-        return merge_sql
+        return self.tiktok_transformer.transform_orders_to_dataframe(raw_orders)
     
-    def process_batch(self, batch_start: date, batch_end: date, batch_num: int) -> Dict[str, Any]:
+    def process_batch(self, batch_start: date, batch_end: date, batch_num: int,
+                      tiktok_future: Optional[Future] = None) -> Dict[str, Any]:
         """Process một batch của historical data"""
         logger.info(f"\n📦 BATCH {batch_num}/{self.total_batches}")
         logger.info(f"📅 Period: {batch_start.strftime('%Y-%m-%d')} to {batch_end.strftime('%Y-%m-%d')}")
@@ -201,60 +355,39 @@ class HistoricalBackfillOrchestrator:
             # MISA CRM Processing
             logger.info("🏢 Processing MISA CRM data...")
             
-            misa_endpoints = [
-                {'name': 'customers', 'table': 'misa_customers', 'pk': ['id']},
-                {'name': 'sale_orders', 'table': 'misa_sale_orders_flattened', 'pk': ['order_id', 'item_id']},
-                {'name': 'contacts', 'table': 'misa_contacts', 'pk': ['id']},
-                {'name': 'stocks', 'table': 'misa_stocks', 'pk': ['stock_code']},
-                {'name': 'products', 'table': 'misa_products', 'pk': ['id']}
-            ]
+            misa_endpoints = self.endpoint_config
             
-            for endpoint in misa_endpoints:
-                try:
-                    logger.info(f"   🔄 Processing {endpoint['name']}...")
-                    
-                    # Extract (limited pages for batch processing)
-                    raw_data = self.misa_extractor.extract_all_data_from_endpoint(
-                        endpoint['name'], 
-                        max_pages=5  # Limit for batch processing
-                    )
-                    
-                    if not raw_data:
-                        logger.info(f"   ⚠️ No data for {endpoint['name']}")
-                        continue
-                    
-                    # Transform
-                    if endpoint['name'] == 'sale_orders':
-                        transformed_data = self.misa_transformer.transform_sale_orders_flattened(raw_data)
-                    else:
-                        transform_method = getattr(self.misa_transformer, f'transform_{endpoint["name"]}')
-                        transformed_data = transform_method(raw_data)
-                    
-                    df = pd.DataFrame(transformed_data)
-                    
-                    # UPSERT
-                    success = self.upsert_misa_data(df, endpoint['table'], endpoint['pk'])
-                    
-                    if success:
+            # Bỏ qua endpoint đã hoàn thành ở lần chạy trước (trừ khi --force)
+            if not self.force:
+                completed = self._get_completed_endpoints(batch_start, batch_end)
+                if completed:
+                    logger.info(f"   ⏭️ Skipping completed endpoints: {', '.join(sorted(completed))}")
+                    batch_results['misa_success'] += len(completed)
+                    misa_endpoints = [e for e in misa_endpoints if e['name'] not in completed]
+            
+            # Các endpoint độc lập (I/O-bound) -> chạy song song
+            with ThreadPoolExecutor(max_workers=max(len(misa_endpoints), 1)) as executor:
+                futures = [
+                    executor.submit(self._process_one_endpoint, endpoint, batch_start, batch_end)
+                    for endpoint in misa_endpoints
+                ]
+                
+                for future in as_completed(futures):
+                    endpoint_result = future.result()
+                    if endpoint_result['success']:
                         batch_results['misa_success'] += 1
-                        batch_results['records_processed'] += len(df)
-                        logger.info(f"   ✅ {endpoint['name']}: {len(df)} records processed")
-                    else:
-                        logger.error(f"   ❌ {endpoint['name']}: Failed")
-                        
-                except Exception as e:
-                    logger.error(f"   ❌ {endpoint['name']} error: {e}")
-                    continue
+                        batch_results['records_processed'] += endpoint_result['records']
             
             # TikTok Shop Processing
             logger.info("\n🛒 Processing TikTok Shop data...")
             try:
-                days_in_batch = (batch_end - batch_start).days
-                raw_orders = self.tiktok_extractor.extract_recent_orders(days_back=days_in_batch)
+                # TikTok extract/transform có thể đã chạy song song với MISA (pipelined)
+                if tiktok_future is not None:
+                    transformed_df = tiktok_future.result()
+                else:
+                    transformed_df = self._extract_tiktok_batch(batch_start, batch_end)
                 
-                if raw_orders:
-                    transformed_df = self.tiktok_transformer.transform_orders_to_dataframe(raw_orders)
-                    
+                if transformed_df is not None:
                     # Use existing TikTok loader (has deduplication)
                     from src.loaders.tiktok_shop_staging_loader import TikTokShopOrderLoader
                     tiktok_loader = TikTokShopOrderLoader()
@@ -294,17 +427,15 @@ class HistoricalBackfillOrchestrator:
             if not self.initialize_components():
                 return False
             
-            # Process batches
+            self._ensure_checkpoint_table()
+            
+            # Build batch windows
+            batches = []
             current_date = self.start_date
             
             for batch_num in range(1, self.total_batches + 1):
                 batch_end = min(current_date + timedelta(days=self.batch_days), self.end_date)
-                
-                batch_result = self.process_batch(current_date, batch_end, batch_num)
-                
-                # Update results
-                self.results['batches_completed'] += 1
-                self.results['total_records_processed'] += batch_result.get('records_processed', 0)
+                batches.append((current_date, batch_end, batch_num))
                 
                 # Move to next batch
                 current_date = batch_end + timedelta(days=1)
@@ -312,6 +443,21 @@ class HistoricalBackfillOrchestrator:
                 if current_date > self.end_date:
                     break
             
+            # Pipeline: TikTok extract/transform của batch N+1 chạy trong lúc batch N đang load
+            with ThreadPoolExecutor(max_workers=1) as producer:
+                next_future = producer.submit(self._extract_tiktok_batch, batches[0][0], batches[0][1])
+                
+                for i, (batch_start, batch_end, batch_num) in enumerate(batches):
+                    tiktok_future = next_future
+                    if i + 1 < len(batches):
+                        next_future = producer.submit(self._extract_tiktok_batch, batches[i + 1][0], batches[i + 1][1])
+                    
+                    batch_result = self.process_batch(batch_start, batch_end, batch_num, tiktok_future)
+                    
+                    # Update results (consumer side, giữ đúng thứ tự batch)
+                    self.results['batches_completed'] += 1
+                    self.results['total_records_processed'] += batch_result.get('records_processed', 0)
+            
             # Final summary
             self.generate_final_summary()
             return True
@@ -330,8 +476,24 @@ class HistoricalBackfillOrchestrator:
         logger.info(f"📅 Period covered: {self.start_date} to {self.end_date}")
         logger.info(f"🎯 Success rate: {(self.results['batches_completed']/self.total_batches)*100:.1f}%")
 
-def main():
-    """Main function"""
+def run_historical_backfill(start_date: str = '2024-07-01', batch_days: int = 30, test: bool = False,
+                            force: bool = False, use_cache: bool = False) -> bool:
+    """Programmatic entrypoint (Airflow, scripts) - không cần argparse"""
+    if test:
+        batch_days = 7
+        logger.info("🧪 Running in TEST MODE")
+    
+    orchestrator = HistoricalBackfillOrchestrator(
+        start_date=start_date,
+        batch_days=batch_days,
+        force=force,
+        use_cache=use_cache
+    )
+    
+    return orchestrator.run_historical_backfill()
+
+def _build_parser():
+    """Build CLI parser (chỉ dùng khi chạy từ command line)"""
     import argparse
     
     parser = argparse.ArgumentParser(description='Historical Backfill from 01/07/2024')
@@ -341,21 +503,18 @@ def main():
                        help='Days per batch (default: 30)')
     parser.add_argument('--test', action='store_true', 
                        help='Test mode with smaller batches')
-    
-    args = parser.parse_args()
-    
-    if args.test:
-        batch_days = 7
-        logger.info("🧪 Running in TEST MODE")
-    else:
-        batch_days = args.batch_days
-    
-    orchestrator = HistoricalBackfillOrchestrator(
-        start_date=args.start_date,
-        batch_days=batch_days
-    )
-    
-    success = orchestrator.run_historical_backfill()
+    parser.add_argument('--force', action='store_true', 
+                       help='Ignore checkpoints and reprocess all batches')
+    parser.add_argument('--use-cache', action='store_true',
+                       help='Reuse cached MISA API pages (may upsert stale data; ignored with --force)')
+    return parser
+
+def main():
+    """Main function"""
+    args = _build_parser().parse_args()
+    disable_unused_record_fields()
+    success = run_historical_backfill(start_date=args.start_date, batch_days=args.batch_days, test=args.test, force=args.force,
+                                     use_cache=args.use_cache)
     
     if success:
         print("\n" + "="*70)
@@ -6,10 +6,15 @@ Tích hợp với TikTok Shop Infrastructure - Cấu trúc src/
 """
 
 import requests
-import jwt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import base64
+import math
 import time
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator
 import logging
 import sys
 import os
@@ -18,6 +23,9 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from config.settings import settings
 from src.utils.logging import setup_logging
+from src.utils.cache import ResponseCache
+from src.utils.rate_limit import RateLimiter
+from src.utils.json_utils import json_loads
 
 logger = setup_logging(__name__)
 
@@ -35,6 +43,22 @@ class MISACRMExtractor:
         
         self.access_token = None
         self.token_expires_at = None
+        self._token_exp_epoch = 0.0  # exp claim (epoch giây) để so sánh nhanh với time.time()
+        self._token_lock = threading.Lock()  # Nhiều thread dùng chung 1 extractor
+        
+        # HTTP keep-alive + connection pool (retry do _make_request_with_retry xử lý)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=0)))
+        self.session.headers.update({
+            "Clientid": self.client_id,
+            "Content-Type": "application/json"
+        })
+        
+        # Rate limit dùng chung cho mọi request dữ liệu (serial lẫn song song)
+        self._rate_limiter = RateLimiter(settings.etl_rate_limit_delay)
+        
+        # Disk cache cho paginated GETs (khởi tạo khi cần, chỉ dùng khi cache=True)
+        self._response_cache: Optional[ResponseCache] = None
         
         # Endpoint configuration
         self.endpoints = {
@@ -47,29 +71,30 @@ class MISACRMExtractor:
         
         logger.info(f"Khởi tạo MISA CRM Extractor cho {settings.company_name}")
     
-    def _decode_token_expiry(self, token: str) -> Optional[datetime]:
-        """Decode JWT token để lấy thời gian hết hạn"""
+    def close(self):
+        """Đóng HTTP session (trả các keep-alive connection)"""
+        self.session.close()
+    
+    def _decode_token_expiry(self, token: str) -> float:
+        """Decode JWT payload (không verify signature) để lấy thời gian hết hạn (epoch giây)"""
         try:
-            decoded = jwt.decode(token, options={"verify_signature": False})
-            exp_timestamp = decoded.get('exp')
+            payload_segment = token.split('.')[1]
+            payload_segment += '=' * (-len(payload_segment) % 4)
+            exp_timestamp = json_loads(base64.urlsafe_b64decode(payload_segment)).get('exp')
             
             if exp_timestamp:
-                return datetime.fromtimestamp(exp_timestamp)
+                return float(exp_timestamp)
             else:
                 logger.warning("Token không có thời gian hết hạn, sử dụng mặc định 1 giờ")
-                return datetime.now() + timedelta(hours=1)
+                return time.time() + 3600
                 
         except Exception as e:
             logger.warning(f"Không thể decode token: {e}, sử dụng mặc định 1 giờ")
-            return datetime.now() + timedelta(hours=1)
+            return time.time() + 3600
     
     def _is_token_expired(self) -> bool:
         """Kiểm tra token có hết hạn không"""
-        if not self.access_token or not self.token_expires_at:
-            return True
-        
-        buffer_time = datetime.now() + timedelta(seconds=settings.misa_crm_token_refresh_buffer)
-        return buffer_time >= self.token_expires_at
+        return not self.access_token or time.time() + settings.misa_crm_token_refresh_buffer >= self._token_exp_epoch
     
     def get_access_token(self, force_refresh: bool = False) -> Optional[str]:
         """Lấy access token với khả năng auto refresh"""
@@ -77,6 +102,15 @@ class MISACRMExtractor:
             logger.debug("Sử dụng token hiện tại còn hạn")
             return self.access_token
         
+        with self._token_lock:
+            # Thread khác có thể đã refresh trong lúc chờ lock
+            if not force_refresh and not self._is_token_expired():
+                return self.access_token
+            
+            return self._request_access_token()
+    
+    def _request_access_token(self) -> Optional[str]:
+        """Gọi API /Account để lấy token mới (caller giữ _token_lock)"""
         logger.info("Đang yêu cầu access token mới từ MISA CRM API")
         
         url = f"{self.base_url}/Account"
@@ -87,13 +121,14 @@ class MISACRMExtractor:
         headers = {"Content-Type": "application/json"}
         
         try:
-            response = requests.post(url, json=data, headers=headers, timeout=settings.api_timeout)
+            response = self.session.post(url, json=data, headers=headers, timeout=settings.api_timeout)
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 if result.get('success') and 'data' in result:
                     self.access_token = result['data']
-                    self.token_expires_at = self._decode_token_expiry(self.access_token)
+                    self._token_exp_epoch = self._decode_token_expiry(self.access_token)
+                    self.token_expires_at = datetime.fromtimestamp(self._token_exp_epoch)
                     
                     logger.info(f"Lấy token thành công, hết hạn lúc: {self.token_expires_at}")
                     return self.access_token
@@ -114,11 +149,8 @@ class MISACRMExtractor:
         if not token:
             raise ValueError("Không thể lấy access token hợp lệ")
         
-        return {
-            "Authorization": f"Bearer {token}",
-            "Clientid": self.client_id,
-            "Content-Type": "application/json"
-        }
+        # Clientid/Content-Type đã set sẵn trên session
+        return {"Authorization": f"Bearer {token}"}
     
     def _make_request_with_retry(self, method: str, url: str, **kwargs) -> Optional[requests.Response]:
         """Thực hiện HTTP request với retry logic và token refresh"""
@@ -128,7 +160,7 @@ class MISACRMExtractor:
                 kwargs['headers'] = headers
                 kwargs['timeout'] = kwargs.get('timeout', settings.api_timeout)
                 
-                response = requests.request(method, url, **kwargs)
+                response = self.session.request(method, url, **kwargs)
                 
                 if response.status_code == 200:
                     return response
@@ -153,7 +185,8 @@ class MISACRMExtractor:
         
         return None
     
-    def extract_endpoint_data(self, endpoint_name: str, page: int = 0, page_size: int = None, **params) -> Optional[Dict]:
+    def extract_endpoint_data(self, endpoint_name: str, page: int = 0, page_size: int = None,
+                              cache: bool = False, **params) -> Optional[Dict]:
         """
         Lấy dữ liệu từ MISA CRM endpoint
         
@@ -161,6 +194,7 @@ class MISACRMExtractor:
             endpoint_name: Tên endpoint ('customers', 'sale_orders', etc.)
             page: Số trang (bắt đầu từ 0)
             page_size: Số bản ghi trên trang
+            cache: Đọc/ghi response qua disk cache (dùng cho backfill chạy lặp lại)
             **params: Tham số bổ sung
             
         Returns:
@@ -186,57 +220,114 @@ class MISACRMExtractor:
         if endpoint_name == 'stocks':
             request_params = {}
         
+        cache_key = None
+        if cache:
+            if self._response_cache is None:
+                self._response_cache = ResponseCache()
+            cache_key = ResponseCache.make_key(endpoint_name, page, page_size, sorted(request_params.items()))
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Cache hit {endpoint_name} (trang {page})")
+                return cached
+        
         logger.debug(f"Đang yêu cầu dữ liệu {endpoint_name} (trang {page}, kích thước {page_size})")
         
+        self._rate_limiter.wait()
         response = self._make_request_with_retry('GET', url, params=request_params)
         
         if response:
-            result = response.json()
+            result = json_loads(response.content)
+            if cache_key:
+                self._response_cache.set(cache_key, result)
             logger.debug(f"Lấy dữ liệu {endpoint_name} thành công")
             return result
         else:
             logger.error(f"Thất bại khi lấy dữ liệu {endpoint_name}")
             return None
     
-    def extract_all_data_from_endpoint(self, endpoint_name: str, max_pages: int = None) -> List[Dict]:
+    def iter_endpoint_pages(self, endpoint_name: str, max_pages: int = None, cache: bool = False) -> Iterator[List[Dict]]:
         """
-        Lấy tất cả dữ liệu từ endpoint với phân trang
+        Lấy dữ liệu từ endpoint theo từng trang (generator) để xử lý streaming
         
         Args:
             endpoint_name: Tên endpoint
             max_pages: Số trang tối đa (None = không giới hạn)
+            cache: Dùng disk cache cho từng trang
             
-        Returns:
-            Danh sách tất cả records
+        Yields:
+            Danh sách records của từng trang
         """
-        all_data = []
         page = 0
         
-        logger.info(f"Bắt đầu lấy dữ liệu bulk từ {endpoint_name}")
-        
         while True:
             if max_pages and page >= max_pages:
                 logger.info(f"Đã đạt giới hạn trang tối đa: {max_pages}")
                 break
             
-            result = self.extract_endpoint_data(endpoint_name, page=page, page_size=settings.misa_crm_page_size)
+            result = self.extract_endpoint_data(endpoint_name, page=page, page_size=settings.misa_crm_page_size, cache=cache)
             
             if not result or 'data' not in result or not result['data']:
                 logger.info(f"Không còn dữ liệu ở trang {page}")
                 break
             
             batch_data = result['data']
-            all_data.extend(batch_data)
-            
-            logger.debug(f"Đã lấy {len(batch_data)} records từ trang {page} (tổng: {len(all_data)})")
+            logger.debug(f"Đã lấy {len(batch_data)} records từ trang {page}")
+            yield batch_data
             
             # Kiểm tra trang cuối
             if len(batch_data) < settings.misa_crm_page_size:
                 logger.info(f"Đã đến trang cuối: {page}")
                 break
             
+            # API trả về tổng số records -> lấy các trang còn lại song song
+            total_records = result.get('totalRecord')
+            if page == 0 and total_records and endpoint_name != 'stocks':
+                yield from self._iter_remaining_pages_parallel(endpoint_name, total_records, max_pages, cache)
+                return
+            
             page += 1
-            time.sleep(settings.etl_rate_limit_delay)  # Rate limiting
+    
+    def _iter_remaining_pages_parallel(self, endpoint_name: str, total_records: int,
+                                       max_pages: int = None, cache: bool = False) -> Iterator[List[Dict]]:
+        """Lấy trang 1..N-1 song song (thứ tự trang được giữ nguyên), rate limit qua _rate_limiter"""
+        n_pages = math.ceil(total_records / settings.misa_crm_page_size)
+        if max_pages:
+            n_pages = min(n_pages, max_pages)
+        
+        if n_pages <= 1:
+            return
+        
+        logger.info(f"Lấy song song {n_pages - 1} trang còn lại của {endpoint_name} ({total_records} records)")
+        
+        def fetch_page(page: int) -> Optional[Dict]:
+            return self.extract_endpoint_data(endpoint_name, page=page, page_size=settings.misa_crm_page_size, cache=cache)
+        
+        with ThreadPoolExecutor(max_workers=settings.etl_page_workers) as executor:
+            for page, result in enumerate(executor.map(fetch_page, range(1, n_pages)), start=1):
+                if not result or 'data' not in result or not result['data']:
+                    logger.info(f"Không còn dữ liệu ở trang {page}")
+                    break
+                
+                logger.debug(f"Đã lấy {len(result['data'])} records từ trang {page}")
+                yield result['data']
+    
+    def extract_all_data_from_endpoint(self, endpoint_name: str, max_pages: int = None, cache: bool = False) -> List[Dict]:
+        """
+        Lấy tất cả dữ liệu từ endpoint với phân trang
+        
+        Args:
+            endpoint_name: Tên endpoint
+            max_pages: Số trang tối đa (None = không giới hạn)
+            cache: Dùng disk cache cho từng trang
+            
+        Returns:
+            Danh sách tất cả records
+        """
+        logger.info(f"Bắt đầu lấy dữ liệu bulk từ {endpoint_name}")
+        
+        all_data = []
+        for batch_data in self.iter_endpoint_pages(endpoint_name, max_pages=max_pages, cache=cache):
+            all_data.extend(batch_data)
         
         logger.info(f"Hoàn thành lấy dữ liệu bulk: {len(all_data)} tổng records từ {endpoint_name}")
         return all_data
@@ -263,23 +354,22 @@ class MISACRMExtractor:
         if not all_data:
             return []
         
-        # Lọc theo modified_date
-        cutoff_time = datetime.now() - timedelta(hours=lookback_hours)
-        filtered_data = []
+        # Lọc theo modified_date (vectorized)
+        # pandas chỉ cần cho bước lọc incremental -> import tại đây (extractor/test kết nối không phải load pandas)
+        import pandas as pd
+        from src.transformers.misa_crm_transformer import _DATETIME_FORMAT_KWARGS
         
-        for record in all_data:
-            modified_date_str = record.get('modified_date')
-            if modified_date_str:
-                try:
-                    modified_date = datetime.fromisoformat(modified_date_str.replace('Z', '+00:00'))
-                    if modified_date >= cutoff_time:
-                        filtered_data.append(record)
-                except:
-                    # Bao gồm record nếu không parse được date
-                    filtered_data.append(record)
-            else:
-                # Bao gồm record nếu không có modified_date
-                filtered_data.append(record)
+        # Cùng format ISO 8601 với transformer: các biến thể (có/không offset, fractional seconds)
+        # không bị thành NaT; timestamp không có offset được coi là UTC
+        modified_dates = pd.to_datetime(
+            pd.Series([record.get('modified_date') for record in all_data]),
+            errors='coerce', utc=True, **_DATETIME_FORMAT_KWARGS
+        )
+        cutoff_time = pd.Timestamp.now(tz='UTC') - pd.Timedelta(hours=lookback_hours)
+        
+        # Bao gồm record nếu không có modified_date hoặc không parse được date
+        keep = (modified_dates.isna() | (modified_dates >= cutoff_time)).tolist()
+        filtered_data = [record for record, keep_record in zip(all_data, keep) if keep_record]
         
         logger.info(f"Lọc incremental: {len(filtered_data)}/{len(all_data)} records")
         return filtered_data
@@ -4,19 +4,24 @@ Dựa trên implementation từ notebook đã hoạt động (Steps 6-8)
 """
 
 import requests
-import time
-import json
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import DefaultCookiePolicy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import sys
 import os
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Iterator
 from datetime import datetime, timedelta
+from pathlib import Path
 
 # Add project root to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from src.utils.auth import TikTokAuthenticator
+from src.utils.auth import TikTokAuthenticator, api_timestamp
 from src.utils.logging import setup_logging
+from src.utils.rate_limit import TokenBucket
+from src.utils.json_utils import json_loads
 from config.settings import settings
 
 logger = setup_logging("tiktok_shop_extractor")
@@ -25,9 +30,138 @@ class TikTokShopOrderExtractor:
     """Trích xuất dữ liệu đơn hàng từ TikTok Shop API"""
     
     def __init__(self):
-        self.auth = TikTokAuthenticator()
         self.base_url = "https://open-api.tiktokglobalshop.com"
         
+        # HTTP keep-alive + connection pool cho các request phân trang/batch
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+        ))
+        # API tin cậy, trả JSON: luôn xin gzip, không cần lưu cookies
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': 'facolos-etl/1.0'
+        })
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        
+        # Auth (refresh token, shop cipher) gọi cùng host -> dùng chung session/connection pool
+        self.auth = TikTokAuthenticator(session=self.session)
+        
+        # Watermark (max update_time đã ingest) cho incremental extract: search theo update_time
+        # để đơn cũ đổi trạng thái (giao hàng, hủy...) vẫn được lấy lại
+        self._watermark_path = Path(settings.etl_state_dir) / 'tiktok_orders_update_time.wm'
+        self._pending_watermark: Optional[int] = None
+        # False nếu lần extract gần nhất có trang search / batch details bị lỗi (data không đầy đủ)
+        self.last_extract_complete = True
+        self._search_failed = False
+        
+        # Order details: nhiều batch chạy song song; mọi request (search + details) lấy token từ 1 bucket dùng chung
+        self.detail_workers = 8
+        self.rate_limit = TokenBucket(rate=settings.tiktok_rps, capacity=settings.tiktok_burst)
+        
+    def close(self):
+        """Đóng HTTP session"""
+        self.session.close()
+        
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+        
+    def iter_order_id_batches(self, 
+                              start_time: int, 
+                              end_time: int,
+                              order_status: Optional[str] = None,
+                              page_size: int = 50,
+                              time_field: str = 'create_time') -> Iterator[List[str]]:
+        """
+        Tìm kiếm ID đơn hàng theo từng trang (generator)
+        
+        Args:
+            start_time: Timestamp bắt đầu
+            end_time: Timestamp kết thúc
+            order_status: Lọc theo trạng thái đơn hàng (tùy chọn)
+            page_size: Kích thước trang cho phân trang
+            time_field: Field lọc khoảng thời gian và sắp xếp ('create_time' hoặc 'update_time')
+            
+        Yields:
+            Danh sách ID đơn hàng của từng trang
+        """
+        self._search_failed = False
+        
+        # Đảm bảo token hợp lệ
+        if not self.auth.ensure_valid_token():
+            logger.error("Không thể đảm bảo token xác thực hợp lệ")
+            self._search_failed = True
+            return
+            
+        cursor = ""
+        has_more = True
+        total_ids = 0
+        
+        url = f"{self.base_url}/order/202309/orders/search"
+        
+        # Params cố định cho mọi trang; mỗi trang chỉ thêm timestamp/cursor
+        base_params = {
+            'app_key': self.auth.app_key,
+            'access_token': self.auth.access_token,
+            'shop_cipher': self.auth.shop_cipher,
+            'version': '202309',
+            f'{time_field}_from': str(start_time),
+            f'{time_field}_to': str(end_time),
+            'page_size': str(page_size),
+            'sort_field': time_field,
+            'sort_order': 'ASC'
+        }
+        
+        if order_status:
+            base_params['order_status'] = order_status
+        
+        while has_more:
+            params = {**base_params, 'timestamp': api_timestamp()}
+            
+            if cursor:
+                params['cursor'] = cursor
+            
+            # Tạo chữ ký
+            signature = self.auth.generate_signature('/order/202309/orders/search', params)
+            params['sign'] = signature
+            
+            # Rate limiting
+            self.rate_limit.acquire()
+            response = self.session.get(url, params=params, timeout=(3.05, 30), allow_redirects=False)
+            
+            if response.status_code == 200:
+                data = json_loads(response.content)
+                if data.get('code') == 0:
+                    orders = data.get('data', {}).get('orders', [])
+                    order_ids = [order['order_id'] for order in orders]
+                    total_ids += len(order_ids)
+                    
+                    # Kiểm tra phân trang
+                    has_more = data.get('data', {}).get('has_more', False)
+                    cursor = data.get('data', {}).get('cursor', '')
+                    
+                    logger.info(f"Đã lấy {len(order_ids)} ID đơn hàng, tổng: {total_ids}")
+                    
+                    if order_ids:
+                        yield order_ids
+                else:
+                    logger.error(f"Lỗi API trong search_orders: {data.get('message')}")
+                    self._search_failed = True
+                    break
+            else:
+                logger.error(f"Lỗi HTTP trong search_orders: {response.status_code}")
+                if response.status_code == 401:
+                    self.auth.invalidate()
+                self._search_failed = True
+                break
+                
+        logger.info(f"Tổng số ID đơn hàng đã lấy: {total_ids}")
+        
     def search_orders_for_ids(self, 
                              start_time: int, 
                              end_time: int,
@@ -46,72 +180,57 @@ class TikTokShopOrderExtractor:
             Danh sách ID đơn hàng
         """
         try:
-            # Đảm bảo token hợp lệ
-            if not self.auth.ensure_valid_token():
-                logger.error("Không thể đảm bảo token xác thực hợp lệ")
-                return []
-                
             all_order_ids = []
-            cursor = ""
-            has_more = True
-            
-            while has_more:
-                url = f"{self.base_url}/order/202309/orders/search"
-                
-                params = {
-                    'app_key': self.auth.app_key,
-                    'timestamp': str(int(time.time())),
-                    'access_token': self.auth.access_token,
-                    'shop_cipher': self.auth.shop_cipher,
-                    'version': '202309',
-                    'create_time_from': str(start_time),
-                    'create_time_to': str(end_time),
-                    'page_size': str(page_size),
-                    'sort_field': 'create_time',
-                    'sort_order': 'ASC'
-                }
-                
-                if cursor:
-                    params['cursor'] = cursor
-                    
-                if order_status:
-                    params['order_status'] = order_status
-                
-                # Tạo chữ ký
-                signature = self.auth.generate_signature('/order/202309/orders/search', params)
-                params['sign'] = signature
-                
-                response = requests.get(url, params=params)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('code') == 0:
-                        orders = data.get('data', {}).get('orders', [])
-                        order_ids = [order['order_id'] for order in orders]
-                        all_order_ids.extend(order_ids)
-                        
-                        # Kiểm tra phân trang
-                        has_more = data.get('data', {}).get('has_more', False)
-                        cursor = data.get('data', {}).get('cursor', '')
-                        
-                        logger.info(f"Đã lấy {len(order_ids)} ID đơn hàng, tổng: {len(all_order_ids)}")
-                        
-                        # Giới hạn tốc độ
-                        time.sleep(0.1)
-                    else:
-                        logger.error(f"Lỗi API trong search_orders: {data.get('message')}")
-                        break
-                else:
-                    logger.error(f"Lỗi HTTP trong search_orders: {response.status_code}")
-                    break
-                    
-            logger.info(f"Tổng số ID đơn hàng đã lấy: {len(all_order_ids)}")
+            for order_ids in self.iter_order_id_batches(start_time, end_time, order_status, page_size):
+                all_order_ids.extend(order_ids)
             return all_order_ids
             
         except Exception as e:
             logger.error(f"Ngoại lệ trong search_orders_for_ids: {str(e)}")
             return []
             
+    def _fetch_order_details(self, batch_ids: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Fetch order details for one batch of up to 50 order IDs
+        
+        Args:
+            batch_ids: Order IDs in this batch
+            
+        Returns:
+            List of order detail dictionaries (None on error)
+        """
+        url = f"{self.base_url}/order/202309/orders"
+        
+        params = {
+            'app_key': self.auth.app_key,
+            'timestamp': api_timestamp(),
+            'access_token': self.auth.access_token,
+            'shop_cipher': self.auth.shop_cipher,
+            'version': '202309',
+            'order_id_list': ','.join(batch_ids)
+        }
+        
+        # Generate signature
+        signature = self.auth.generate_signature('/order/202309/orders', params)
+        params['sign'] = signature
+        
+        # Rate limiting
+        self.rate_limit.acquire()
+        response = self.session.get(url, params=params, timeout=(3.05, 30), allow_redirects=False)
+        
+        if response.status_code == 200:
+            data = json_loads(response.content)
+            if data.get('code') == 0:
+                return data.get('data', {}).get('order_list', [])
+            else:
+                logger.error(f"API error in get_order_details: {data.get('message')}")
+        else:
+            logger.error(f"HTTP error in get_order_details: {response.status_code}")
+            if response.status_code == 401:
+                self.auth.invalidate()
+        
+        return None
+            
     def get_order_details_with_ids(self, order_ids: List[str]) -> List[Dict[str, Any]]:
         """
         Get detailed order information for a list of order IDs
@@ -129,43 +248,17 @@ class TikTokShopOrderExtractor:
                 
             # TikTok API supports up to 50 order IDs per request
             batch_size = 50
+            batches = [order_ids[i:i + batch_size] for i in range(0, len(order_ids), batch_size)]
             all_orders = []
             
-            for i in range(0, len(order_ids), batch_size):
-                batch_ids = order_ids[i:i + batch_size]
-                
-                url = f"{self.base_url}/order/202309/orders"
-                
-                params = {
-                    'app_key': self.auth.app_key,
-                    'timestamp': str(int(time.time())),
-                    'access_token': self.auth.access_token,
-                    'shop_cipher': self.auth.shop_cipher,
-                    'version': '202309',
-                    'order_id_list': ','.join(batch_ids)
-                }
-                
-                # Generate signature
-                signature = self.auth.generate_signature('/order/202309/orders', params)
-                params['sign'] = signature
-                
-                response = requests.get(url, params=params)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('code') == 0:
-                        orders = data.get('data', {}).get('order_list', [])
-                        all_orders.extend(orders)
-                        
-                        logger.info(f"Retrieved details for batch {i//batch_size + 1}, "
-                                  f"orders: {len(orders)}, total: {len(all_orders)}")
-                        
-                        # Rate limiting
-                        time.sleep(0.2)
-                    else:
-                        logger.error(f"API error in get_order_details: {data.get('message')}")
-                else:
-                    logger.error(f"HTTP error in get_order_details: {response.status_code}")
+            # Batches are independent and network-bound -> fetch concurrently (order preserved)
+            with ThreadPoolExecutor(max_workers=self.detail_workers) as executor:
+                for batch_num, orders in enumerate(executor.map(self._fetch_order_details, batches), start=1):
+                    orders = orders or []
+                    all_orders.extend(orders)
+                    
+                    logger.info(f"Retrieved details for batch {batch_num}, "
+                              f"orders: {len(orders)}, total: {len(all_orders)}")
                     
             logger.info(f"Total order details retrieved: {len(all_orders)}")
             return all_orders
@@ -176,17 +269,21 @@ class TikTokShopOrderExtractor:
             
     def extract_orders_for_period(self, 
                                  start_date: datetime, 
-                                 end_date: datetime) -> List[Dict[str, Any]]:
+                                 end_date: datetime,
+                                 time_field: str = 'create_time') -> List[Dict[str, Any]]:
         """
         Extract all orders for a specific time period
         
         Args:
             start_date: Start date
             end_date: End date
+            time_field: Order timestamp the period applies to ('create_time' or 'update_time')
             
         Returns:
             List of order dictionaries
         """
+        self.last_extract_complete = False
+        
         try:
             # Convert to timestamps
             start_timestamp = int(start_date.timestamp())
@@ -194,15 +291,37 @@ class TikTokShopOrderExtractor:
             
             logger.info(f"Extracting orders from {start_date} to {end_date}")
             
-            # Step 1: Search for order IDs
-            order_ids = self.search_orders_for_ids(start_timestamp, end_timestamp)
+            # Search (producer) và fetch details (consumers) chạy chồng lên nhau:
+            # mỗi trang ID được gửi ngay sang thread pool, tối đa 8 batch đang chờ
+            in_flight = threading.BoundedSemaphore(8)
+            futures = []
             
-            if not order_ids:
+            with ThreadPoolExecutor(max_workers=self.detail_workers) as executor:
+                for order_ids in self.iter_order_id_batches(start_timestamp, end_timestamp, time_field=time_field):
+                    # Search page_size mặc định = 50 = giới hạn của order details API
+                    for i in range(0, len(order_ids), 50):
+                        in_flight.acquire()
+                        future = executor.submit(self._fetch_order_details, order_ids[i:i + 50])
+                        future.add_done_callback(lambda _: in_flight.release())
+                        futures.append(future)
+                
+                orders = []
+                failed_batches = 0
+                for future in futures:
+                    batch_orders = future.result()
+                    if batch_orders is None:
+                        failed_batches += 1
+                    else:
+                        orders.extend(batch_orders)
+            
+            self.last_extract_complete = not self._search_failed and failed_batches == 0
+            if not self.last_extract_complete:
+                logger.warning(f"Extract không đầy đủ: search lỗi={self._search_failed}, "
+                               f"batch details lỗi={failed_batches}")
+            
+            if not futures:
                 logger.warning("No order IDs found for the specified period")
                 return []
-                
-            # Step 2: Get detailed order information
-            orders = self.get_order_details_with_ids(order_ids)
             
             logger.info(f"Successfully extracted {len(orders)} orders")
             return orders
@@ -211,12 +330,36 @@ class TikTokShopOrderExtractor:
             logger.error(f"Exception in extract_orders_for_period: {str(e)}")
             return []
             
-    def extract_recent_orders(self, days_back: int = 1) -> List[Dict[str, Any]]:
+    def _read_watermark(self) -> Optional[int]:
+        """Đọc update_time lớn nhất đã ingest (None nếu chưa có)"""
+        try:
+            return int(self._watermark_path.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+            
+    def commit_watermark(self):
+        """
+        Ghi watermark của lần extract gần nhất (gọi sau khi load thành công
+        để lần chạy sau không bỏ sót đơn hàng nếu load thất bại)
+        """
+        if self._pending_watermark is None:
+            return
+            
+        self._watermark_path.parent.mkdir(parents=True, exist_ok=True)
+        self._watermark_path.write_text(str(self._pending_watermark))
+        logger.info(f"Watermark TikTok orders cập nhật: {self._pending_watermark}")
+        self._pending_watermark = None
+        
+    def extract_recent_orders(self, days_back: int = 1, use_watermark: bool = False,
+                              overlap_minutes: int = 0) -> List[Dict[str, Any]]:
         """
         Extract orders from recent days
         
         Args:
             days_back: Number of days to look back
+            use_watermark: Search by update_time, starting from the stored max update_time
+                           (minus overlap) if it is newer than days_back
+            overlap_minutes: Re-read this many minutes before the watermark to catch late-arriving updates
             
         Returns:
             List of order dictionaries
@@ -224,7 +367,24 @@ class TikTokShopOrderExtractor:
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days_back)
         
-        return self.extract_orders_for_period(start_date, end_date)
+        # Incremental: lọc theo update_time để lấy cả đơn cũ vừa được cập nhật
+        time_field = 'update_time' if use_watermark else 'create_time'
+        
+        if use_watermark:
+            watermark = self._read_watermark()
+            if watermark and watermark - overlap_minutes * 60 > start_date.timestamp():
+                start_date = datetime.fromtimestamp(watermark - overlap_minutes * 60)
+                logger.info(f"Incremental từ watermark: {start_date}")
+        
+        orders = self.extract_orders_for_period(start_date, end_date, time_field=time_field)
+        
+        # Chỉ tiến watermark khi extract đầy đủ: nếu có trang/batch lỗi, lần sau đọc lại cả khoảng
+        if use_watermark and orders and self.last_extract_complete:
+            update_times = [int(order['update_time']) for order in orders if order.get('update_time')]
+            if update_times:
+                self._pending_watermark = max(update_times)
+        
+        return orders
         
     def test_api_connection(self) -> bool:
         """
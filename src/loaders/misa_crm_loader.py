@@ -6,12 +6,16 @@ Tích hợp với TikTok Shop Infrastructure - Cấu trúc src/
 """
 
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sqlalchemy import create_engine, text
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from typing import Dict, List, Any, Optional
 import logging
 import sys
 import os
+import threading
+import uuid
 
 # Import shared utilities
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -20,6 +24,41 @@ from src.utils.logging import setup_logging
 
 logger = setup_logging(__name__)
 
+# SQL Server integer types -> pyodbc SQL type constant
+INTEGER_SQL_TYPES = {
+    'bigint': 'SQL_BIGINT',
+    'int': 'SQL_INTEGER',
+    'smallint': 'SQL_SMALLINT',
+    'tinyint': 'SQL_TINYINT'
+}
+
+DATETIME_SQL_TYPES = ('datetime', 'datetime2', 'smalldatetime')
+DECIMAL_SQL_TYPES = ('decimal', 'numeric', 'money', 'smallmoney')
+STRING_SQL_TYPES = ('nvarchar', 'nchar', 'varchar', 'char')
+
+def _bulk_csv_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Chuẩn bị DataFrame để ghi CSV cho BULK INSERT: BIT columns -> 1/0
+    (bool và nullable 'boolean'; NULL -> Int8 <NA> -> field rỗng, KEEPNULLS giữ NULL)
+    """
+    csv_df = df.copy()
+    bool_columns = csv_df.select_dtypes(include=['bool', 'boolean']).columns
+    if len(bool_columns):
+        csv_df[bool_columns] = csv_df[bool_columns].astype('Int8')
+    return csv_df
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    """Convert sang Decimal; giá trị null / không parse được -> None (tương tự errors='coerce')"""
+    if value is None or pd.isna(value):
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+# Số rows mỗi batch DELETE trong cleanup_old_data
+CLEANUP_BATCH_SIZE = 10000
+
 class MISACRMLoader:
     """
     MISA CRM Data Loader - Tương tự TikTok Shop Loader pattern
@@ -27,8 +66,6 @@ class MISACRMLoader:
     
     def __init__(self):
         """Khởi tạo MISA CRM Loader"""
-        self.db_engine = create_engine(settings.sql_server_connection_string)
-        
         # Table mapping
         self.table_mappings = {
             'customers': settings.get_misa_crm_table_full_name('customers'),
@@ -38,9 +75,101 @@ class MISACRMLoader:
             'products': settings.get_misa_crm_table_full_name('products')
         }
         
+        # Giới hạn tổng số partition writer đang ghi, dùng chung giữa các bảng load song song
+        # trong load_all_data_to_staging (nếu không: 5 bảng x N partition vượt pool -> pool_timeout)
+        self._partition_slots = threading.BoundedSemaphore(settings.etl_parallel_load_workers)
+        
+        # fast_executemany: pyodbc gửi parameter array 1 lần/chunk thay vì từng row.
+        # pool_size đủ cho: partition writer (bị giới hạn bởi _partition_slots)
+        # + 1 connection/bảng load song song + 1 connection cho query khác
+        self.db_engine = create_engine(
+            settings.sql_server_connection_string,
+            fast_executemany=True,
+            pool_size=settings.etl_parallel_load_workers + len(self.table_mappings) + 1
+        )
+        
+        # Transaction dùng chung khi orchestrator gọi begin()/commit()/rollback()
+        self._connection = None
+        self._transaction = None
+        self._commit_every: Optional[int] = None
+        self._rows_since_commit = 0
+        # Endpoints đã load trong transaction: chưa commit / đã được commit trung gian
+        # (committed_endpoints giữ lại sau rollback() để caller biết phần nào đã nằm trong DB)
+        self._pending_endpoints: List[str] = []
+        self.committed_endpoints: set = set()
+        
+        # Cache metadata columns (non-computed) theo table cho pyodbc fallback
+        self._column_cache: Dict[str, List[Dict[str, Any]]] = {}
+        
+        # pyodbc connection dùng chung cho fallback loader (connect lazily, đóng bằng close())
+        self._pyodbc_conn = None
+        self._pyodbc_lock = threading.Lock()
+        
         logger.info(f"Khởi tạo MISA CRM Loader cho {settings.company_name}")
         logger.info(f"Database: {settings.sql_server_host}")
     
+    def begin(self, commit_every: Optional[int] = None):
+        """
+        Mở một transaction dùng chung cho nhiều lần load (1 log flush thay vì 1 lần/bảng)
+        
+        Args:
+            commit_every: Commit trung gian sau mỗi N records để giới hạn transaction log
+        """
+        if self._transaction is not None:
+            raise RuntimeError("Transaction đã được mở, cần commit() hoặc rollback() trước")
+        
+        self._connection = self.db_engine.connect()
+        self._transaction = self._connection.begin()
+        self._commit_every = commit_every
+        self._rows_since_commit = 0
+        self._pending_endpoints = []
+        self.committed_endpoints = set()
+        logger.info("🔓 Bắt đầu transaction cho MISA CRM loads")
+    
+    def commit(self):
+        """Commit transaction hiện tại và đóng connection"""
+        if self._transaction is None:
+            return
+        
+        try:
+            self._transaction.commit()
+            logger.info("✅ Committed MISA CRM transaction")
+        finally:
+            self._close_transaction()
+    
+    def rollback(self):
+        """Rollback transaction hiện tại và đóng connection"""
+        if self._transaction is None:
+            return
+        
+        try:
+            self._transaction.rollback()
+            logger.warning("↩️ Rolled back MISA CRM transaction")
+        finally:
+            self._close_transaction()
+    
+    def _close_transaction(self):
+        """Giải phóng connection của transaction dùng chung"""
+        self._connection.close()
+        self._connection = None
+        self._transaction = None
+        self._commit_every = None
+        self._rows_since_commit = 0
+        self._pending_endpoints = []
+    
+    def _track_rows_for_commit(self, endpoint: str, row_count: int):
+        """Commit trung gian khi số records trong transaction vượt commit_every"""
+        self._rows_since_commit += row_count
+        self._pending_endpoints.append(endpoint)
+        
+        if self._commit_every and self._rows_since_commit >= self._commit_every:
+            self._transaction.commit()
+            self._transaction = self._connection.begin()
+            self.committed_endpoints.update(self._pending_endpoints)
+            self._pending_endpoints = []
+            logger.info(f"💾 Intermediate commit sau {self._rows_since_commit} records")
+            self._rows_since_commit = 0
+    
     def _get_table_info(self, table_full_name: str) -> Dict[str, Any]:
         """
         Lấy thông tin về table (schema, table name)
@@ -86,7 +215,8 @@ class MISACRMLoader:
             return False
     
     def load_dataframe_to_staging(self, df: pd.DataFrame, endpoint: str, 
-                                 if_exists: str = 'append') -> bool:
+                                 if_exists: str = 'append',
+                                 batch_size: Optional[int] = None) -> bool:
         """
         Load DataFrame vào staging table
         
@@ -94,6 +224,7 @@ class MISACRMLoader:
             df: DataFrame cần load
             endpoint: Tên endpoint
             if_exists: Hành động nếu table đã tồn tại ('append', 'replace', 'fail')
+            batch_size: Số rows mỗi batch insert (default: settings.misa_crm_etl_batch_size)
             
         Returns:
             True nếu thành công
@@ -108,111 +239,370 @@ class MISACRMLoader:
         
         table_full_name = self.table_mappings[endpoint]
         table_info = self._get_table_info(table_full_name)
+        batch_size = batch_size or settings.misa_crm_etl_batch_size
+        
+        # Trong transaction dùng chung: mỗi bảng chạy trong savepoint riêng,
+        # lỗi 1 bảng chỉ rollback bảng đó
+        savepoint = self._connection.begin_nested() if self._transaction is not None else None
         
         try:
-            # Load data using pandas to_sql
-            df.to_sql(
-                name=table_info['table'],
-                con=self.db_engine,
-                schema=table_info['schema'],
-                if_exists=if_exists,
-                index=False,
-                method='multi',
-                chunksize=settings.misa_crm_etl_batch_size
-            )
+            if self._should_bulk_insert(df, if_exists):
+                # Large loads: BULK INSERT từ file CSV (server đọc trực tiếp, không qua TDS parameters)
+                if savepoint is not None:
+                    self._bulk_insert(self._connection, df, table_info)
+                else:
+                    with self.db_engine.begin() as conn:
+                        self._bulk_insert(conn, df, table_info)
+            elif savepoint is None and self._should_parallel_load(df, if_exists):
+                # DataFrame lớn: chia partition, mỗi partition ghi trên 1 connection riêng
+                committed = self._parallel_to_sql(df, table_info, batch_size)
+                if committed is False:
+                    # Một phần partition đã commit -> không fallback để tránh ghi trùng
+                    return False
+            else:
+                # Load data using pandas to_sql
+                df.to_sql(
+                    name=table_info['table'],
+                    con=self._connection if savepoint is not None else self.db_engine,
+                    schema=table_info['schema'],
+                    if_exists=if_exists,
+                    index=False,
+                    chunksize=batch_size
+                )
+            
+            if savepoint is not None:
+                savepoint.commit()
+                self._track_rows_for_commit(endpoint, len(df))
             
             logger.info(f"✅ Loaded {len(df)} records to {table_full_name}")
             return True
             
         except Exception as e:
             logger.error(f"❌ Lỗi khi load data vào {table_full_name}: {e}")
+            if savepoint is not None:
+                # Không fallback pyodbc: nó commit trên connection riêng (ngoài transaction dùng chung,
+                # rollback() không hoàn tác được) và có thể bị block bởi locks transaction đang giữ
+                savepoint.rollback()
+                return False
             # Try alternative loading method for all tables (SQLAlchemy engine issue)
             logger.info(f"🔄 Trying alternative pyodbc loading method for {endpoint}...")
-            return self._load_with_pyodbc(df, table_full_name)
+            return self._load_with_pyodbc(df, table_full_name, batch_size)
+
+    def _should_parallel_load(self, df: pd.DataFrame, if_exists: str) -> bool:
+        """Ghi song song theo partition chỉ khi append và DataFrame vượt ngưỡng"""
+        return (
+            if_exists == 'append'
+            and settings.etl_parallel_load_workers > 1
+            and len(df) > settings.etl_parallel_load_threshold
+        )
 
-    def _load_with_pyodbc(self, df: pd.DataFrame, table_full_name: str) -> bool:
+    def _parallel_to_sql(self, df: pd.DataFrame, table_info: Dict[str, Any],
+                         batch_size: int) -> Optional[bool]:
         """
-        Alternative loading method using pyodbc for composite key tables
+        Chia DataFrame thành các partition liên tiếp và to_sql song song, mỗi partition 1 connection
+        
+        Args:
+            df: DataFrame cần load
+            table_info: Dict chứa schema và table name
+            batch_size: Số rows mỗi batch insert
+            
+        Returns:
+            True nếu tất cả partition thành công, False nếu lỗi sau khi đã có partition commit
+            
+        Raises:
+            Exception của partition lỗi nếu chưa có partition nào commit (caller có thể fallback)
         """
+        workers = settings.etl_parallel_load_workers
+        bounds = [len(df) * i // workers for i in range(workers + 1)]
+        partitions = [df.iloc[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
+        
+        def write_partition(part: pd.DataFrame):
+            # Chờ slot trước khi lấy connection để không chiếm pool khi các bảng khác đang ghi.
+            # engine.begin(): mỗi partition commit/rollback độc lập trên connection riêng từ pool
+            with self._partition_slots, self.db_engine.begin() as conn:
+                part.to_sql(
+                    name=table_info['table'],
+                    con=conn,
+                    schema=table_info['schema'],
+                    if_exists='append',
+                    index=False,
+                    chunksize=batch_size
+                )
+        
+        committed_rows = 0
+        first_error = None
+        
+        with ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+            futures = {executor.submit(write_partition, part): len(part) for part in partitions}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    committed_rows += futures[future]
+                except Exception as e:
+                    first_error = first_error or e
+        
+        if first_error is None:
+            return True
+        if committed_rows == 0:
+            raise first_error
+        
+        logger.error(
+            f"❌ Parallel load {table_info['schema']}.{table_info['table']} lỗi sau khi đã commit "
+            f"{committed_rows}/{len(df)} records: {first_error}"
+        )
+        return False
+
+    def _should_bulk_insert(self, df: pd.DataFrame, if_exists: str) -> bool:
+        """BULK INSERT chỉ dùng khi đã cấu hình thư mục chia sẻ với SQL Server và DataFrame đủ lớn"""
+        return (
+            bool(settings.etl_bulk_insert_dir)
+            and bool(settings.etl_bulk_insert_server_dir)
+            and if_exists == 'append'
+            and len(df) >= settings.etl_bulk_insert_threshold
+        )
+
+    def _bulk_insert(self, conn, df: pd.DataFrame, table_info: Dict[str, Any]):
+        """
+        Load DataFrame bằng BULK INSERT (CSV) qua temp table rồi INSERT ... WITH (TABLOCK)
+        
+        Args:
+            conn: SQLAlchemy connection (đang trong transaction)
+            df: DataFrame cần load
+            table_info: Dict chứa schema và table name
+        """
+        file_name = f"{table_info['table']}_{uuid.uuid4().hex}.csv"
+        local_path = os.path.join(settings.etl_bulk_insert_dir, file_name)
+        server_path = f"{settings.etl_bulk_insert_server_dir.rstrip('/')}/{file_name}"
+        
+        column_list = ', '.join(f"[{col}]" for col in df.columns)
+        target = f"[{table_info['schema']}].[{table_info['table']}]"
+        
+        # BIT columns: BULK INSERT cần 1/0 thay vì True/False
+        csv_df = _bulk_csv_frame(df)
+        
         try:
-            import pyodbc
+            os.makedirs(settings.etl_bulk_insert_dir, exist_ok=True)
+            csv_df.to_csv(local_path, index=False, header=False, encoding='utf-8', na_rep='', lineterminator='\n')
+            
+            conn.execute(text(f"SELECT TOP 0 {column_list} INTO #bulk_src FROM {target}"))
+            conn.execute(text(f"""
+                BULK INSERT #bulk_src FROM '{server_path}'
+                WITH (FORMAT = 'CSV', CODEPAGE = '65001', ROWTERMINATOR = '0x0a', KEEPNULLS, TABLOCK)
+            """))
+            conn.execute(text(f"INSERT INTO {target} WITH (TABLOCK) ({column_list}) SELECT {column_list} FROM #bulk_src"))
+            conn.execute(text("DROP TABLE #bulk_src"))
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
 
-            # Create connection string for pyodbc
-            connection_string = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={settings.sql_server_host},{settings.sql_server_port};"
-                f"DATABASE={settings.sql_server_database};"
-                f"UID={settings.sql_server_username};"
-                f"PWD={settings.sql_server_password};"
-                f"TrustServerCertificate=yes"
-            )
+    def _load_with_pyodbc(self, df: pd.DataFrame, table_full_name: str,
+                          batch_size: int = 1000) -> bool:
+        """
+        Alternative loading method using pyodbc for composite key tables
+        """
+        # Connection pyodbc dùng chung không thread-safe -> các lần fallback chạy tuần tự
+        with self._pyodbc_lock:
+            try:
+                import pyodbc
 
-            connection = pyodbc.connect(connection_string)
-            cursor = connection.cursor()
+                connection = self._get_pyodbc()
+                cursor = connection.cursor()
 
-            # Get table info
-            table_info = self._get_table_info(table_full_name)
-            schema = table_info['schema']
-            table = table_info['table']
+                # Get table info
+                table_info = self._get_table_info(table_full_name)
+                schema = table_info['schema']
+                table = table_info['table']
 
-            # Get table columns (excluding computed columns)
-            cursor.execute(f"""
-                SELECT COLUMN_NAME
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_SCHEMA = '{schema}'
-                AND TABLE_NAME = '{table}'
-                AND COLUMNPROPERTY(OBJECT_ID(TABLE_SCHEMA+'.'+TABLE_NAME), COLUMN_NAME, 'IsComputed') = 0
-                ORDER BY ORDINAL_POSITION
-            """)
+                # Get table columns + SQL types (excluding computed columns)
+                column_meta = self._column_cache.get(table_full_name)
+                if column_meta is None:
+                    cursor.execute("""
+                        SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH,
+                               NUMERIC_PRECISION, NUMERIC_SCALE, DATETIME_PRECISION
+                        FROM INFORMATION_SCHEMA.COLUMNS
+                        WHERE TABLE_SCHEMA = ?
+                        AND TABLE_NAME = ?
+                        AND COLUMNPROPERTY(OBJECT_ID(TABLE_SCHEMA+'.'+TABLE_NAME), COLUMN_NAME, 'IsComputed') = 0
+                        ORDER BY ORDINAL_POSITION
+                    """, schema, table)
+                    column_meta = [
+                        {
+                            'name': row.COLUMN_NAME,
+                            'data_type': row.DATA_TYPE.lower(),
+                            'max_length': row.CHARACTER_MAXIMUM_LENGTH,
+                            'precision': row.NUMERIC_PRECISION,
+                            'scale': row.NUMERIC_SCALE,
+                            'datetime_precision': row.DATETIME_PRECISION
+                        }
+                        for row in cursor.fetchall()
+                    ]
+                    self._column_cache[table_full_name] = column_meta
 
-            db_columns = [row.COLUMN_NAME for row in cursor.fetchall()]
+                # Match DataFrame columns with database columns
+                matching_meta = [meta for meta in column_meta if meta['name'] in df.columns]
+                matching_columns = [meta['name'] for meta in matching_meta]
 
-            # Match DataFrame columns with database columns
-            matching_columns = [col for col in db_columns if col in df.columns]
+                if not matching_columns:
+                    logger.error(f"❌ No matching columns found between DataFrame and {table_full_name}")
+                    return False
+
+                # Prepare insert statement
+                placeholders = ', '.join(['?' for _ in matching_columns])
+                insert_sql = f"INSERT INTO {schema}.{table} ({', '.join(matching_columns)}) VALUES ({placeholders})"
+
+                # Ép kiểu theo SQL type rồi handle NaN values (vectorized, 1 lần cho cả DataFrame)
+                clean_df = self._coerce_for_pyodbc(df.reindex(columns=matching_columns), matching_meta)
+                clean_df = clean_df.astype(object).where(clean_df.notna(), None)
+                rows = clean_df.to_numpy().tolist()
+
+                # Insert data in batches (parameter arrays bind ở tầng ODBC, 1 round-trip/batch)
+                cursor.fast_executemany = True
+                input_sizes = self._get_input_sizes(pyodbc, matching_meta)
+                if input_sizes is not None:
+                    # Khai báo sẵn type/size -> pyodbc không phải tự dò type cho từng parameter
+                    cursor.setinputsizes(input_sizes)
+                total_inserted = 0
+
+                for i in range(0, len(rows), batch_size):
+                    batch_data = rows[i:i+batch_size]
 
-            if not matching_columns:
-                logger.error(f"❌ No matching columns found between DataFrame and {table_full_name}")
+                    # Execute batch insert
+                    cursor.executemany(insert_sql, batch_data)
+                    connection.commit()
+                    total_inserted += len(batch_data)
+
+                    logger.info(f"   Inserted batch {i//batch_size + 1}: {len(batch_data)} rows")
+
+                cursor.close()
+
+                logger.info(f"✅ Successfully loaded {total_inserted} records to {table_full_name} using pyodbc")
+                return True
+
+            except Exception as e:
+                logger.error(f"❌ pyodbc loading failed for {table_full_name}: {e}")
+                self._discard_pyodbc_batch()
                 return False
 
-            # Prepare insert statement
-            placeholders = ', '.join(['?' for _ in matching_columns])
-            insert_sql = f"INSERT INTO {schema}.{table} ({', '.join(matching_columns)}) VALUES ({placeholders})"
+    def _get_pyodbc(self):
+        """Lấy pyodbc connection dùng chung (connect lazily lần đầu, autocommit=False)"""
+        if self._pyodbc_conn is None:
+            import pyodbc
 
-            # Insert data in batches
-            batch_size = 1000
-            total_inserted = 0
+            connection_string = (
+                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+                f"SERVER={settings.sql_server_host},{settings.sql_server_port};"
+                f"DATABASE={settings.sql_server_database};"
+                f"UID={settings.sql_server_username};"
+                f"PWD={settings.sql_server_password};"
+                f"TrustServerCertificate=yes"
+            )
+            self._pyodbc_conn = pyodbc.connect(connection_string, autocommit=False)
 
-            for i in range(0, len(df), batch_size):
-                batch_df = df.iloc[i:i+batch_size]
-                batch_data = []
+        return self._pyodbc_conn
 
-                for _, row in batch_df.iterrows():
-                    row_data = []
-                    for col in matching_columns:
-                        value = row[col] if col in row else None
-                        # Handle NaN values
-                        if pd.isna(value):
-                            row_data.append(None)
-                        else:
-                            row_data.append(value)
-                    batch_data.append(row_data)
+    def _discard_pyodbc_batch(self):
+        """Rollback batch đang dở; connection hỏng thì bỏ để lần sau connect lại"""
+        if self._pyodbc_conn is None:
+            return
 
-                # Execute batch insert
-                cursor.executemany(insert_sql, batch_data)
-                connection.commit()
-                total_inserted += len(batch_data)
+        try:
+            self._pyodbc_conn.rollback()
+        except Exception:
+            self._close_pyodbc()
 
-                logger.info(f"   Inserted batch {i//batch_size + 1}: {len(batch_data)} rows")
+    def _close_pyodbc(self):
+        if self._pyodbc_conn is not None:
+            try:
+                self._pyodbc_conn.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Lỗi khi đóng pyodbc connection: {e}")
+            self._pyodbc_conn = None
 
-            cursor.close()
-            connection.close()
+    def close(self):
+        """Đóng pyodbc connection dùng chung và dispose engine pool"""
+        with self._pyodbc_lock:
+            self._close_pyodbc()
+        self.db_engine.dispose()
 
-            logger.info(f"✅ Successfully loaded {total_inserted} records to {table_full_name} using pyodbc")
-            return True
+    @staticmethod
+    def _coerce_for_pyodbc(df: pd.DataFrame, column_meta: List[Dict[str, Any]]) -> pd.DataFrame:
+        """
+        Ép kiểu từng column theo SQL type (vectorized) để mọi row cùng 1 Python type:
+        pyodbc fast_executemany bind binary theo batch, không phải dò lại type từng row
+        
+        Args:
+            df: DataFrame đã reindex theo matching columns
+            column_meta: Metadata columns từ INFORMATION_SCHEMA (cùng thứ tự với df)
+            
+        Returns:
+            DataFrame đã ép kiểu (copy)
+        """
+        df = df.copy()
+        
+        for meta in column_meta:
+            col = meta['name']
+            data_type = meta['data_type']
+            
+            if data_type in INTEGER_SQL_TYPES:
+                # float64 (do NaN) / string số -> Int64 nullable, gửi integer thay vì float
+                numeric = pd.to_numeric(df[col], errors='coerce')
+                try:
+                    df[col] = numeric.astype('Int64')
+                except (TypeError, ValueError):
+                    # Có giá trị lẻ -> giữ nguyên, để SQL Server tự convert như trước
+                    pass
+            elif data_type in ('float', 'real'):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            elif data_type in DECIMAL_SQL_TYPES:
+                # Decimal(str(v)) giữ đúng giá trị hiển thị, tránh phần đuôi nhị phân của float
+                df[col] = df[col].map(_to_decimal)
+            elif data_type in DATETIME_SQL_TYPES:
+                if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                    df[col] = pd.to_datetime(df[col], errors='coerce')
+                # datetime2 tối đa 7 chữ số thập phân; microsecond là đủ và khớp datetime Python
+                if getattr(df[col].dt, 'tz', None) is not None:
+                    df[col] = df[col].dt.tz_localize(None)
+                df[col] = df[col].dt.floor('us')
+            elif data_type in STRING_SQL_TYPES:
+                df[col] = df[col].astype('string')
+        
+        return df
 
-        except Exception as e:
-            logger.error(f"❌ pyodbc loading failed for {table_full_name}: {e}")
-            return False
+    @staticmethod
+    def _get_input_sizes(pyodbc, column_meta: List[Dict[str, Any]]) -> Optional[List[Any]]:
+        """
+        Build danh sách (sql_type, size, decimals) cho cursor.setinputsizes
+        
+        Returns:
+            List input sizes, hoặc None nếu có column với SQL type chưa hỗ trợ (để pyodbc tự dò)
+        """
+        sizes = []
+        
+        for meta in column_meta:
+            data_type = meta['data_type']
+            
+            if data_type in INTEGER_SQL_TYPES:
+                sizes.append((getattr(pyodbc, INTEGER_SQL_TYPES[data_type]), 0, 0))
+            elif data_type in DECIMAL_SQL_TYPES:
+                sizes.append((pyodbc.SQL_DECIMAL, meta['precision'], meta['scale']))
+            elif data_type in ('float', 'real'):
+                sizes.append((pyodbc.SQL_DOUBLE, 0, 0))
+            elif data_type == 'bit':
+                sizes.append((pyodbc.SQL_BIT, 0, 0))
+            elif data_type == 'date':
+                sizes.append((pyodbc.SQL_TYPE_DATE, 10, 0))
+            elif data_type in DATETIME_SQL_TYPES:
+                # datetime: (23, 3); datetime2(p): (20 + p, p); smalldatetime: (19, 0)
+                decimals = 3 if data_type == 'datetime' else (meta['datetime_precision'] or 0)
+                sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 20 + decimals if decimals else 19, decimals))
+            elif data_type in STRING_SQL_TYPES:
+                # (max) -> CHARACTER_MAXIMUM_LENGTH = -1, size 0 = không giới hạn
+                max_length = meta['max_length'] if meta['max_length'] and meta['max_length'] > 0 else 0
+                sizes.append((pyodbc.SQL_WVARCHAR, max_length, 0))
+            else:
+                return None
+        
+        return sizes
 
     def load_all_data_to_staging(self, transformed_data: Dict[str, pd.DataFrame],
                                 truncate_first: bool = False) -> Dict[str, int]:
@@ -229,6 +619,7 @@ class MISACRMLoader:
         logger.info("Bắt đầu load tất cả data vào staging tables...")
         
         loaded_counts = {}
+        to_load = {}
         
         for endpoint, df in transformed_data.items():
             if df.empty:
@@ -236,24 +627,37 @@ class MISACRMLoader:
                 loaded_counts[endpoint] = 0
                 continue
             
-            try:
-                # Truncate table nếu được yêu cầu
-                if truncate_first:
-                    self.truncate_table(endpoint)
-                
-                # Load data
-                success = self.load_dataframe_to_staging(df, endpoint, if_exists='append')
+            # Truncate table nếu được yêu cầu (chạy tuần tự trước khi load)
+            if truncate_first:
+                self.truncate_table(endpoint)
+            
+            to_load[endpoint] = df
+        
+        # Các table độc lập -> load song song (engine pool cấp connection riêng cho mỗi thread).
+        # Transaction dùng chung (begin()) chỉ có 1 connection nên phải load tuần tự.
+        max_workers = 1 if self._transaction is not None else max(len(to_load), 1)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.load_dataframe_to_staging, df, endpoint, 'append'): endpoint
+                for endpoint, df in to_load.items()
+            }
+            
+            for future in as_completed(futures):
+                endpoint = futures[future]
+                rows = len(to_load[endpoint])
                 
-                if success:
-                    loaded_counts[endpoint] = len(df)
-                    logger.info(f"✅ {endpoint}: {len(df)} records loaded")
-                else:
+                try:
+                    if future.result():
+                        loaded_counts[endpoint] = rows
+                        logger.info(f"✅ {endpoint}: {rows} records loaded")
+                    else:
+                        loaded_counts[endpoint] = 0
+                        logger.error(f"❌ {endpoint}: Load thất bại")
+                    
+                except Exception as e:
+                    logger.error(f"❌ Exception khi load {endpoint}: {e}")
                     loaded_counts[endpoint] = 0
-                    logger.error(f"❌ {endpoint}: Load thất bại")
-                
-            except Exception as e:
-                logger.error(f"❌ Exception khi load {endpoint}: {e}")
-                loaded_counts[endpoint] = 0
         
         total_loaded = sum(loaded_counts.values())
         logger.info(f"✅ Load hoàn thành: {total_loaded} tổng records")
@@ -279,49 +683,82 @@ class MISACRMLoader:
             'validation_passed': True
         }
         
-        for endpoint, expected_count in loaded_counts.items():
-            if endpoint not in self.table_mappings:
-                continue
-            
-            table_full_name = self.table_mappings[endpoint]
-            
-            try:
-                with self.db_engine.connect() as conn:
-                    # Count records in table
-                    result = conn.execute(text(f"SELECT COUNT(*) FROM {table_full_name}"))
-                    actual_count = result.fetchone()[0]
-                    
-                    # Check latest ETL batch
-                    result = conn.execute(text(f"SELECT MAX(etl_created_at) FROM {table_full_name}"))
-                    latest_etl_time = result.fetchone()[0]
-                    
-                    table_validation = {
-                        'expected_count': expected_count,
-                        'actual_count': actual_count,
-                        'count_match': actual_count >= expected_count,  # Allow for existing data
-                        'latest_etl_time': latest_etl_time,
-                        'has_recent_data': latest_etl_time and (datetime.now() - latest_etl_time).total_seconds() < 3600  # Within 1 hour
-                    }
-                    
-                    validation_results['table_validations'][endpoint] = table_validation
-                    validation_results['total_actual_records'] += actual_count
-                    
-                    if not table_validation['count_match'] or not table_validation['has_recent_data']:
-                        validation_results['validation_passed'] = False
-                    
-                    logger.info(f"📊 {endpoint}: Expected {expected_count}, Actual {actual_count}, Latest ETL: {latest_etl_time}")
-                    
-            except Exception as e:
-                logger.error(f"❌ Lỗi khi validate {endpoint}: {e}")
-                validation_results['validation_passed'] = False
+        endpoints = [endpoint for endpoint in loaded_counts if endpoint in self.table_mappings]
+        if not endpoints:
+            logger.info("📊 Validation tổng thể: ✅ PASSED")
+            return validation_results
+        
+        # COUNT + MAX của tất cả tables trong 1 round-trip (table names lấy từ settings, không phải user input)
+        union_query = "\nUNION ALL\n".join(
+            f"SELECT '{endpoint}' AS endpoint, COUNT(*) AS actual_count, MAX(etl_created_at) AS latest_etl_time "
+            f"FROM {self.table_mappings[endpoint]}"
+            for endpoint in endpoints
+        )
+        
+        try:
+            with self.db_engine.connect() as conn:
+                rows = {row[0]: (row[1], row[2]) for row in conn.execute(text(union_query)).fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi validate staging tables: {e}")
+            validation_results['validation_passed'] = False
+            for endpoint in endpoints:
                 validation_results['table_validations'][endpoint] = {
                     'error': str(e)
                 }
+            return validation_results
+        
+        for endpoint in endpoints:
+            expected_count = loaded_counts[endpoint]
+            actual_count, latest_etl_time = rows[endpoint]
+            
+            table_validation = {
+                'expected_count': expected_count,
+                'actual_count': actual_count,
+                'count_match': actual_count >= expected_count,  # Allow for existing data
+                'latest_etl_time': latest_etl_time,
+                'has_recent_data': latest_etl_time and (datetime.now() - latest_etl_time).total_seconds() < 3600  # Within 1 hour
+            }
+            
+            validation_results['table_validations'][endpoint] = table_validation
+            validation_results['total_actual_records'] += actual_count
+            
+            if not table_validation['count_match'] or not table_validation['has_recent_data']:
+                validation_results['validation_passed'] = False
+            
+            logger.info(f"📊 {endpoint}: Expected {expected_count}, Actual {actual_count}, Latest ETL: {latest_etl_time}")
         
         logger.info(f"📊 Validation tổng thể: {'✅ PASSED' if validation_results['validation_passed'] else '❌ FAILED'}")
         
         return validation_results
     
+    def _get_table_summary(self, table_full_name: str) -> Dict[str, Any]:
+        """
+        Lấy count, recent count, latest ETL và số batch của 1 table trong 1 query
+        
+        Args:
+            table_full_name: Tên đầy đủ của table (schema.table)
+            
+        Returns:
+            Dict với thông tin tóm tắt của table
+        """
+        with self.db_engine.connect() as conn:
+            result = conn.execute(text(f"""
+                SELECT 
+                    COUNT(*) as total_count,
+                    SUM(CASE WHEN etl_created_at >= DATEADD(day, -1, GETDATE()) THEN 1 ELSE 0 END) as recent_count,
+                    MAX(etl_created_at) as latest_etl,
+                    COUNT(DISTINCT etl_batch_id) as batch_count
+                FROM {table_full_name}
+            """))
+            row = result.fetchone()
+        
+        return {
+            'total_records': row[0],
+            'recent_records_24h': row[1] or 0,
+            'latest_etl_time': row[2],
+            'total_batches': row[3]
+        }
+    
     def get_staging_data_summary(self) -> Dict[str, Any]:
         """
         Lấy tóm tắt dữ liệu trong staging tables
@@ -337,45 +774,27 @@ class MISACRMLoader:
             'total_records': 0
         }
         
-        for endpoint, table_full_name in self.table_mappings.items():
-            try:
-                with self.db_engine.connect() as conn:
-                    # Basic counts
-                    result = conn.execute(text(f"SELECT COUNT(*) FROM {table_full_name}"))
-                    total_count = result.fetchone()[0]
-                    
-                    # Latest ETL info
-                    result = conn.execute(text(f"""
-                        SELECT 
-                            MAX(etl_created_at) as latest_etl,
-                            COUNT(DISTINCT etl_batch_id) as batch_count
-                        FROM {table_full_name}
-                    """))
-                    etl_info = result.fetchone()
-                    
-                    # Recent data (last 24 hours)
-                    result = conn.execute(text(f"""
-                        SELECT COUNT(*) 
-                        FROM {table_full_name} 
-                        WHERE etl_created_at >= DATEADD(day, -1, GETDATE())
-                    """))
-                    recent_count = result.fetchone()[0]
-                    
-                    table_summary = {
-                        'total_records': total_count,
-                        'recent_records_24h': recent_count,
-                        'latest_etl_time': etl_info[0],
-                        'total_batches': etl_info[1]
-                    }
+        # Các table độc lập -> query song song
+        with ThreadPoolExecutor(max_workers=len(self.table_mappings)) as executor:
+            futures = {
+                executor.submit(self._get_table_summary, table_full_name): endpoint
+                for endpoint, table_full_name in self.table_mappings.items()
+            }
+            
+            for future in as_completed(futures):
+                endpoint = futures[future]
+                try:
+                    table_summary = future.result()
                     
                     summary['tables'][endpoint] = table_summary
-                    summary['total_records'] += total_count
+                    summary['total_records'] += table_summary['total_records']
                     
-                    logger.info(f"📊 {endpoint}: {total_count} records, {recent_count} recent")
+                    logger.info(f"📊 {endpoint}: {table_summary['total_records']} records, "
+                                f"{table_summary['recent_records_24h']} recent")
                     
-            except Exception as e:
-                logger.error(f"❌ Lỗi khi lấy summary cho {endpoint}: {e}")
-                summary['tables'][endpoint] = {'error': str(e)}
+                except Exception as e:
+                    logger.error(f"❌ Lỗi khi lấy summary cho {endpoint}: {e}")
+                    summary['tables'][endpoint] = {'error': str(e)}
         
         logger.info(f"📊 Tổng records trong staging: {summary['total_records']}")
         
@@ -399,27 +818,33 @@ class MISACRMLoader:
         deleted_counts = {}
         
         for endpoint, table_full_name in self.table_mappings.items():
+            deleted_count = 0
+            
             try:
                 with self.db_engine.connect() as conn:
-                    # Delete old data
-                    result = conn.execute(text(f"""
-                        DELETE FROM {table_full_name} 
-                        WHERE etl_created_at < DATEADD(day, -{retention_days}, GETDATE())
-                    """))
-                    
-                    deleted_count = result.rowcount
-                    deleted_counts[endpoint] = deleted_count
-                    
-                    conn.commit()
-                    
-                    if deleted_count > 0:
-                        logger.info(f"🗑️ {endpoint}: Đã xóa {deleted_count} records cũ")
-                    else:
-                        logger.info(f"✅ {endpoint}: Không có dữ liệu cũ cần xóa")
+                    # Xóa theo batch nhỏ, commit mỗi batch: giữ row-level lock, log truncate được giữa các batch
+                    while True:
+                        result = conn.execute(text(f"""
+                            DELETE TOP ({CLEANUP_BATCH_SIZE}) FROM {table_full_name}
+                            WHERE etl_created_at < DATEADD(day, -:retention_days, GETDATE())
+                        """), {'retention_days': retention_days})
+                        conn.commit()
+                        
+                        deleted_count += result.rowcount
+                        if result.rowcount < CLEANUP_BATCH_SIZE:
+                            break
+                
+                deleted_counts[endpoint] = deleted_count
+                
+                if deleted_count > 0:
+                    logger.info(f"🗑️ {endpoint}: Đã xóa {deleted_count} records cũ")
+                else:
+                    logger.info(f"✅ {endpoint}: Không có dữ liệu cũ cần xóa")
                     
             except Exception as e:
                 logger.error(f"❌ Lỗi khi cleanup {endpoint}: {e}")
-                deleted_counts[endpoint] = 0
+                # Các batch trước đó đã commit
+                deleted_counts[endpoint] = deleted_count
         
         total_deleted = sum(deleted_counts.values())
         logger.info(f"🗑️ Cleanup hoàn thành: {total_deleted} tổng records đã xóa")
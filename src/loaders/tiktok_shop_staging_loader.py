@@ -7,16 +7,37 @@ import pandas as pd
 import logging
 import sys
 import os
+import uuid
+from sqlalchemy import text
 from typing import Optional, Dict, Any
 
 # Add project root to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-from src.utils.database import db_manager
+from src.utils.database import db_manager, fast_executemany_insert, get_dbapi_connection, iter_row_chunks
 from src.utils.logging import setup_logging
 from config.settings import settings
 
 logger = setup_logging("tiktok_shop_loader")
 
+# Khóa 1 dòng staging (1 line item của 1 đơn hàng) dùng cho MERGE
+MERGE_KEY_COLUMNS = ['order_id', 'item_id', 'item_sku_id']
+# Key columns không bao giờ NULL: so sánh bằng = (index seek được trên target)
+NOT_NULL_KEY_COLUMNS = ['order_id']
+
+# Columns không được âm (chỉ cảnh báo khi validate)
+NON_NEGATIVE_COLUMNS = ['item_quantity']
+
+# pyarrow CSV writer nhanh hơn pandas to_csv nhiều lần; optional, fallback nếu chưa cài
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    pacsv = None
+
+# String dtype dùng khi truncate columns: Arrow-backed (kernel C++) nếu có pyarrow
+STRING_DTYPE = 'string[pyarrow]' if pa is not None else 'string'
+
 class TikTokShopOrderLoader:
     """Tải dữ liệu đơn hàng TikTok Shop vào database staging"""
     
@@ -106,13 +127,47 @@ class TikTokShopOrderLoader:
                 logger.error(f"Unsupported load mode: {load_mode}")
                 return False
                 
-            # Load data into database
-            success = self.db.insert_dataframe(
-                df_prepared,
-                self.staging_table,
-                self.staging_schema,
-                if_exists=load_mode
-            )
+            # Load lớn: BULK INSERT từ file (server đọc trực tiếp, không qua TDS parameters)
+            if load_mode == 'append' and self._should_bulk_load(df_prepared):
+                try:
+                    self._bulk_load_via_file(df_prepared)
+                    logger.info(f"Successfully bulk loaded {len(df_prepared)} rows")
+                    return True
+                except Exception as e:
+                    # Transaction đã rollback -> fallback sang INSERT an toàn
+                    logger.warning(f"BULK INSERT failed, falling back to INSERT: {str(e)}")
+            
+            # Load data into database (pyodbc fast_executemany: 1 round-trip/chunk thay vì 1/row)
+            if load_mode == 'append':
+                # Append: convert sang Python rows từng chunk, không tạo object copy của cả DataFrame
+                success = self.db.append_dataframe_streaming(
+                    df_prepared,
+                    self.staging_table,
+                    self.staging_schema,
+                    chunksize=50000
+                )
+            else:
+                # replace: cần to_sql để tạo lại table
+                success = self.db.insert_dataframe(
+                    df_prepared,
+                    self.staging_table,
+                    self.staging_schema,
+                    if_exists=load_mode,
+                    method=fast_executemany_insert,
+                    chunksize=50000
+                )
+            
+            if not success:
+                # Fallback: multi-row INSERT ... VALUES (chunksize tự tính theo giới hạn parameters).
+                # Lần thử trước chạy trong 1 transaction nên đã rollback, không bị ghi trùng
+                logger.warning("fast_executemany insert failed, retrying with multi-row INSERT")
+                success = self.db.insert_dataframe(
+                    df_prepared,
+                    self.staging_table,
+                    self.staging_schema,
+                    if_exists=load_mode,
+                    method='multi'
+                )
             
             if success:
                 logger.info(f"Successfully loaded {len(df_prepared)} rows")
@@ -127,7 +182,7 @@ class TikTokShopOrderLoader:
             
     def load_incremental_orders(self, df: pd.DataFrame) -> bool:
         """
-        Load orders incrementally (avoiding duplicates)
+        Load orders incrementally (upsert: MERGE từ temp table, không ghi trùng)
         
         Args:
             df: DataFrame with order data
@@ -142,16 +197,88 @@ class TikTokShopOrderLoader:
                 
             logger.info(f"Loading {len(df)} rows incrementally...")
             
-            # For incremental loads, we'll use MERGE logic or check for existing records
-            # For now, we'll use simple append mode and rely on database constraints
-            # to handle duplicates (if any are defined)
+            missing_keys = [col for col in MERGE_KEY_COLUMNS + ['update_time'] if col not in df.columns]
+            if missing_keys:
+                logger.warning(f"Missing merge key columns {missing_keys}, falling back to append")
+                return self.load_orders(df, load_mode='append', validate_before_load=True)
             
-            return self.load_orders(df, load_mode='append', validate_before_load=True)
+            if not self._validate_dataframe(df):
+                logger.error("DataFrame validation failed")
+                return False
+            
+            df_prepared = self._prepare_dataframe_for_load(df)
+            merged_rows = self._merge_orders(df_prepared)
+            
+            logger.info(f"Successfully merged {len(df_prepared)} rows ({merged_rows} inserted/updated)")
+            return True
             
         except Exception as e:
             logger.error(f"Error in incremental load: {str(e)}")
             return False
             
+    def _merge_orders(self, df_prepared: pd.DataFrame) -> int:
+        """
+        Upsert DataFrame vào staging table: fast_executemany vào temp table rồi 1 câu MERGE
+        (dedupe trong batch bằng ROW_NUMBER, chỉ update khi update_time mới hơn hoặc row cũ chưa có update_time)
+        
+        Args:
+            df_prepared: DataFrame đã prepare
+            
+        Returns:
+            Số rows đã insert/update
+        """
+        if not self.db.engine and not self.db.initialize():
+            raise RuntimeError("Failed to initialize database connection")
+        
+        columns = list(df_prepared.columns)
+        column_list = ', '.join(f"[{col}]" for col in columns)
+        target = f"[{self.staging_schema}].[{self.staging_table}]"
+        
+        match_condition = ' AND '.join(
+            f"T.[{col}] = S.[{col}]" if col in NOT_NULL_KEY_COLUMNS
+            else f"(T.[{col}] = S.[{col}] OR (T.[{col}] IS NULL AND S.[{col}] IS NULL))"
+            for col in MERGE_KEY_COLUMNS
+        )
+        update_set = ', '.join(
+            f"T.[{col}] = S.[{col}]" for col in columns
+            if col not in MERGE_KEY_COLUMNS and col not in ('etl_created_at', 'etl_batch_id')
+        )
+        partition_by = ', '.join(f"[{col}]" for col in MERGE_KEY_COLUMNS)
+        
+        merge_sql = f"""
+            WITH ranked AS (
+                SELECT {column_list},
+                       ROW_NUMBER() OVER (PARTITION BY {partition_by} ORDER BY [update_time] DESC) AS rn
+                FROM #tmp_tiktok_orders
+            )
+            MERGE {target} AS T
+            USING (SELECT {column_list} FROM ranked WHERE rn = 1) AS S
+            ON {match_condition}
+            WHEN MATCHED AND (S.[update_time] > T.[update_time] OR T.[update_time] IS NULL) THEN
+                UPDATE SET {update_set}
+            WHEN NOT MATCHED THEN
+                INSERT ({column_list}) VALUES ({', '.join(f"S.[{col}]" for col in columns)});
+        """
+        
+        with self.db.engine.begin() as conn:
+            # Temp table local trên cùng connection của transaction
+            conn.execute(text(f"SELECT TOP 0 {column_list} INTO #tmp_tiktok_orders FROM {target}"))
+            
+            cursor = get_dbapi_connection(conn).cursor()
+            try:
+                cursor.fast_executemany = True
+                insert_sql = f"INSERT INTO #tmp_tiktok_orders ({column_list}) VALUES ({', '.join('?' for _ in columns)})"
+                for rows in iter_row_chunks(df_prepared, 50000):
+                    cursor.executemany(insert_sql, rows)
+            finally:
+                cursor.close()
+            
+            result = conn.execute(text(merge_sql))
+            merged_rows = result.rowcount
+            conn.execute(text("DROP TABLE #tmp_tiktok_orders"))
+        
+        return merged_rows
+            
     def get_load_statistics(self) -> Dict[str, Any]:
         """
         Get statistics about loaded data
@@ -162,23 +289,13 @@ class TikTokShopOrderLoader:
         try:
             stats = {}
             
-            # Get row count
+            # Tất cả thống kê trong 1 query (1 round-trip)
             with self.db.get_connection() as conn:
-                result = conn.execute(
-                    f"SELECT COUNT(*) as row_count FROM [{self.staging_schema}].[{self.staging_table}]"
-                ).fetchone()
-                stats['total_rows'] = result.row_count
-                
-                # Get unique orders count
-                result = conn.execute(
-                    f"SELECT COUNT(DISTINCT order_id) as unique_orders FROM [{self.staging_schema}].[{self.staging_table}]"
-                ).fetchone()
-                stats['unique_orders'] = result.unique_orders
-                
-                # Get date range
-                result = conn.execute(
+                result = conn.exec_driver_sql(
                     f"""
                     SELECT 
+                        COUNT(*) as row_count,
+                        COUNT(DISTINCT order_id) as unique_orders,
                         MIN(create_time) as min_create_time,
                         MAX(create_time) as max_create_time,
                         MIN(etl_created_at) as min_etl_time,
@@ -189,6 +306,8 @@ class TikTokShopOrderLoader:
                 
                 if result:
                     stats.update({
+                        'total_rows': result.row_count,
+                        'unique_orders': result.unique_orders,
                         'min_create_time': result.min_create_time,
                         'max_create_time': result.max_create_time,
                         'min_etl_time': result.min_etl_time,
@@ -202,6 +321,73 @@ class TikTokShopOrderLoader:
             logger.error(f"Error getting load statistics: {str(e)}")
             return {}
             
+    def _should_bulk_load(self, df: pd.DataFrame) -> bool:
+        """BULK INSERT chỉ dùng khi đã cấu hình thư mục chia sẻ với SQL Server và DataFrame đủ lớn"""
+        return (
+            bool(settings.etl_bulk_insert_dir)
+            and bool(settings.etl_bulk_insert_server_dir)
+            and len(df) > settings.etl_bulk_insert_threshold
+        )
+        
+    def _bulk_load_via_file(self, df_prepared: pd.DataFrame):
+        """
+        Load DataFrame bằng BULK INSERT: ghi CSV vào thư mục chia sẻ, BULK INSERT vào temp table
+        rồi INSERT ... WITH (TABLOCK) vào staging table, tất cả trong 1 transaction
+        
+        Args:
+            df_prepared: DataFrame đã prepare
+        """
+        if not self.db.engine and not self.db.initialize():
+            raise RuntimeError("Failed to initialize database connection")
+        
+        file_name = f"{self.staging_table}_{uuid.uuid4().hex}.csv"
+        local_path = os.path.join(settings.etl_bulk_insert_dir, file_name)
+        server_path = f"{settings.etl_bulk_insert_server_dir.rstrip('/')}/{file_name}"
+        
+        column_list = ', '.join(f"[{col}]" for col in df_prepared.columns)
+        target = f"[{self.staging_schema}].[{self.staging_table}]"
+        
+        try:
+            os.makedirs(settings.etl_bulk_insert_dir, exist_ok=True)
+            self._write_bulk_csv(df_prepared, local_path)
+            
+            with self.db.engine.begin() as conn:
+                # Temp table theo đúng thứ tự columns của file, target có thêm columns default
+                conn.execute(text(f"SELECT TOP 0 {column_list} INTO #bulk_src FROM {target}"))
+                conn.execute(text(f"""
+                    BULK INSERT #bulk_src FROM '{server_path}'
+                    WITH (FORMAT = 'CSV', CODEPAGE = '65001', ROWTERMINATOR = '0x0a', KEEPNULLS, TABLOCK, BATCHSIZE = 50000)
+                """))
+                conn.execute(text(f"INSERT INTO {target} WITH (TABLOCK) ({column_list}) SELECT {column_list} FROM #bulk_src"))
+                conn.execute(text("DROP TABLE #bulk_src"))
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            
+    def _write_bulk_csv(self, df: pd.DataFrame, path: str):
+        """
+        Ghi CSV (UTF-8, có quote, không header) cho BULK INSERT.
+        Dùng pyarrow CSV writer (C++, đa luồng) nếu có cài, fallback pandas to_csv
+        """
+        if pacsv is not None:
+            try:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                # datetime2 nhận tối đa 7 chữ số thập phân -> timestamp microsecond
+                for i, field in enumerate(table.schema):
+                    if pa.types.is_timestamp(field.type) and field.type.unit == 'ns':
+                        table = table.set_column(i, field.name, table.column(i).cast(pa.timestamp('us', tz=field.type.tz)))
+                pacsv.write_csv(table, path, write_options=pacsv.WriteOptions(include_header=False))
+                return
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                # Column object nhiều kiểu lẫn lộn -> pyarrow không suy ra được type
+                logger.warning(f"pyarrow CSV writer failed, using pandas to_csv: {str(e)}")
+        
+        # CSV có quote (buyer_message, remark... có thể chứa tab/xuống dòng)
+        df.to_csv(
+            path, index=False, header=False, encoding='utf-8', na_rep='',
+            lineterminator='\n', date_format='%Y-%m-%d %H:%M:%S.%f'
+        )
+            
     def _validate_dataframe(self, df: pd.DataFrame) -> bool:
         """
         Validate DataFrame before loading
@@ -229,18 +415,11 @@ class TikTokShopOrderLoader:
                 logger.error(f"Found {null_order_ids} rows with null order_id")
                 return False
                 
-            # Check data types and ranges
-            numeric_columns = [
-                'original_shipping_fee', 'original_total_product_price',
-                'seller_discount', 'shipping_fee', 'total_amount',
-                'item_quantity', 'item_unit_price'
-            ]
-            
-            for col in numeric_columns:
-                if col in df.columns:
-                    # Check for negative values where they shouldn't be
-                    if col in ['item_quantity'] and (df[col] < 0).any():
-                        logger.warning(f"Found negative values in {col}")
+            # Check for negative values where they shouldn't be (1 lần scan cho mỗi column cần kiểm tra).
+            # to_numeric: column object có None lẫn số thì so sánh trực tiếp sẽ raise TypeError
+            for col in NON_NEGATIVE_COLUMNS:
+                if col in df.columns and (pd.to_numeric(df[col], errors='coerce') < 0).any():
+                    logger.warning(f"Found negative values in {col}")
                         
             logger.info("DataFrame validation passed")
             return True
@@ -260,7 +439,8 @@ class TikTokShopOrderLoader:
             Prepared DataFrame
         """
         try:
-            df_prepared = df.copy()
+            # Shallow copy: chỉ các column bị gán lại mới có data mới, phần còn lại dùng chung với df
+            df_prepared = df.copy(deep=False)
             
             # Ensure proper data types
             # Convert timestamp columns
@@ -283,13 +463,14 @@ class TikTokShopOrderLoader:
                 'item_sku_name': 500
             }
             
+            # String dtype (Arrow-backed nếu có pyarrow) slice vectorized và giữ NULL là <NA> thay vì chuỗi 'None'.
+            # Gán từng column (không dùng assign) để không deep copy cả DataFrame
             for col, max_length in string_columns.items():
                 if col in df_prepared.columns:
-                    df_prepared[col] = df_prepared[col].astype(str).str[:max_length]
-                    
-            # Handle None/NaN values appropriately
-            df_prepared = df_prepared.where(pd.notnull(df_prepared), None)
+                    df_prepared[col] = df_prepared[col].astype(STRING_DTYPE).str.slice(0, max_length)
             
+            # NaN/NA -> NULL do từng đường load tự xử lý (to_sql, CSV na_rep, MERGE temp table),
+            # không cần thêm 1 bản copy object của cả DataFrame ở đây
             return df_prepared
             
         except Exception as e:
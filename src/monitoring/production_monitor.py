@@ -7,13 +7,18 @@ Hệ thống monitoring cho production ETL pipeline
 
 import sys
 import os
-import json
 import time
-import smtplib
+import string
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice, takewhile
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+
+# smtplib / email chỉ import khi thực sự gửi email alert (hầu hết ETL runs không có alert)
 
 # Add project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -24,6 +29,61 @@ from config.settings import settings
 
 logger = setup_logging("production_monitor")
 
+# Session dùng chung cho Slack webhook (keep-alive, không handshake lại mỗi alert)
+_slack_session = requests.Session()
+_slack_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Templates compile 1 lần ở module level cho nội dung alert
+_EMAIL_TEMPLATE = string.Template("""ETL Pipeline Alert
+==================
+
+Time: $ts
+
+Alerts:
+$alert_lines
+
+Recent Metrics:
+- Cycle Duration: ${cycle_duration}s
+- Records Processed: $total_records
+- MISA Success Rate: ${misa_success_rate}%
+- TikTok Success: $tiktok_success
+- Consecutive Failures: $consecutive_failures
+- Consecutive No Data: $consecutive_no_data
+
+Please check the ETL pipeline immediately.
+
+Facolos ETL Monitoring System
+""")
+_ALERT_LINE_TEMPLATE = string.Template("- [$severity] $type: $message")
+_SLACK_TEMPLATE = string.Template("🚨 Facolos ETL Alert - $count alert(s)\n$alert_lines")
+
+# Cửa sổ (giờ) của running aggregates dùng cho performance summary
+AGGREGATE_WINDOW_HOURS = 24
+
+def _format_alert_lines(alerts: List['Alert']) -> str:
+    """1 dòng '[SEVERITY] TYPE: message' cho mỗi alert"""
+    return '\n'.join(
+        _ALERT_LINE_TEMPLATE.substitute(severity=a.severity, type=a.type, message=a.message) for a in alerts
+    )
+
+@dataclass
+class Alert:
+    """Alert đã gửi; __slots__ thay cho dict (history giữ tới 1000 alerts), chỉ giữ các metrics email cần"""
+    __slots__ = (
+        'id', 'timestamp', 'type', 'severity', 'message',
+        'cycle_duration', 'total_records', 'misa_success_rate', 'tiktok_success'
+    )
+    
+    id: str
+    timestamp: datetime
+    type: str
+    severity: str
+    message: str
+    cycle_duration: float
+    total_records: int
+    misa_success_rate: float
+    tiktok_success: bool
+
 class ProductionETLMonitor:
     """
     Production ETL monitoring và alerting system
@@ -32,8 +92,24 @@ class ProductionETLMonitor:
     def __init__(self):
         self.config = ProductionConfig()
         self.thresholds = ProductionConfig.get_performance_thresholds()
-        self.metrics_history = []
-        self.alert_history = []
+        # Bounded deque: append O(1), tự bỏ entry cũ nhất khi đầy
+        self.metrics_history = deque(maxlen=100)
+        self.alert_history = deque(maxlen=1000)
+        
+        # Sliding-window aggregates: success rate 10 cycles gần nhất + tổng 24h cập nhật dần (O(1)/cycle)
+        self._last10_successes = deque(maxlen=10)
+        self._window_24h = deque()  # (timestamp, total_records, cycle_duration, overall_success)
+        self._window_cycles = 0
+        self._window_successes = 0
+        self._window_records = 0
+        self._window_duration = 0.0
+        
+        # Lần gửi gần nhất theo (type, severity) -> chặn alert trùng trong 1 giờ với O(1)
+        self._last_alert_at: Dict[tuple, datetime] = {}
+        
+        # SMTP connection dùng chung cho email alerts (mở lazily, giữ lại giữa các lần gửi)
+        self._smtp: Optional['smtplib.SMTP_SSL'] = None
+        self._smtp_lock = threading.Lock()
         
         # Performance tracking
         self.consecutive_failures = 0
@@ -43,13 +119,16 @@ class ProductionETLMonitor:
     def record_cycle_metrics(self, cycle_results: Dict[str, Any]) -> Dict[str, Any]:
         """Record metrics từ một ETL cycle"""
         
+        misa = cycle_results.get('misa_crm') or {}
+        tiktok_orders = (cycle_results.get('tiktok_shop') or {}).get('orders') or {}
+        
         metrics = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(),  # datetime native, isoformat chỉ khi trả ra ngoài
             'cycle_duration': cycle_results.get('duration_seconds', 0),
             'total_records': cycle_results.get('total_records', 0),
-            'misa_success_count': len([k for k, v in cycle_results.get('misa_crm', {}).items() 
-                                     if isinstance(v, dict) and v.get('status') == 'success']),
-            'tiktok_success': cycle_results.get('tiktok_shop', {}).get('orders', {}).get('status') == 'success',
+            'misa_success_count': sum(1 for v in misa.values()
+                                      if isinstance(v, dict) and v.get('status') == 'success'),
+            'tiktok_success': tiktok_orders.get('status') == 'success',
             'errors': cycle_results.get('errors', []),
             'data_quality_passed': cycle_results.get('data_quality', {}).get('quality_check_passed', False)
         }
@@ -58,12 +137,9 @@ class ProductionETLMonitor:
         metrics['misa_success_rate'] = metrics['misa_success_count'] / 5.0  # 5 MISA endpoints
         metrics['overall_success'] = cycle_results.get('success', False)
         
-        # Store metrics
+        # Store metrics (deque giữ last 100 cycles)
         self.metrics_history.append(metrics)
-        
-        # Keep only last 100 cycles
-        if len(self.metrics_history) > 100:
-            self.metrics_history = self.metrics_history[-100:]
+        self._update_aggregates(metrics)
         
         # Update consecutive counters
         if metrics['overall_success']:
@@ -76,13 +152,40 @@ class ProductionETLMonitor:
         else:
             self.consecutive_failures += 1
         
-        # Check for alerts
-        self._check_alert_conditions(metrics)
+        # Check for alerts: tất cả alerts của cycle gửi chung 1 email / 1 Slack message
+        alerts = self._check_alert_conditions(metrics)
+        if alerts:
+            self._send_alerts_batch(alerts, metrics)
+        
+        # Trả ra ngoài (cycle_results / XCom) với timestamp dạng string như trước
+        return {**metrics, 'timestamp': metrics['timestamp'].isoformat()}
+    
+    def _update_aggregates(self, metrics: Dict[str, Any]):
+        """Cộng cycle mới vào các running aggregates"""
+        self._last10_successes.append(bool(metrics['overall_success']))
+        
+        self._window_24h.append((
+            metrics['timestamp'], metrics['total_records'], metrics['cycle_duration'], bool(metrics['overall_success'])
+        ))
+        self._window_cycles += 1
+        self._window_successes += bool(metrics['overall_success'])
+        self._window_records += metrics['total_records']
+        self._window_duration += metrics['cycle_duration']
         
-        return metrics
+        self._evict_window(metrics['timestamp'])
+    
+    def _evict_window(self, now: datetime):
+        """Trừ các cycle đã ra khỏi cửa sổ 24h (mỗi cycle chỉ bị trừ 1 lần)"""
+        cutoff_time = now - timedelta(hours=AGGREGATE_WINDOW_HOURS)
+        while self._window_24h and self._window_24h[0][0] <= cutoff_time:
+            _, records, duration, success = self._window_24h.popleft()
+            self._window_cycles -= 1
+            self._window_successes -= success
+            self._window_records -= records
+            self._window_duration -= duration
     
-    def _check_alert_conditions(self, metrics: Dict[str, Any]):
-        """Check các điều kiện cần alert"""
+    def _check_alert_conditions(self, metrics: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Check các điều kiện cần alert, trả về danh sách alerts của cycle"""
         
         alerts = []
         
@@ -111,8 +214,8 @@ class ProductionETLMonitor:
             })
         
         # Alert 4: Low success rate
-        if len(self.metrics_history) >= 10:
-            recent_success_rate = sum(m['overall_success'] for m in self.metrics_history[-10:]) / 10
+        if len(self._last10_successes) >= 10:
+            recent_success_rate = sum(self._last10_successes) / len(self._last10_successes)
             if recent_success_rate < 0.8:  # Less than 80% success rate
                 alerts.append({
                     'type': 'RELIABILITY',
@@ -120,80 +223,141 @@ class ProductionETLMonitor:
                     'message': f"Success rate in last 10 cycles: {recent_success_rate*100:.1f}% (below 80% threshold)"
                 })
         
-        # Send alerts
-        for alert in alerts:
-            self._send_alert(alert, metrics)
+        return alerts
     
-    def _send_alert(self, alert: Dict[str, Any], metrics: Dict[str, Any]):
-        """Send alert notification"""
+    def _send_alerts_batch(self, alerts: List[Dict[str, Any]], metrics: Dict[str, Any]):
+        """Ghi nhận alerts của 1 cycle (bỏ alert trùng) rồi gửi 1 email + 1 Slack message cho cả batch"""
         
-        alert_id = f"{alert['type']}_{alert['severity']}_{int(time.time())}"
-        
-        # Avoid duplicate alerts
-        recent_alerts = [a for a in self.alert_history if a['timestamp'] > datetime.now() - timedelta(hours=1)]
-        if any(a['type'] == alert['type'] and a['severity'] == alert['severity'] for a in recent_alerts):
-            return  # Skip duplicate alert
-        
-        # Record alert
-        alert_record = {
-            'id': alert_id,
-            'timestamp': datetime.now(),
-            'type': alert['type'],
-            'severity': alert['severity'],
-            'message': alert['message'],
-            'metrics': metrics
-        }
-        self.alert_history.append(alert_record)
+        records = [record for record in (self._record_alert(alert, metrics) for alert in alerts) if record is not None]
+        if not records:
+            return
         
         # Send email alert
         if ProductionConfig.ENABLE_EMAIL_ALERTS:
-            self._send_email_alert(alert_record)
+            self._send_email_alert(records)
         
         # Send Slack alert (if configured)
         if ProductionConfig.ENABLE_SLACK_ALERTS:
-            self._send_slack_alert(alert_record)
+            self._send_slack_alert(records)
+    
+    def _record_alert(self, alert: Dict[str, Any], metrics: Dict[str, Any]) -> Optional['Alert']:
+        """Ghi alert vào history; trả về None nếu cùng (type, severity) đã alert trong 1 giờ qua"""
+        
+        # Avoid duplicate alerts
+        key = (alert['type'], alert['severity'])
+        now = datetime.now()
+        if key in self._last_alert_at and now - self._last_alert_at[key] < timedelta(hours=1):
+            return  # Skip duplicate alert
+        self._last_alert_at[key] = now
+        
+        alert_id = f"{alert['type']}_{alert['severity']}_{int(time.time())}"
+        
+        # Record alert
+        alert_record = Alert(
+            id=alert_id,
+            timestamp=now,
+            type=alert['type'],
+            severity=alert['severity'],
+            message=alert['message'],
+            cycle_duration=metrics['cycle_duration'],
+            total_records=metrics['total_records'],
+            misa_success_rate=metrics['misa_success_rate'],
+            tiktok_success=metrics['tiktok_success']
+        )
+        self.alert_history.append(alert_record)
         
         logger.warning(f"🚨 ALERT: {alert['severity']} - {alert['message']}")
+        return alert_record
     
-    def _send_email_alert(self, alert: Dict[str, Any]):
-        """Send email alert"""
+    def _send_email_alert(self, alerts: List['Alert']):
+        """Send 1 email alert cho tất cả alerts của cycle"""
         try:
-            subject = f"🚨 Facolos ETL Alert - {alert['severity']}: {alert['type']}"
-            
-            body = f"""
-            ETL Pipeline Alert
-            ==================
+            # Các alerts cùng cycle dùng chung metrics
+            alert = alerts[0]
+            if len(alerts) == 1:
+                subject = f"🚨 Facolos ETL Alert - {alert.severity}: {alert.type}"
+            else:
+                severities = {a.severity for a in alerts}
+                top_severity = 'CRITICAL' if 'CRITICAL' in severities else alert.severity
+                subject = f"🚨 Facolos ETL Alert - {top_severity}: {len(alerts)} alerts"
             
-            Severity: {alert['severity']}
-            Type: {alert['type']}
-            Time: {alert['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}
+            body = _EMAIL_TEMPLATE.substitute(
+                ts=alert.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                alert_lines=_format_alert_lines(alerts),
+                cycle_duration=f"{alert.cycle_duration:.1f}",
+                total_records=alert.total_records,
+                misa_success_rate=f"{alert.misa_success_rate*100:.1f}",
+                tiktok_success=alert.tiktok_success,
+                consecutive_failures=self.consecutive_failures,
+                consecutive_no_data=self.consecutive_no_data
+            )
             
-            Message: {alert['message']}
+            if not ProductionConfig.SMTP_HOST:
+                # Chưa cấu hình SMTP -> chỉ log
+                logger.info(f"📧 Email alert prepared: {subject}")
+                return
             
-            Recent Metrics:
-            - Cycle Duration: {alert['metrics']['cycle_duration']:.1f}s
-            - Records Processed: {alert['metrics']['total_records']}
-            - MISA Success Rate: {alert['metrics']['misa_success_rate']*100:.1f}%
-            - TikTok Success: {alert['metrics']['tiktok_success']}
-            - Consecutive Failures: {self.consecutive_failures}
-            - Consecutive No Data: {self.consecutive_no_data}
+            import smtplib
+            from email.message import EmailMessage
             
-            Please check the ETL pipeline immediately.
+            msg = EmailMessage()
+            msg['Subject'] = subject
+            msg['From'] = ProductionConfig.ALERT_EMAIL_SENDER
+            msg['To'] = ', '.join(ProductionConfig.ALERT_EMAIL_RECIPIENTS)
+            msg.set_content(body)
             
-            Facolos ETL Monitoring System
-            """
+            with self._smtp_lock:
+                try:
+                    self._get_smtp().send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    # Server đóng connection giữa noop() và send -> mở lại và gửi 1 lần nữa
+                    self._smtp = None
+                    self._get_smtp().send_message(msg)
             
-            # Note: Email sending would require SMTP configuration
-            logger.info(f"📧 Email alert prepared: {subject}")
+            logger.info(f"📧 Email alert sent: {subject}")
             
         except Exception as e:
             logger.error(f"❌ Failed to send email alert: {e}")
     
-    def _send_slack_alert(self, alert: Dict[str, Any]):
-        """Send Slack alert"""
+    def _get_smtp(self) -> 'smtplib.SMTP_SSL':
+        """Trả về SMTP connection còn sống (noop() để kiểm tra), connect lại nếu đã bị đóng"""
+        import smtplib
+        
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+        
+        smtp = smtplib.SMTP_SSL(
+            ProductionConfig.SMTP_HOST, ProductionConfig.SMTP_PORT,
+            timeout=ProductionConfig.CONNECTION_TIMEOUT_SECONDS
+        )
+        if ProductionConfig.SMTP_USERNAME:
+            smtp.login(ProductionConfig.SMTP_USERNAME, ProductionConfig.SMTP_PASSWORD)
+        self._smtp = smtp
+        return smtp
+    
+    def _send_slack_alert(self, alerts: List['Alert']):
+        """Send 1 Slack message cho tất cả alerts của cycle"""
         try:
-            # Note: Slack integration would require webhook setup
-            logger.info(f"📱 Slack alert prepared: {alert['type']} - {alert['severity']}")
+            summary = ', '.join(f"{a.type} - {a.severity}" for a in alerts)
+            
+            if not ProductionConfig.SLACK_WEBHOOK_URL:
+                # Chưa cấu hình webhook -> chỉ log
+                logger.info(f"📱 Slack alert prepared: {summary}")
+                return
+            
+            response = _slack_session.post(
+                ProductionConfig.SLACK_WEBHOOK_URL,
+                json={'text': _SLACK_TEMPLATE.substitute(
+                    count=len(alerts), alert_lines=_format_alert_lines(alerts)
+                )},
+                timeout=ProductionConfig.CONNECTION_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            logger.info(f"📱 Slack alert sent: {summary}")
             
         except Exception as e:
             logger.error(f"❌ Failed to send Slack alert: {e}")
@@ -201,19 +365,30 @@ class ProductionETLMonitor:
     def get_performance_summary(self, hours: int = 24) -> Dict[str, Any]:
         """Get performance summary cho last N hours"""
         
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        recent_metrics = [
-            m for m in self.metrics_history 
-            if datetime.fromisoformat(m['timestamp']) > cutoff_time
-        ]
+        now = datetime.now()
+        cutoff_time = now - timedelta(hours=hours)
         
-        if not recent_metrics:
-            return {'error': 'No metrics available for the specified period'}
+        if hours == AGGREGATE_WINDOW_HOURS:
+            # Cửa sổ 24h: dùng running aggregates, không duyệt lại history
+            self._evict_window(now)
+            total_cycles = self._window_cycles
+            successful_cycles = self._window_successes
+            total_records = self._window_records
+            total_duration = self._window_duration
+        else:
+            # metrics_history append theo thứ tự thời gian -> duyệt ngược 1 lượt, dừng ở entry đầu tiên quá cutoff
+            total_cycles = successful_cycles = total_records = 0
+            total_duration = 0.0
+            for m in reversed(self.metrics_history):
+                if m['timestamp'] <= cutoff_time:
+                    break
+                total_cycles += 1
+                successful_cycles += bool(m['overall_success'])
+                total_records += m['total_records']
+                total_duration += m['cycle_duration']
         
-        total_cycles = len(recent_metrics)
-        successful_cycles = sum(1 for m in recent_metrics if m['overall_success'])
-        total_records = sum(m['total_records'] for m in recent_metrics)
-        avg_duration = sum(m['cycle_duration'] for m in recent_metrics) / total_cycles
+        if not total_cycles:
+            return {'error': 'No metrics available for the specified period'}
         
         return {
             'period_hours': hours,
@@ -222,11 +397,11 @@ class ProductionETLMonitor:
             'success_rate': successful_cycles / total_cycles * 100,
             'total_records_processed': total_records,
             'avg_records_per_cycle': total_records / total_cycles if total_cycles > 0 else 0,
-            'avg_cycle_duration': avg_duration,
+            'avg_cycle_duration': total_duration / total_cycles,
             'consecutive_failures': self.consecutive_failures,
             'consecutive_no_data': self.consecutive_no_data,
             'last_successful_run': self.last_successful_run.isoformat() if self.last_successful_run else None,
-            'alert_count': len([a for a in self.alert_history if a['timestamp'] > cutoff_time])
+            'alert_count': sum(1 for _ in takewhile(lambda a: a.timestamp > cutoff_time, reversed(self.alert_history)))
         }
     
     def generate_health_report(self) -> Dict[str, Any]:
@@ -249,12 +424,12 @@ class ProductionETLMonitor:
             'summary_1h': summary_1h,
             'recent_alerts': [
                 {
-                    'type': a['type'],
-                    'severity': a['severity'],
-                    'message': a['message'],
-                    'timestamp': a['timestamp'].isoformat()
+                    'type': a.type,
+                    'severity': a.severity,
+                    'message': a.message,
+                    'timestamp': a.timestamp.isoformat()
                 }
-                for a in self.alert_history[-10:]  # Last 10 alerts
+                for a in list(islice(reversed(self.alert_history), 10))[::-1]  # Last 10 alerts
             ],
             'system_info': {
                 'environment': 'production',
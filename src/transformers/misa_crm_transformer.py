@@ -5,7 +5,10 @@ MISA CRM Data Transformer
 Tích hợp với TikTok Shop Infrastructure - Cấu trúc src/
 """
 
+import multiprocessing
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 import logging
@@ -19,6 +22,115 @@ from src.utils.logging import setup_logging
 
 logger = setup_logging(__name__)
 
+# pyarrow cast string -> float nhanh hơn pd.to_numeric nhiều lần; optional, fallback nếu chưa cài
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+# MISA trả date dạng ISO 8601: khai báo format để parse bằng fast path C thay vì đoán từng giá trị
+# (format='ISO8601' từ pandas 2.0; pandas 1.5 dùng infer_datetime_format)
+if int(pd.__version__.split('.')[0]) >= 2:
+    _DATETIME_FORMAT_KWARGS = {'format': 'ISO8601'}
+else:
+    _DATETIME_FORMAT_KWARGS = {'infer_datetime_format': True}
+
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    """Parse ISO 8601 strings -> datetime (lỗi -> NaT), cache các giá trị lặp lại"""
+    return pd.to_datetime(values, errors='coerce', cache=True, **_DATETIME_FORMAT_KWARGS)
+
+
+def _to_numeric(values: pd.Series) -> pd.Series:
+    """String/object -> float64 (lỗi -> NaN); column toàn string số parse bằng pyarrow cast"""
+    if pc is not None and values.dtype == object:
+        try:
+            arr = pa.array(values, from_pandas=True)
+            if pa.types.is_string(arr.type):
+                parsed = pc.cast(arr, pa.float64(), safe=False)
+                return pd.Series(parsed.to_numpy(zero_copy_only=False), index=values.index, name=values.name)
+        except pa.ArrowException:
+            # Kiểu lẫn lộn / chuỗi không parse được -> để pandas coerce từng giá trị
+            pass
+    return pd.to_numeric(values, errors='coerce')
+
+
+def _constant_column(value: Optional[str], length: int):
+    """Column chỉ có 1 giá trị string -> Categorical (1 byte code/row thay vì 1 object/row)"""
+    if value is None:
+        return None
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[value])
+
+
+# Endpoint -> (tên output trong transform_all_endpoints, transform method)
+ENDPOINT_TRANSFORMS = {
+    'customers': ('customers', 'transform_customers'),
+    'sale_orders': ('sale_orders_flattened', 'transform_sale_orders_flattened'),
+    'contacts': ('contacts', 'transform_contacts'),
+    'stocks': ('stocks', 'transform_stocks'),
+    'products': ('products', 'transform_products')
+}
+
+
+# Item fields (NULL) cho order không có sale_order_product_mappings
+EMPTY_ITEM_FIELDS = [
+    'id', 'product_code', 'unit', 'price', 'amount', 'total',
+    'tax_percent', 'discount_percent', 'stock_name', 'description'
+]
+
+# Columns theo staging tables (sql/staging/create_misa_crm_tables.sql), không gồm etl_*
+CUSTOMER_COLUMNS = (
+    'id', 'account_number', 'account_code', 'account_name', 'account_short_name', 'owner_name',
+    'office_tel', 'office_email', 'website', 'fax', 'billing_address', 'billing_country',
+    'billing_province', 'billing_district', 'billing_ward', 'billing_street', 'billing_code',
+    'shipping_address', 'shipping_country', 'shipping_province', 'shipping_district',
+    'shipping_ward', 'shipping_street', 'shipping_code', 'business_type', 'industry',
+    'annual_revenue', 'tax_code', 'bank_account', 'bank_name', 'debt', 'debt_limit',
+    'number_of_days_owed', 'number_orders', 'order_sales', 'average_order_value',
+    'average_number_of_days_between_purchases', 'number_days_without_purchase',
+    'list_product_category', 'list_product', 'purchase_date_recent', 'purchase_date_first',
+    'customer_since_date', 'last_interaction_date', 'last_visit_date', 'last_call_date',
+    'is_personal', 'gender', 'identification', 'issued_on', 'place_of_issue', 'celebrate_date',
+    'organization_unit_name', 'form_layout', 'rating', 'lead_source', 'sector_name',
+    'no_of_employee_name', 'parent_account_name', 'account_type', 'inactive', 'is_public',
+    'is_distributor', 'is_portal_access', 'portal_username', 'billing_long', 'billing_lat',
+    'shipping_long', 'shipping_lat', 'custom_field13', 'custom_field14', 'description', 'tag',
+    'budget_code', 'total_score', 'number_days_not_interacted', 'related_users', 'created_date',
+    'created_by', 'modified_date', 'modified_by', 'last_modified_date'
+)
+
+CONTACT_COLUMNS = (
+    'id', 'contact_code', 'account_code', 'contact_name', 'first_name', 'last_name', 'salutation',
+    'mobile', 'office_tel', 'other_phone', 'office_email', 'email', 'facebook', 'zalo',
+    'account_name', 'title', 'department', 'account_type', 'mailing_address', 'mailing_country',
+    'mailing_province', 'mailing_district', 'mailing_ward', 'mailing_street', 'mailing_zip',
+    'shipping_address', 'shipping_country', 'shipping_province', 'shipping_district',
+    'shipping_ward', 'shipping_street', 'shipping_zip', 'mailing_long', 'mailing_lat',
+    'shipping_long', 'shipping_lat', 'date_of_birth', 'gender', 'married_status', 'bank_account',
+    'bank_name', 'email_opt_out', 'phone_opt_out', 'lead_source', 'customer_since_date',
+    'organization_unit_name', 'owner_name', 'form_layout', 'inactive', 'total_score',
+    'last_interaction_date', 'last_visit_date', 'last_call_date', 'number_days_not_interacted',
+    'is_public', 'tag', 'related_users', 'description', 'created_date', 'created_by',
+    'modified_date', 'modified_by'
+)
+
+STOCK_COLUMNS = (
+    'stock_code', 'act_database_id', 'async_id', 'stock_name', 'description', 'inactive',
+    'created_date', 'created_by', 'modified_date', 'modified_by'
+)
+
+PRODUCT_COLUMNS = (
+    'id', 'product_code', 'product_name', 'product_category', 'usage_unit', 'description',
+    'sale_description', 'unit_price', 'purchased_price', 'unit_cost', 'unit_price1', 'unit_price2',
+    'unit_price_fixed', 'price_after_tax', 'tax', 'is_use_tax', 'product_properties',
+    'is_follow_serial_number', 'is_set_product', 'quantity_formula', 'default_stock',
+    'warranty_period', 'warranty_description', 'organization_unit_name', 'owner_name',
+    'form_layout', 'source', 'inactive', 'is_public', 'avatar', 'tag', 'created_date', 'created_by',
+    'modified_date', 'modified_by'
+)
+
 class MISACRMTransformer:
     """
     MISA CRM Data Transformer - Tương tự TikTok Shop Transformer pattern
@@ -27,11 +139,14 @@ class MISACRMTransformer:
     def __init__(self):
         """Khởi tạo MISA CRM Transformer"""
         self.batch_id = None
+        self._batch_ts = None
         logger.info(f"Khởi tạo MISA CRM Transformer cho {settings.company_name}")
     
     def set_batch_id(self, batch_id: str):
         """Set batch ID cho transformation session"""
         self.batch_id = batch_id
+        # 1 timestamp cho cả batch: etl_created_at/etl_updated_at khớp nhau giữa các endpoint
+        self._batch_ts = pd.Timestamp(datetime.now())
         logger.info(f"Set batch ID: {batch_id}")
     
     def _add_etl_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -44,11 +159,56 @@ class MISACRMTransformer:
         Returns:
             DataFrame với ETL metadata
         """
-        df = df.copy()
-        df['etl_batch_id'] = self.batch_id
-        df['etl_created_at'] = datetime.now()
-        df['etl_updated_at'] = datetime.now()
-        df['etl_source'] = 'misa_crm_api'
+        # Gán trực tiếp vào df (do transform_* vừa tạo ra), không copy cả frame
+        now = self._batch_ts if self._batch_ts is not None else pd.Timestamp(datetime.now())
+        df['etl_batch_id'] = _constant_column(self.batch_id, len(df))
+        df['etl_created_at'] = now
+        df['etl_updated_at'] = now
+        df['etl_source'] = _constant_column('misa_crm_api', len(df))
+        
+        return df
+    
+    @staticmethod
+    def _convert_types(df: pd.DataFrame, numeric_columns: List[str] = (),
+                       date_columns: List[str] = (), boolean_columns: List[str] = (),
+                       categorical_columns: List[str] = ()) -> pd.DataFrame:
+        """
+        Ép kiểu theo nhóm column: mỗi nhóm 1 lần gán (không loop gán từng column)
+        
+        Args:
+            df: DataFrame cần ép kiểu (sửa trực tiếp)
+            numeric_columns: Columns -> numeric (lỗi -> NaN)
+            date_columns: Columns -> datetime (lỗi -> NaT)
+            boolean_columns: Columns -> nullable boolean (NULL giữ nguyên là <NA>)
+            categorical_columns: Columns string ít giá trị khác nhau -> category
+            
+        Returns:
+            DataFrame đã ép kiểu
+        """
+        present = df.columns.intersection(numeric_columns)
+        if len(present):
+            df[present] = df[present].apply(_to_numeric)
+        
+        present = df.columns.intersection(date_columns)
+        if len(present):
+            df[present] = df[present].apply(_to_datetime)
+        
+        # astype(bool) biến NaN/None thành True -> dùng nullable 'boolean' để giữ NULL
+        present = df.columns.intersection(boolean_columns)
+        if len(present):
+            try:
+                df[present] = df[present].astype('boolean')
+            except (TypeError, ValueError):
+                # Có column chứa giá trị không phải bool-like -> xử lý từng column
+                for col in present:
+                    try:
+                        df[col] = df[col].astype('boolean')
+                    except (TypeError, ValueError):
+                        df[col] = df[col].astype(bool)
+        
+        present = df.columns.intersection(categorical_columns)
+        if len(present):
+            df[present] = df[present].astype('category')
         
         return df
     
@@ -69,7 +229,7 @@ class MISACRMTransformer:
             return pd.DataFrame()
         
         # Convert to DataFrame
-        df = pd.DataFrame(customers_data)
+        df = _records_to_frame(customers_data, CUSTOMER_COLUMNS, 'customers')
         
         # Data type conversions
         numeric_columns = [
@@ -79,10 +239,6 @@ class MISACRMTransformer:
             'billing_long', 'billing_lat', 'shipping_long', 'shipping_lat', 'total_score'
         ]
         
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
         # Date columns
         date_columns = [
             'purchase_date_recent', 'purchase_date_first', 'customer_since_date',
@@ -90,18 +246,12 @@ class MISACRMTransformer:
             'issued_on', 'celebrate_date', 'created_date', 'modified_date', 'last_modified_date'
         ]
         
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         # Boolean columns
         boolean_columns = [
             'is_personal', 'inactive', 'is_public', 'is_distributor', 'is_portal_access'
         ]
         
-        for col in boolean_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(bool, errors='ignore')
+        df = self._convert_types(df, numeric_columns, date_columns, boolean_columns)
         
         # Add ETL metadata
         df = self._add_etl_metadata(df)
@@ -125,56 +275,54 @@ class MISACRMTransformer:
             logger.warning("Không có dữ liệu sale orders để transform")
             return pd.DataFrame()
         
-        flattened_rows = []
+        nested_key = 'sale_order_product_mappings'
+        has_items = np.fromiter((bool(order.get(nested_key)) for order in sale_orders_data),
+                                dtype=bool, count=len(sale_orders_data))
+        orders_with_items = [order for order, flag in zip(sale_orders_data, has_items) if flag]
+        orders_without_items = [order for order, flag in zip(sale_orders_data, has_items) if not flag]
         
-        for order in sale_orders_data:
-            # Tách dữ liệu chính của order (loại bỏ nested data)
-            order_main = {k: v for k, v in order.items() if k != 'sale_order_product_mappings'}
+        frames = []
+        
+        if orders_with_items:
+            # Flatten vectorized: mỗi product item 1 dòng, thông tin order lặp lại theo số item.
+            # max_level=0: giữ nguyên nested value của item như trước, không tách thành 'a.b'
+            item_counts = np.array([len(order[nested_key]) for order in orders_with_items])
+            
+            order_df = pd.DataFrame(orders_with_items).drop(columns=[nested_key]).add_prefix('order_')
+            order_df = order_df.loc[order_df.index.repeat(item_counts)].reset_index(drop=True)
+            items_df = pd.json_normalize(
+                orders_with_items, record_path=nested_key, record_prefix='item_', max_level=0
+            )
             
-            # Lấy nested product mappings
-            product_mappings = order.get('sale_order_product_mappings', [])
+            items_df = pd.concat([order_df, items_df], axis=1)
             
-            if product_mappings:
-                # Tạo một dòng cho mỗi product item
-                for item in product_mappings:
-                    flattened_row = {}
-                    
-                    # Thêm thông tin chính của order (prefix với order_)
-                    for key, value in order_main.items():
-                        flattened_row[f"order_{key}"] = value
-                    
-                    # Thêm thông tin chi tiết của item (prefix với item_)
-                    for key, value in item.items():
-                        flattened_row[f"item_{key}"] = value
-                    
-                    # Thêm metadata
-                    flattened_row['has_multiple_items'] = len(product_mappings) > 1
-                    flattened_row['total_items_in_order'] = len(product_mappings)
-                    
-                    flattened_rows.append(flattened_row)
-            else:
-                # Order không có items - tạo dòng với item fields = NULL
-                flattened_row = {}
-                
-                # Thêm thông tin chính của order
-                for key, value in order_main.items():
-                    flattened_row[f"order_{key}"] = value
-                
-                # Thêm item fields với giá trị NULL
-                item_fields = [
-                    'id', 'product_code', 'unit', 'price', 'amount', 'total',
-                    'tax_percent', 'discount_percent', 'stock_name', 'description'
-                ]
-                for field in item_fields:
-                    flattened_row[f"item_{field}"] = None
-                
-                # Thêm metadata
-                flattened_row['has_multiple_items'] = False
-                flattened_row['total_items_in_order'] = 0
-                
-                flattened_rows.append(flattened_row)
-        
-        df = pd.DataFrame(flattened_rows)
+            # Thêm metadata
+            items_df['has_multiple_items'] = np.repeat(item_counts > 1, item_counts)
+            items_df['total_items_in_order'] = np.repeat(item_counts, item_counts)
+            frames.append(items_df)
+        
+        if orders_without_items:
+            # Order không có items - tạo dòng với item fields = NULL
+            empty_df = pd.DataFrame(orders_without_items).drop(columns=[nested_key], errors='ignore')
+            empty_df = empty_df.add_prefix('order_')
+            for field in EMPTY_ITEM_FIELDS:
+                empty_df[f"item_{field}"] = None
+            
+            # Thêm metadata
+            empty_df['has_multiple_items'] = False
+            empty_df['total_items_in_order'] = 0
+            frames.append(empty_df)
+        
+        if len(frames) == 1:
+            df = frames[0]
+        else:
+            # Giữ thứ tự order như input: sắp xếp lại theo vị trí order gốc (stable -> items giữ thứ tự)
+            df = pd.concat(frames, ignore_index=True)
+            positions = np.concatenate([
+                np.repeat(np.flatnonzero(has_items), item_counts),
+                np.flatnonzero(~has_items)
+            ])
+            df = df.iloc[np.argsort(positions, kind='stable')].reset_index(drop=True)
         
         if df.empty:
             logger.warning("DataFrame rỗng sau khi flatten")
@@ -188,10 +336,6 @@ class MISACRMTransformer:
             'order_exchange_rate'
         ]
         
-        for col in order_numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
         # Data type conversions cho item fields
         item_numeric_columns = [
             'item_price', 'item_amount', 'item_usage_unit_amount', 'item_usage_unit_price',
@@ -202,10 +346,6 @@ class MISACRMTransformer:
             'item_ratio', 'item_custom_field1', 'item_produced_quantity', 'item_quantity_ordered'
         ]
         
-        for col in item_numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
         # Date columns
         order_date_columns = [
             'order_sale_order_date', 'order_due_date', 'order_book_date',
@@ -213,22 +353,24 @@ class MISACRMTransformer:
             'order_invoice_date', 'order_production_date'
         ]
         
-        for col in order_date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         item_date_columns = ['item_expire_date']
         
-        for col in item_date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         # Boolean columns
         boolean_columns = ['order_is_use_currency', 'item_is_promotion']
         
-        for col in boolean_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(bool, errors='ignore')
+        # Status/đơn vị lặp lại trên mọi dòng item -> category
+        categorical_columns = [
+            'order_status', 'order_delivery_status', 'order_pay_status', 'order_revenue_status',
+            'order_currency_type', 'item_unit', 'item_usage_unit'
+        ]
+        
+        df = self._convert_types(
+            df,
+            order_numeric_columns + item_numeric_columns,
+            order_date_columns + item_date_columns,
+            boolean_columns,
+            categorical_columns
+        )
         
         # Add ETL metadata
         df = self._add_etl_metadata(df)
@@ -243,7 +385,7 @@ class MISACRMTransformer:
         if not contacts_data:
             return pd.DataFrame()
         
-        df = pd.DataFrame(contacts_data)
+        df = _records_to_frame(contacts_data, CONTACT_COLUMNS, 'contacts')
         
         # Data type conversions
         numeric_columns = [
@@ -251,27 +393,16 @@ class MISACRMTransformer:
             'total_score', 'number_days_not_interacted'
         ]
         
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
         # Date columns
         date_columns = [
             'date_of_birth', 'customer_since_date', 'last_interaction_date',
             'last_visit_date', 'last_call_date', 'created_date', 'modified_date'
         ]
         
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         # Boolean columns
         boolean_columns = ['email_opt_out', 'phone_opt_out', 'inactive', 'is_public']
         
-        for col in boolean_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(bool, errors='ignore')
-        
+        df = self._convert_types(df, numeric_columns, date_columns, boolean_columns)
         df = self._add_etl_metadata(df)
         
         logger.info(f"Transform contacts hoàn thành: {len(df)} records")
@@ -284,22 +415,15 @@ class MISACRMTransformer:
         if not stocks_data:
             return pd.DataFrame()
         
-        df = pd.DataFrame(stocks_data)
+        df = _records_to_frame(stocks_data, STOCK_COLUMNS, 'stocks')
         
         # Date columns
         date_columns = ['created_date', 'modified_date']
         
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         # Boolean columns
         boolean_columns = ['inactive']
         
-        for col in boolean_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(bool, errors='ignore')
-        
+        df = self._convert_types(df, date_columns=date_columns, boolean_columns=boolean_columns)
         df = self._add_etl_metadata(df)
         
         logger.info(f"Transform stocks hoàn thành: {len(df)} records")
@@ -312,7 +436,7 @@ class MISACRMTransformer:
         if not products_data:
             return pd.DataFrame()
         
-        df = pd.DataFrame(products_data)
+        df = _records_to_frame(products_data, PRODUCT_COLUMNS, 'products')
         
         # Data type conversions
         numeric_columns = [
@@ -320,27 +444,16 @@ class MISACRMTransformer:
             'unit_price2', 'unit_price_fixed'
         ]
         
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
         # Date columns
         date_columns = ['created_date', 'modified_date']
         
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
         # Boolean columns
         boolean_columns = [
             'price_after_tax', 'is_use_tax', 'is_follow_serial_number',
             'is_set_product', 'inactive', 'is_public'
         ]
         
-        for col in boolean_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(bool, errors='ignore')
-        
+        df = self._convert_types(df, numeric_columns, date_columns, boolean_columns)
         df = self._add_etl_metadata(df)
         
         logger.info(f"Transform products hoàn thành: {len(df)} records")
@@ -361,23 +474,28 @@ class MISACRMTransformer:
         
         logger.info("Bắt đầu transform tất cả endpoint data...")
         
-        transformed_data = {}
-        
-        # Transform từng endpoint
-        if 'customers' in raw_data and raw_data['customers']:
-            transformed_data['customers'] = self.transform_customers(raw_data['customers'])
-        
-        if 'sale_orders' in raw_data and raw_data['sale_orders']:
-            transformed_data['sale_orders_flattened'] = self.transform_sale_orders_flattened(raw_data['sale_orders'])
-        
-        if 'contacts' in raw_data and raw_data['contacts']:
-            transformed_data['contacts'] = self.transform_contacts(raw_data['contacts'])
-        
-        if 'stocks' in raw_data and raw_data['stocks']:
-            transformed_data['stocks'] = self.transform_stocks(raw_data['stocks'])
+        # (tên output, transform method) của các endpoint có data
+        jobs = [
+            (output_name, method_name, raw_data[endpoint])
+            for endpoint, (output_name, method_name) in ENDPOINT_TRANSFORMS.items()
+            if raw_data.get(endpoint)
+        ]
         
-        if 'products' in raw_data and raw_data['products']:
-            transformed_data['products'] = self.transform_products(raw_data['products'])
+        # Các endpoint độc lập, CPU-bound -> mỗi endpoint 1 process.
+        # Process daemon (vd. Celery worker) không được tạo process con -> chạy tuần tự
+        workers = min(settings.etl_transform_workers, len(jobs))
+        if workers > 1 and not multiprocessing.current_process().daemon:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    output_name: executor.submit(_transform_endpoint, method_name, data, batch_id, self._batch_ts)
+                    for output_name, method_name, data in jobs
+                }
+                transformed_data = {output_name: future.result() for output_name, future in futures.items()}
+        else:
+            transformed_data = {
+                output_name: getattr(self, method_name)(data)
+                for output_name, method_name, data in jobs
+            }
         
         # Summary
         total_rows = sum(len(df) for df in transformed_data.values())
@@ -415,18 +533,17 @@ class MISACRMTransformer:
         
         validation_results['unique_orders_in_flattened'] = flattened_df['order_id'].nunique()
         
-        # Count items trong original data
-        for order in original_orders:
-            items = order.get('sale_order_product_mappings', [])
-            validation_results['total_items_original'] += len(items)
-            
-            if len(items) > 1:
-                validation_results['orders_with_multiple_items'] += 1
-            elif len(items) == 0:
-                validation_results['orders_without_items'] += 1
+        # Count items trong original data (chỉ lấy len từng order, đếm bằng numpy)
+        item_counts = np.fromiter(
+            (len(order.get('sale_order_product_mappings') or []) for order in original_orders),
+            dtype=np.int64, count=len(original_orders)
+        )
+        validation_results['total_items_original'] = int(item_counts.sum())
+        validation_results['orders_with_multiple_items'] = int((item_counts > 1).sum())
+        validation_results['orders_without_items'] = int((item_counts == 0).sum())
         
         # Count items trong flattened data
-        validation_results['total_items_flattened'] = len(flattened_df[flattened_df['item_id'].notna()])
+        validation_results['total_items_flattened'] = int(flattened_df['item_id'].notna().sum())
         
         # Validation checks
         checks = [
@@ -445,3 +562,20 @@ class MISACRMTransformer:
         logger.info(f"   Validation: {'✅ PASSED' if validation_results['validation_passed'] else '❌ FAILED'}")
         
         return validation_results
+
+
+def _records_to_frame(records: List[Dict], columns: tuple, endpoint: str) -> pd.DataFrame:
+    """List dict -> DataFrame theo column list cố định (bỏ bước suy luận columns, schema ổn định giữa các batch)"""
+    unknown = records[0].keys() - set(columns)
+    if unknown:
+        logger.warning(f"⚠️ {endpoint}: bỏ qua fields không có trong staging table: {sorted(unknown)}")
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+def _transform_endpoint(method_name: str, data: List[Dict], batch_id: str,
+                        batch_ts: pd.Timestamp) -> pd.DataFrame:
+    """Chạy 1 transform method trong process con (hàm module-level để pickle được)"""
+    transformer = MISACRMTransformer()
+    transformer.batch_id = batch_id
+    transformer._batch_ts = batch_ts
+    return getattr(transformer, method_name)(data)
@@ -3,16 +3,92 @@ Chuyển đổi dữ liệu cho dữ liệu đơn hàng TikTok Shop
 Thực hiện cấu trúc phẳng (Option B) từ notebook
 """
 
+import numpy as np
 import pandas as pd
-import json
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List
 from datetime import datetime
 import uuid
 from src.utils.logging import setup_logging
+from src.utils.json_utils import json_dumps
 
 logger = setup_logging("tiktok_shop_transformer")
 
+# Staging column -> đường dẫn field trong order (json_normalize, max_level=1)
+ORDER_COLUMNS = {
+    'order_id': 'order_id',
+    'order_status': 'order_status',
+    'buyer_message': 'buyer_message',
+    'cancel_reason': 'cancel_reason',
+    'cancel_user': 'cancel_user',
+    'collection_time': 'collection_time',
+    'create_time': 'create_time',
+    'delivery_due_time': 'delivery_due_time',
+    'delivery_time': 'delivery_time',
+    'fulfillment_type': 'fulfillment_type',
+    'order_line_type': 'order_line_type',
+    'payment_method': 'payment_method',
+    'payment_method_name': 'payment_method_name',
+    'remark': 'remark',
+    'request_cancel_reason': 'request_cancel_reason',
+    'split_or_combine_tag': 'split_or_combine_tag',
+    'update_time': 'update_time',
+    'warehouse_id': 'warehouse_id',
+    
+    # Số tiền đơn hàng
+    'currency': 'order_amount.currency',
+    'original_shipping_fee': 'order_amount.original_shipping_fee',
+    'original_total_product_price': 'order_amount.original_total_product_price',
+    'seller_discount': 'order_amount.seller_discount',
+    'shipping_fee': 'order_amount.shipping_fee',
+    'shipping_fee_platform_discount': 'order_amount.shipping_fee_platform_discount',
+    'shipping_fee_seller_discount': 'order_amount.shipping_fee_seller_discount',
+    'subtotal_after_seller_discounts': 'order_amount.subtotal_after_seller_discounts',
+    'tax_amount': 'order_amount.tax_amount',
+    'total_amount': 'order_amount.total_amount',
+    
+    # Thông tin người nhận/giao hàng
+    'recipient_address_detail': 'recipient_address.detail',
+    'recipient_address_region_code': 'recipient_address.region_code',
+    'recipient_address_state': 'recipient_address.state',
+    'recipient_address_city': 'recipient_address.city',
+    'recipient_address_town': 'recipient_address.town',
+    'recipient_address_district': 'recipient_address.district',
+    'recipient_address_zipcode': 'recipient_address.zipcode',
+    'recipient_name': 'recipient_address.name',
+    'recipient_phone': 'recipient_address.phone',
+    'recipient_phone_number': 'recipient_address.phone_number'
+}
+
+ORDER_NUMERIC_COLUMNS = [
+    'original_shipping_fee', 'original_total_product_price', 'seller_discount', 'shipping_fee',
+    'shipping_fee_platform_discount', 'shipping_fee_seller_discount',
+    'subtotal_after_seller_discounts', 'tax_amount', 'total_amount'
+]
+
+# Staging column -> đường dẫn field trong line item
+ITEM_COLUMNS = {
+    'item_id': 'product_id',
+    'item_name': 'product_name',
+    'item_sku_id': 'sku_id',
+    'item_sku_image': 'sku_info.sku_image',
+    'item_sku_name': 'sku_info.sku_name',
+    'item_quantity': 'quantity',
+    'item_unit_price': 'unit_price',
+    'item_currency': 'currency',
+    'item_is_gift': 'is_gift',
+    'item_platform_discount': 'platform_discount',
+    'item_seller_discount': 'seller_discount'
+}
+
+ITEM_NUMERIC_COLUMNS = ['item_unit_price', 'item_platform_discount', 'item_seller_discount']
+
+# Columns ít giá trị khác nhau, lặp lại trên mọi hàng -> category
+CATEGORICAL_COLUMNS = [
+    'order_status', 'fulfillment_type', 'payment_method', 'payment_method_name', 'currency',
+    'item_currency', 'recipient_address_region_code', 'recipient_address_state', 'warehouse_id'
+]
+
 class TikTokShopOrderTransformer:
     """Chuyển đổi dữ liệu đơn hàng TikTok Shop thành định dạng staging phẳng"""
     
@@ -33,34 +109,42 @@ class TikTokShopOrderTransformer:
             if not orders:
                 logger.warning("Không có đơn hàng để chuyển đổi")
                 return pd.DataFrame()
-                
-            flattened_rows = []
             
-            for order in orders:
-                # Trích xuất thông tin cấp đơn hàng
-                order_info = self._extract_order_info(order)
-                
-                # Trích xuất thông tin người nhận
-                recipient_info = self._extract_recipient_info(order)
-                
-                # Trích xuất line items (làm phẳng mỗi item)
-                line_items = order.get('line_items', [])
-                
-                if not line_items:
-                    # Nếu không có line items, tạo một hàng chỉ với thông tin đơn hàng
-                    row = {**order_info, **recipient_info}
-                    row.update(self._get_empty_item_fields())
-                    flattened_rows.append(row)
-                else:
-                    # Tạo một hàng cho mỗi line item
-                    for item in line_items:
-                        item_info = self._extract_item_info(item)
-                        
-                        row = {**order_info, **recipient_info, **item_info}
-                        flattened_rows.append(row)
-                        
-            # Chuyển đổi thành DataFrame
-            df = pd.DataFrame(flattened_rows)
+            # Mỗi line item 1 hàng; đơn hàng không có line items vẫn giữ 1 hàng (item fields NULL)
+            item_counts = np.array([len(order.get('line_items') or []) for order in orders])
+            rows_per_order = np.maximum(item_counts, 1)
+            
+            # Thông tin đơn hàng + số tiền + người nhận: json_normalize tách 'order_amount.*',
+            # 'recipient_address.*' 1 lần cho cả batch, rồi lặp lại theo số hàng của từng đơn
+            order_df = self._select_columns(pd.json_normalize(orders, max_level=1), ORDER_COLUMNS)
+            order_df[ORDER_NUMERIC_COLUMNS] = order_df[ORDER_NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+            order_df = order_df.loc[order_df.index.repeat(rows_per_order)].reset_index(drop=True)
+            
+            # Line items (làm phẳng mỗi item), đặt đúng vào hàng của đơn hàng tương ứng
+            orders_with_items = [order for order, count in zip(orders, item_counts) if count]
+            if orders_with_items:
+                raw_items = pd.json_normalize(orders_with_items, record_path='line_items', max_level=1)
+            else:
+                raw_items = pd.DataFrame()
+            item_df = self._select_columns(raw_items, ITEM_COLUMNS)
+            item_df[ITEM_NUMERIC_COLUMNS] = item_df[ITEM_NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+            item_df['item_quantity'] = np.trunc(
+                pd.to_numeric(item_df['item_quantity'], errors='coerce')
+            ).astype('Int64')
+            
+            # Chuyển đổi sales attributes thành chuỗi JSON
+            if 'sku_info.sales_attributes' in raw_items.columns:
+                item_df['item_sku_sales_attributes'] = raw_items['sku_info.sales_attributes'].map(
+                    lambda attrs: json_dumps(attrs) if isinstance(attrs, list) and attrs else None
+                )
+            else:
+                item_df['item_sku_sales_attributes'] = None
+            
+            item_df.index = np.flatnonzero(np.repeat(item_counts > 0, rows_per_order))
+            item_df = item_df.reindex(range(len(order_df)))
+            
+            df = pd.concat([order_df, item_df], axis=1)
+            df[CATEGORICAL_COLUMNS] = df[CATEGORICAL_COLUMNS].astype('category')
             
             # Thêm metadata ETL
             df = self._add_etl_metadata(df)
@@ -72,128 +156,23 @@ class TikTokShopOrderTransformer:
             logger.error(f"Lỗi chuyển đổi đơn hàng thành DataFrame: {str(e)}")
             return pd.DataFrame()
             
-    def _extract_order_info(self, order: Dict[str, Any]) -> Dict[str, Any]:
-        """Trích xuất thông tin cấp đơn hàng"""
-        order_amount = order.get('order_amount', {})
-        
-        return {
-            'order_id': order.get('order_id'),
-            'order_status': order.get('order_status'),
-            'buyer_message': order.get('buyer_message'),
-            'cancel_reason': order.get('cancel_reason'),
-            'cancel_user': order.get('cancel_user'),
-            'collection_time': order.get('collection_time'),
-            'create_time': order.get('create_time'),
-            'delivery_due_time': order.get('delivery_due_time'),
-            'delivery_time': order.get('delivery_time'),
-            'fulfillment_type': order.get('fulfillment_type'),
-            'order_line_type': order.get('order_line_type'),
-            'payment_method': order.get('payment_method'),
-            'payment_method_name': order.get('payment_method_name'),
-            'remark': order.get('remark'),
-            'request_cancel_reason': order.get('request_cancel_reason'),
-            'split_or_combine_tag': order.get('split_or_combine_tag'),
-            'update_time': order.get('update_time'),
-            'warehouse_id': order.get('warehouse_id'),
-            
-            # Số tiền đơn hàng
-            'currency': order_amount.get('currency'),
-            'original_shipping_fee': self._safe_float(order_amount.get('original_shipping_fee')),
-            'original_total_product_price': self._safe_float(order_amount.get('original_total_product_price')),
-            'seller_discount': self._safe_float(order_amount.get('seller_discount')),
-            'shipping_fee': self._safe_float(order_amount.get('shipping_fee')),
-            'shipping_fee_platform_discount': self._safe_float(order_amount.get('shipping_fee_platform_discount')),
-            'shipping_fee_seller_discount': self._safe_float(order_amount.get('shipping_fee_seller_discount')),
-            'subtotal_after_seller_discounts': self._safe_float(order_amount.get('subtotal_after_seller_discounts')),
-            'tax_amount': self._safe_float(order_amount.get('tax_amount')),
-            'total_amount': self._safe_float(order_amount.get('total_amount'))
-        }
-        
-    def _extract_recipient_info(self, order: Dict[str, Any]) -> Dict[str, Any]:
-        """Trích xuất thông tin người nhận/giao hàng"""
-        recipient = order.get('recipient_address', {})
-        
-        return {
-            'recipient_address_detail': recipient.get('detail'),
-            'recipient_address_region_code': recipient.get('region_code'),
-            'recipient_address_state': recipient.get('state'),
-            'recipient_address_city': recipient.get('city'),
-            'recipient_address_town': recipient.get('town'),
-            'recipient_address_district': recipient.get('district'),
-            'recipient_address_zipcode': recipient.get('zipcode'),
-            'recipient_name': recipient.get('name'),
-            'recipient_phone': recipient.get('phone'),
-            'recipient_phone_number': recipient.get('phone_number')
-        }
-        
-    def _extract_item_info(self, item: Dict[str, Any]) -> Dict[str, Any]:
-        """Trích xuất thông tin line item"""
-        sku_info = item.get('sku_info', {})
-        sales_attributes = sku_info.get('sales_attributes', [])
-        
-        # Chuyển đổi sales attributes thành chuỗi JSON
-        sales_attributes_json = json.dumps(sales_attributes) if sales_attributes else None
-        
-        return {
-            'item_id': item.get('product_id'),
-            'item_name': item.get('product_name'),
-            'item_sku_id': item.get('sku_id'),
-            'item_sku_image': sku_info.get('sku_image'),
-            'item_sku_name': sku_info.get('sku_name'),
-            'item_quantity': self._safe_int(item.get('quantity')),
-            'item_unit_price': self._safe_float(item.get('unit_price')),
-            'item_currency': item.get('currency'),
-            'item_is_gift': item.get('is_gift'),
-            'item_platform_discount': self._safe_float(item.get('platform_discount')),
-            'item_seller_discount': self._safe_float(item.get('seller_discount')),
-            'item_sku_sales_attributes': sales_attributes_json
-        }
-        
-    def _get_empty_item_fields(self) -> Dict[str, Any]:
-        """Lấy các trường item trống cho đơn hàng không có line items"""
-        return {
-            'item_id': None,
-            'item_name': None,
-            'item_sku_id': None,
-            'item_sku_image': None,
-            'item_sku_name': None,
-            'item_quantity': None,
-            'item_unit_price': None,
-            'item_currency': None,
-            'item_is_gift': None,
-            'item_platform_discount': None,
-            'item_seller_discount': None,
-            'item_sku_sales_attributes': None
-        }
+    @staticmethod
+    def _select_columns(raw_df: pd.DataFrame, column_map: Dict[str, str]) -> pd.DataFrame:
+        """Lấy các field theo đường dẫn json_normalize và đổi tên theo staging schema (thiếu -> NULL)"""
+        selected = raw_df.reindex(columns=list(column_map.values()))
+        selected.columns = list(column_map.keys())
+        return selected
         
     def _add_etl_metadata(self, df: pd.DataFrame) -> pd.DataFrame:
         """Add ETL metadata columns"""
         now = datetime.utcnow()
         
-        df['etl_batch_id'] = self.batch_id
+        df['etl_batch_id'] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[self.batch_id])
         df['etl_created_at'] = now
         df['etl_updated_at'] = now
         
         return df
         
-    def _safe_float(self, value: Any) -> Optional[float]:
-        """Safely convert value to float"""
-        if value is None or value == '':
-            return None
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return None
-            
-    def _safe_int(self, value: Any) -> Optional[int]:
-        """Safely convert value to int"""
-        if value is None or value == '':
-            return None
-        try:
-            return int(value)
-        except (ValueError, TypeError):
-            return None
-            
     def validate_dataframe(self, df: pd.DataFrame) -> bool:
         """
         Validate transformed DataFrame
@@ -4,31 +4,51 @@ Based on the working notebook implementation
 """
 
 import hmac
-import hashlib
 import time
-import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-import sys
-import os
 from typing import Dict, Any, Optional
 
-# Add project root to Python path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 from config.settings import settings
+from src.utils.json_utils import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
 
+def api_timestamp() -> str:
+    """Current Unix time in seconds as the string TikTok expects in 'timestamp'"""
+    return str(time.time_ns() // 1_000_000_000)
+
 class TikTokAuthenticator:
     """Handle TikTok Shop API authentication and token management"""
     
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
+        """
+        Args:
+            session: Shared HTTP session (e.g. the extractor's); a pooled keep-alive session is created if omitted
+        """
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+            ))
+        self.session = session
+        
         self.app_key = settings.tiktok_app_key
         self.app_secret = settings.tiktok_app_secret
+        # Encode secret once instead of on every signature
+        self._app_secret_bytes = (self.app_secret or '').encode('utf-8')
         self.access_token = settings.tiktok_access_token
         self.refresh_token = settings.tiktok_refresh_token
         self.shop_cipher = settings.tiktok_shop_cipher
         
+        # Token validity probe result is reused for _token_ttl seconds (tokens live for hours)
+        self._token_verified_at: Optional[float] = None
+        self._token_ttl = 3000
+        
     def generate_signature(self, path: str, params: Dict[str, Any]) -> str:
         """
         Generate HMAC-SHA256 signature for TikTok API requests
@@ -42,25 +62,17 @@ class TikTokAuthenticator:
         """
         # Ensure timestamp is included
         if 'timestamp' not in params:
-            params['timestamp'] = str(int(time.time()))
+            params['timestamp'] = api_timestamp()
             
-        # Sort parameters by key
-        sorted_params = sorted(params.items())
+        # Create string to sign: path + query string of parameters sorted by key
+        # (list comp over a generator: str.join materializes its input anyway)
+        string_to_sign = path + '&'.join([k + '=' + str(v) for k, v in sorted(params.items())])
         
-        # Create query string
-        query_string = '&'.join([f"{k}={v}" for k, v in sorted_params])
+        # Lazy formatting: the string is only rendered when DEBUG is enabled
+        logger.debug("String to sign: %s", string_to_sign)
         
-        # Create string to sign: path + query_string
-        string_to_sign = path + query_string
-        
-        logger.debug(f"String to sign: {string_to_sign}")
-        
-        # Generate HMAC-SHA256 signature
-        signature = hmac.new(
-            self.app_secret.encode('utf-8'),
-            string_to_sign.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        # Generate HMAC-SHA256 signature (one-shot digest, no HMAC object per call)
+        signature = hmac.digest(self._app_secret_bytes, string_to_sign.encode('utf-8'), 'sha256').hex()
         
         return signature
         
@@ -76,7 +88,7 @@ class TikTokAuthenticator:
             
             params = {
                 'app_key': self.app_key,
-                'timestamp': str(int(time.time())),
+                'timestamp': api_timestamp(),
                 'refresh_token': self.refresh_token,
                 'grant_type': 'refresh_token'
             }
@@ -89,10 +101,10 @@ class TikTokAuthenticator:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(url, json=params, headers=headers)
+            response = self.session.post(url, data=json_dumps(params), headers=headers)
             
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 if data.get('code') == 0:
                     # Update tokens
                     self.access_token = data['data']['access_token']
@@ -123,7 +135,7 @@ class TikTokAuthenticator:
             
             params = {
                 'app_key': self.app_key,
-                'timestamp': str(int(time.time())),
+                'timestamp': api_timestamp(),
                 'access_token': self.access_token,
                 'version': '202309'
             }
@@ -132,13 +144,14 @@ class TikTokAuthenticator:
             signature = self.generate_signature('/shop/202309/shops', params)
             params['sign'] = signature
             
-            response = requests.get(url, params=params)
+            response = self.session.get(url, params=params)
             
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 if data.get('code') == 0 and data.get('data', {}).get('shops'):
                     shop_cipher = data['data']['shops'][0]['cipher']
                     self.shop_cipher = shop_cipher
+                    self._token_verified_at = time.monotonic()
                     logger.info(f"Shop cipher retrieved: {shop_cipher}")
                     return shop_cipher
                 else:
@@ -152,6 +165,10 @@ class TikTokAuthenticator:
             logger.error(f"Exception getting shop cipher: {str(e)}")
             return None
             
+    def invalidate(self):
+        """Forget the last successful token check (e.g. after a 401 from the API)"""
+        self._token_verified_at = None
+        
     def ensure_valid_token(self) -> bool:
         """
         Ensure we have a valid access token, refresh if necessary
@@ -159,6 +176,11 @@ class TikTokAuthenticator:
         Returns:
             True if we have a valid token, False otherwise
         """
+        # Token verified recently: skip the HTTPS probe
+        if (self._token_verified_at is not None and self.shop_cipher
+                and time.monotonic() - self._token_verified_at < self._token_ttl):
+            return True
+            
         # Try to get shop cipher as a test of token validity
         if self.get_shop_cipher():
             return True
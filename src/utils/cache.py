@@ -0,0 +1,59 @@
+"""
+Persistent API response cache (SQLite) for repeated paginated GETs during backfill
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Optional
+
+from config.settings import settings
+
+
+class ResponseCache:
+    """Key/value cache with TTL, stored in a single SQLite file"""
+
+    def __init__(self, path: str = None, ttl_seconds: int = None):
+        """
+        Initialize response cache
+
+        Args:
+            path: SQLite file path (default: <ETL_STATE_DIR>/api_cache.sqlite)
+            ttl_seconds: Entry lifetime (default: settings.etl_api_cache_ttl_seconds)
+        """
+        self.path = path or os.path.join(settings.etl_state_dir, 'api_cache.sqlite')
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.etl_api_cache_ttl_seconds
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, body TEXT, expires_at INTEGER)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call keeps the cache safe to share across threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable cache key from request parts"""
+        return hashlib.blake2b('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return cached value, or None if missing/expired"""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT body FROM cache WHERE key = ? AND expires_at > ?", (key, int(time.time()))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any):
+        """Store value with the configured TTL"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, body, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), int(time.time()) + self.ttl_seconds)
+            )
@@ -2,22 +2,28 @@
 Database utilities for SQL Server connections and operations
 """
 
+from __future__ import annotations
+
 import logging
+import threading
 import sqlalchemy as sa
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from contextlib import contextmanager
-from typing import Optional, Dict, Any, List
-import pandas as pd
-import sys
-import os
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
+
+# pandas only appears in annotations here; callers already hold the DataFrames
+if TYPE_CHECKING:
+    import pandas as pd
 
-# Add project root to Python path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Số parameters an toàn cho 1 statement (SQL Server tối đa 2100)
+MSSQL_MAX_PARAMETERS = 2000
+
 class DatabaseManager:
     """Manage SQL Server database connections and operations"""
     
@@ -25,6 +31,10 @@ class DatabaseManager:
         self.connection_string = settings.sql_server_connection_string
         self.engine: Optional[sa.Engine] = None
         self.SessionLocal: Optional[sessionmaker] = None
+        # MISA/TikTok chạy song song trên threads: chỉ 1 thread được tạo engine
+        self._engine_lock = threading.Lock()
+        # (schema, table) lowercased, loaded by table_exists in one query; None = not loaded
+        self._known_tables: Optional[set] = None
         
     def initialize(self) -> bool:
         """
@@ -34,12 +44,22 @@ class DatabaseManager:
             True if successful, False otherwise
         """
         try:
-            self.engine = create_engine(
-                self.connection_string,
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                echo=False
-            )
+            # Engine (và connection pool) tạo 1 lần; gọi initialize() lại chỉ test connection
+            if self.engine is None:
+                with self._engine_lock:
+                    if self.engine is None:
+                        self.engine = create_engine(
+                            self.connection_string,
+                            poolclass=QueuePool,
+                            pool_size=10,
+                            max_overflow=20,
+                            pool_timeout=30,
+                            pool_pre_ping=True,
+                            pool_recycle=1800,
+                            fast_executemany=True,
+                            future=True,
+                            echo=False
+                        )
             
             # Test connection
             with self.engine.connect() as conn:
@@ -103,17 +123,18 @@ class DatabaseManager:
             True if successful, False otherwise
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                sql_content = file.read()
-                
-            # Split by GO statements
-            statements = [stmt.strip() for stmt in sql_content.split('GO') if stmt.strip()]
+            if not self.engine:
+                if not self.initialize():
+                    return False
             
-            with self.get_connection() as conn:
-                for statement in statements:
-                    if statement:
+            # Batches run as they are read; one transaction (single commit) for the whole file
+            try:
+                with open(file_path, 'r', encoding='utf-8') as file, self.engine.begin() as conn:
+                    for statement in iter_sql_batches(file):
                         conn.execute(text(statement))
-                        conn.commit()
+            finally:
+                # Script may create/drop tables
+                self._known_tables = None
                         
             logger.info(f"Successfully executed SQL file: {file_path}")
             return True
@@ -130,15 +151,16 @@ class DatabaseManager:
             True if successful, False otherwise
         """
         try:
-            sql = f"""
-            IF NOT EXISTS (SELECT * FROM sys.schemas WHERE name = '{settings.staging_schema}')
+            sql = """
+            IF NOT EXISTS (SELECT 1 FROM sys.schemas WHERE name = :schema)
             BEGIN
-                EXEC('CREATE SCHEMA {settings.staging_schema}');
+                DECLARE @sql NVARCHAR(300) = N'CREATE SCHEMA ' + QUOTENAME(:schema);
+                EXEC sp_executesql @sql;
             END;
             """
             
             with self.get_connection() as conn:
-                conn.execute(text(sql))
+                conn.execute(text(sql), {"schema": settings.staging_schema})
                 conn.commit()
                 
             logger.info(f"Staging schema '{settings.staging_schema}' ensured")
@@ -162,20 +184,17 @@ class DatabaseManager:
         try:
             schema = schema or settings.staging_schema
             
-            sql = """
-            SELECT COUNT(*) as count
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_SCHEMA = :schema 
-            AND TABLE_NAME = :table_name
-            """
-            
-            with self.get_connection() as conn:
-                result = conn.execute(
-                    text(sql), 
-                    {"schema": schema, "table_name": table_name}
-                ).fetchone()
+            # Load every table name once, then answer from the set
+            if self._known_tables is None:
+                sql = "SELECT TABLE_SCHEMA, TABLE_NAME FROM INFORMATION_SCHEMA.TABLES"
                 
-                return result.count > 0
+                with self.get_connection() as conn:
+                    self._known_tables = {
+                        (row.TABLE_SCHEMA.lower(), row.TABLE_NAME.lower())
+                        for row in conn.execute(text(sql))
+                    }
+            
+            return (schema.lower(), table_name.lower()) in self._known_tables
                 
         except Exception as e:
             logger.error(f"Error checking table existence: {str(e)}")
@@ -210,7 +229,8 @@ class DatabaseManager:
             return False
             
     def insert_dataframe(self, df: pd.DataFrame, table_name: str, 
-                        schema: str = None, if_exists: str = 'append') -> bool:
+                        schema: str = None, if_exists: str = 'append',
+                        method: Any = None, chunksize: Optional[int] = None) -> bool:
         """
         Insert DataFrame into database table
         
@@ -219,6 +239,9 @@ class DatabaseManager:
             table_name: Target table name
             schema: Schema name (optional)
             if_exists: What to do if table exists ('append', 'replace', 'fail')
+            method: pandas to_sql insertion method (None = executemany, sent via the engine's
+                    fast_executemany; 'multi' or a callable such as fast_executemany_insert)
+            chunksize: Rows per insert call (None = all rows at once; với 'multi' tự tính theo giới hạn 2100 parameters)
             
         Returns:
             True if successful, False otherwise
@@ -229,6 +252,15 @@ class DatabaseManager:
             if not self.engine:
                 if not self.initialize():
                     return False
+            
+            # Append vào table có sẵn: executemany trực tiếp trên cursor, bỏ qua bước to_sql
+            # dựng từng row cho SQLAlchemy (to_sql chỉ cần khi phải tạo table)
+            if if_exists == 'append' and method is None and self.table_exists(table_name, schema):
+                return self.append_dataframe_streaming(df, table_name, schema, chunksize=chunksize or 50000)
+            
+            if method == 'multi' and chunksize is None:
+                # SQL Server giới hạn 2100 parameters/statement -> rows/INSERT = 2000 // số columns
+                chunksize = max(1, MSSQL_MAX_PARAMETERS // max(len(df.columns), 1))
                     
             df.to_sql(
                 table_name,
@@ -236,8 +268,11 @@ class DatabaseManager:
                 schema=schema,
                 if_exists=if_exists,
                 index=False,
-                method='multi'
+                method=method,
+                chunksize=chunksize
             )
+            # to_sql may have created/replaced the table
+            self._known_tables = None
             
             logger.info(f"Successfully inserted {len(df)} rows into {schema}.{table_name}")
             return True
@@ -246,5 +281,101 @@ class DatabaseManager:
             logger.error(f"Failed to insert DataFrame into {schema}.{table_name}: {str(e)}")
             return False
 
+    def append_dataframe_streaming(self, df: pd.DataFrame, table_name: str,
+                                  schema: str = None, chunksize: int = 50000) -> bool:
+        """
+        Append DataFrame to an existing table via pyodbc fast_executemany, converting
+        rows to Python values one chunk at a time (to_sql materializes object arrays
+        for the whole DataFrame first). All chunks run in one transaction.
+        
+        Args:
+            df: DataFrame to insert
+            table_name: Target table name
+            schema: Schema name (optional)
+            chunksize: Rows per executemany call
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            schema = schema or settings.staging_schema
+            
+            if not self.engine:
+                if not self.initialize():
+                    return False
+            
+            columns = ', '.join(f"[{col}]" for col in df.columns)
+            placeholders = ', '.join('?' for _ in df.columns)
+            insert_sql = f"INSERT INTO [{schema}].[{table_name}] ({columns}) VALUES ({placeholders})"
+            
+            with self.engine.begin() as conn:
+                cursor = get_dbapi_connection(conn).cursor()
+                try:
+                    cursor.fast_executemany = True
+                    for rows in iter_row_chunks(df, chunksize):
+                        cursor.executemany(insert_sql, rows)
+                finally:
+                    cursor.close()
+            
+            logger.info(f"Successfully inserted {len(df)} rows into {schema}.{table_name}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to insert DataFrame into {schema}.{table_name}: {str(e)}")
+            return False
+
+def iter_sql_batches(lines):
+    """
+    Yield SQL batches from an iterable of script lines, split on lines
+    consisting only of the GO batch separator (case-insensitive)
+    """
+    buffer = []
+    for line in lines:
+        if line.strip().upper() == 'GO':
+            statement = ''.join(buffer).strip()
+            if statement:
+                yield statement
+            buffer.clear()
+        else:
+            buffer.append(line)
+    statement = ''.join(buffer).strip()
+    if statement:
+        yield statement
+
+def get_dbapi_connection(conn):
+    """Raw DBAPI (pyodbc) connection behind a SQLAlchemy Connection (SQLAlchemy 1.4 / 2.x)"""
+    raw_connection = conn.connection
+    return getattr(raw_connection, 'dbapi_connection', None) or raw_connection.connection
+
+def iter_row_chunks(df: pd.DataFrame, chunksize: int):
+    """
+    Yield DataFrame rows as lists of Python value lists, chunk by chunk,
+    with NaN/NA converted to None (only one chunk converted to objects at a time)
+    """
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        yield chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist()
+
+def fast_executemany_insert(pd_table, conn, keys: List[str], data_iter):
+    """
+    pandas to_sql insertion method: one parameterized INSERT sent via pyodbc
+    fast_executemany (whole chunk bound as a parameter array, one round-trip per chunk)
+    
+    Runs on the raw DBAPI connection of the SQLAlchemy connection, so it stays
+    inside the transaction opened by to_sql.
+    """
+    dbapi_connection = get_dbapi_connection(conn)
+    
+    table = f"[{pd_table.schema}].[{pd_table.name}]" if pd_table.schema else f"[{pd_table.name}]"
+    columns = ', '.join(f"[{key}]" for key in keys)
+    placeholders = ', '.join('?' for _ in keys)
+    
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", list(data_iter))
+    finally:
+        cursor.close()
+
 # Global database manager instance
 db_manager = DatabaseManager()
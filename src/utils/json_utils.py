@@ -0,0 +1,26 @@
+"""
+JSON helpers shared by API extractors, transformers and authentication
+"""
+
+import json
+from typing import Any, Union
+
+# orjson (de)serializes much faster than stdlib json; optional, fall back if not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON from bytes or str (e.g. response.content)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> str:
+    """Serialize value to a JSON string (str, not bytes)"""
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value)
@@ -2,16 +2,17 @@
 Logging utilities for the TikTok ETL system
 """
 
+import functools
 import logging
 import logging.handlers
 import os
-import sys
 from datetime import datetime
 
-# Add project root to Python path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 from config.settings import settings
 
+# Log directories already created in this process (skip repeated makedirs)
+_ensured_dirs = set()
+
 def setup_logging(
     name: str = "tiktok_etl",
     log_file: str = None,
@@ -20,6 +21,9 @@ def setup_logging(
     """
     Setup logging configuration
     
+    Call sites should pass arguments lazily (logger.debug("x=%s", value)) so
+    records below the configured level are never formatted.
+    
     Args:
         name: Logger name
         log_file: Log file path (optional)
@@ -52,8 +56,9 @@ def setup_logging(
     if log_file:
         # Ensure log directory exists
         log_dir = os.path.dirname(log_file)
-        if log_dir:
+        if log_dir and log_dir not in _ensured_dirs:
             os.makedirs(log_dir, exist_ok=True)
+            _ensured_dirs.add(log_dir)
             
         file_handler = logging.handlers.RotatingFileHandler(
             log_file,
@@ -66,6 +71,18 @@ def setup_logging(
     
     return logger
 
+def disable_unused_record_fields():
+    """
+    Skip per-record thread/process lookups when LOG_FORMAT never prints them.
+    
+    Changes process-wide logging flags, so only call it from CLI entrypoints
+    (never from modules imported by Airflow/Celery, whose handlers may use them).
+    """
+    if '%(thread' not in settings.log_format:
+        logging.logThreads = False
+    if '%(process)' not in settings.log_format:
+        logging.logProcesses = False
+
 def get_log_file_path(component: str, date: datetime = None) -> str:
     """
     Generate log file path for a component
@@ -80,7 +97,11 @@ def get_log_file_path(component: str, date: datetime = None) -> str:
     if date is None:
         date = datetime.now()
         
-    date_str = date.strftime("%Y%m%d")
-    filename = f"{component}_{date_str}.log"
+    return _log_file_path(component, date.year, date.month, date.day)
+
+@functools.lru_cache(maxsize=64)
+def _log_file_path(component: str, year: int, month: int, day: int) -> str:
+    """Log file path for a component and calendar day (cached)"""
+    filename = f"{component}_{year:04d}{month:02d}{day:02d}.log"
     
     return os.path.join("logs", filename)
@@ -0,0 +1,62 @@
+"""
+Rate limiting utilities shared by API extractors
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """Minimum interval between request starts, shared across threads"""
+
+    def __init__(self, interval: float):
+        """
+        Initialize rate limiter
+
+        Args:
+            interval: Minimum seconds between two requests
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_allowed = 0.0
+
+    def wait(self):
+        """Block until the next request is allowed"""
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_allowed - now
+            self._next_allowed = max(now, self._next_allowed) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class TokenBucket:
+    """Token bucket: sustained `rate` requests/second with bursts up to `capacity`, shared across threads"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialize token bucket
+
+        Args:
+            rate: Tokens added per second (sustained requests/second)
+            capacity: Maximum tokens held (burst size)
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: float = 1):
+        """Take n tokens, blocking until they are available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # Reserve tokens now (balance may go negative) so waiting threads queue fairly
+            self._tokens -= n
+            wait_time = -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+        if wait_time > 0:
+            time.sleep(wait_time)
@@ -0,0 +1,26 @@
+"""
+Tests cho MISA CRM loader: chuẩn bị CSV cho BULK INSERT
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from src.loaders.misa_crm_loader import _bulk_csv_frame
+
+
+def test_bulk_csv_frame_writes_nullable_booleans_as_bit():
+    df = pd.DataFrame({
+        'inactive': pd.array([True, None, False], dtype='boolean'),
+        'is_public': [True, False, True],
+        'account_name': ['A', 'B', None]
+    })
+
+    csv_df = _bulk_csv_frame(df)
+    csv = csv_df.to_csv(index=False, header=False, na_rep='', lineterminator='\n')
+
+    assert csv == "1,1,A\n,0,B\n0,1,\n"
+    # DataFrame gốc không bị sửa
+    assert df['inactive'].dtype == 'boolean'